@@ -1,40 +0,0 @@
-#!/bin/bash
-#
-# Licensed to the Apache Software Foundation (ASF) under one
-# or more contributor license agreements.  See the NOTICE file
-# distributed with this work for additional information
-# regarding copyright ownership.  The ASF licenses this file
-# to you under the Apache License, Version 2.0 (the
-# "License"); you may not use this file except in compliance
-# with the License.  You may obtain a copy of the License at
-#
-#   http://www.apache.org/licenses/LICENSE-2.0
-#
-# Unless required by applicable law or agreed to in writing,
-# software distributed under the License is distributed on an
-# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
-# KIND, either express or implied.  See the License for the
-# specific language governing permissions and limitations
-# under the License.
-
-if [ "$#" -ne 1 ]; then
-    echo "Usage: $0 <project_id>"
-    echo ""
-    echo "Decrypts all encrypted variables from environment and print them"
-    exit 1
-fi
-
-PROJECT_ID=$1
-
-printenv | cut -d "=" -f 1 | grep -e "ENCRYPTED$" | while read key; do
-    val=${!key}
-    decrypted_key=${key%_ENCRYPTED}
-    decrypted_val=$((base64 --decode | gcloud kms decrypt --plaintext-file=-\
-         --ciphertext-file=- \
-         --location=global \
-         --keyring=airflow \
-         --project=$PROJECT_ID \
-         --key=airflow_crypto_key) <<< "$val")
-    echo "${decrypted_key}=${decrypted_val}"
-done
-
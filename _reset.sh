@@ -38,6 +38,6 @@ echo "Resetting the database"
 echo
 airflow db reset -y
 echo
-python ${MY_DIR}/_setup_gcp_connection.py "${GCP_PROJECT_ID}"
+python ${MY_DIR}/_setup_gcp_connection.py --all-keys "${GCP_PROJECT_ID}"
 echo
 source ${MY_DIR}/_create_links.sh
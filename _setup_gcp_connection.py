@@ -15,45 +15,286 @@
 # KIND, either express or implied.  See the License for the
 # specific language governing permissions and limitations
 # under the License.
-"""Writes GCP Connection to the airflow db."""
+"""Writes GCP Connections to the airflow db.
+
+By default only google_cloud_default is pointed at the key selected in the
+environment (GCP_SERVICE_ACCOUNT_KEY_NAME). In bulk mode a connection is also
+created or updated for each key of a mapping file (JSON {conn_id: key file})
+or for each service account key found in the keys directory (the conn_id is
+the name of the key file without extension, for example gcp_bigtable).
+All connections are written in one transaction.
+
+The connection table is written directly with SQLAlchemy Core, reading the
+database URL and fernet key from the environment or the airflow config, which
+takes a fraction of the time needed to import airflow. When that is not
+possible (for example the config uses *_cmd options), the airflow models are
+used instead.
+"""
+import argparse
+import glob
 import json
 import os
 import sys
 
-from airflow.models.connection import Connection
-from airflow import settings
+try:
+    from configparser import RawConfigParser
+except ImportError:
+    from ConfigParser import RawConfigParser
 
 KEYPATH_EXTRA = 'extra__google_cloud_platform__key_path'
 SCOPE_EXTRA = 'extra__google_cloud_platform__scope'
 PROJECT_EXTRA = 'extra__google_cloud_platform__project'
 
-key_file_name = os.environ.get('GCP_SERVICE_ACCOUNT_KEY_NAME')
-home_dir = os.path.expanduser('~')
-full_key_path = os.path.join(home_dir,
-                             "config",
-                             "keys",
-                             key_file_name)
-if not os.path.isfile(full_key_path):
-    print()
-    print('The key file ' + full_key_path + ' is missing!')
-    print()
-    sys.exit(1)
-
-session = settings.Session()
-try:
-    # noinspection PyUnresolvedReferences
-    conn = session.query(Connection).filter(
-      Connection.conn_id == 'google_cloud_default')[0]
-    extras = conn.extra_dejson
-    extras[KEYPATH_EXTRA] = full_key_path
-    print('Setting GCP key file to ' + full_key_path)
-    extras[SCOPE_EXTRA] = 'https://www.googleapis.com/auth/cloud-platform'
-    extras[PROJECT_EXTRA] = sys.argv[1]
-    conn.extra = json.dumps(extras)
-    session.commit()
-except BaseException as e:
-    print('session error' + str(e))
-    session.rollback()
-    raise
-finally:
-    session.close()
+DEFAULT_CONN_ID = 'google_cloud_default'
+CONN_TYPE = 'google_cloud_platform'
+SCOPE = 'https://www.googleapis.com/auth/cloud-platform'
+
+DEFAULT_KEYS_DIR = os.path.join(os.path.expanduser('~'), "config", "keys")
+
+# Airflow options used by the direct writer (the database section is used by
+# newer airflow versions)
+SQL_ALCHEMY_CONN_OPTIONS = [('database', 'sql_alchemy_conn'), ('core', 'sql_alchemy_conn')]
+FERNET_KEY_OPTION = ('core', 'fernet_key')
+
+CREATED = 'created'
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+
+
+def get_extras(extra, key_path, project_id):
+    """Returns the extra JSON of the connection with the GCP fields set.
+
+    Other fields of the existing extra are kept.
+    """
+    extras = json.loads(extra) if extra else {}
+    extras[KEYPATH_EXTRA] = key_path
+    extras[SCOPE_EXTRA] = SCOPE
+    extras[PROJECT_EXTRA] = project_id
+    return extras
+
+
+def discover_key_files(keys_dir):
+    """Returns {conn_id: key path} of the service account keys in keys_dir."""
+    connections = {}
+    for key_path in sorted(glob.glob(os.path.join(keys_dir, '*.json'))):
+        try:
+            with open(key_path) as f:
+                key = json.load(f)
+        except ValueError:
+            continue
+        if isinstance(key, dict) and key.get('type') == 'service_account':
+            connections[os.path.splitext(os.path.basename(key_path))[0]] = \
+                os.path.abspath(key_path)
+    return connections
+
+
+def read_connections_file(connections_file, keys_dir):
+    """Returns {conn_id: key path} of the JSON mapping (relative to keys_dir)."""
+    with open(connections_file) as f:
+        mapping = json.load(f)
+    return {conn_id: os.path.abspath(os.path.join(keys_dir, key_file))
+            for conn_id, key_file in mapping.items()}
+
+
+def upsert_connections(session, connections, project_id):
+    """Creates or updates the connections {conn_id: key path} in the session.
+
+    Each connection is looked up by its conn_id. Returns {conn_id: CREATED,
+    UPDATED or UNCHANGED}. The caller commits the session.
+    """
+    from airflow.models.connection import Connection
+    results = {}
+    for conn_id, key_path in sorted(connections.items()):
+        # noinspection PyUnresolvedReferences
+        conn = session.query(Connection).filter(Connection.conn_id == conn_id).first()
+        if conn is None:
+            session.add(Connection(conn_id=conn_id, conn_type=CONN_TYPE,
+                                   extra=json.dumps(get_extras(None, key_path, project_id))))
+            results[conn_id] = CREATED
+            continue
+        extras = get_extras(conn.extra, key_path, project_id)
+        if conn.extra and extras == json.loads(conn.extra):
+            results[conn_id] = UNCHANGED
+        else:
+            conn.extra = json.dumps(extras)
+            results[conn_id] = UPDATED
+    return results
+
+
+class DirectWriteUnavailable(Exception):
+    """Raised when the connections can only be written with airflow itself."""
+
+
+def get_airflow_config_file():
+    """Returns the config file airflow would use (it may not exist)."""
+    if os.environ.get('AIRFLOW_CONFIG'):
+        return os.path.expanduser(os.environ['AIRFLOW_CONFIG'])
+    airflow_home = os.path.expanduser(os.environ.get('AIRFLOW_HOME', '~/airflow'))
+    return os.path.join(airflow_home, 'airflow.cfg')
+
+
+def get_airflow_option(config, section, key):
+    """Returns the option the same way airflow does - environment variable first."""
+    environment_variable = 'AIRFLOW__{}__{}'.format(section.upper(), key.upper())
+    if environment_variable in os.environ:
+        return os.path.expandvars(os.environ[environment_variable])
+    for suffix in ['_cmd', '_secret']:
+        if 'AIRFLOW__{}__{}{}'.format(section.upper(), key.upper(), suffix.upper()) \
+                in os.environ or config.has_option(section, key + suffix):
+            raise DirectWriteUnavailable("{}{} is used".format(key, suffix))
+    if config.has_option(section, key):
+        return os.path.expanduser(os.path.expandvars(config.get(section, key)))
+    return None
+
+
+def get_fernet(fernet_key):
+    """Returns the same fernet airflow uses to encrypt extras, None if not configured."""
+    if not fernet_key:
+        return None
+    try:
+        from cryptography.fernet import Fernet, MultiFernet
+    except ImportError:
+        raise DirectWriteUnavailable("cryptography is not installed")
+    return MultiFernet([Fernet(key.encode('utf-8')) for key in fernet_key.split(',')])
+
+
+def upsert_connections_directly(db_connection, fernet, connections, project_id):
+    """The same as upsert_connections, using SQL statements of SQLAlchemy Core."""
+    from sqlalchemy import text
+    select_connection = text("SELECT id, extra, is_extra_encrypted FROM connection "
+                             "WHERE conn_id = :conn_id")
+    update_connection = text("UPDATE connection SET extra = :extra, "
+                             "is_extra_encrypted = :is_extra_encrypted WHERE id = :id")
+    insert_connection = text("INSERT INTO connection (conn_id, conn_type, extra, "
+                             "is_encrypted, is_extra_encrypted) VALUES (:conn_id, "
+                             ":conn_type, :extra, :is_encrypted, :is_extra_encrypted)")
+
+    def encrypt(extras):
+        extra = json.dumps(extras)
+        return fernet.encrypt(extra.encode('utf-8')).decode('utf-8') if fernet else extra
+
+    results = {}
+    for conn_id, key_path in sorted(connections.items()):
+        row = db_connection.execute(select_connection, dict(conn_id=conn_id)).fetchone()
+        if row is None:
+            db_connection.execute(insert_connection, dict(
+                conn_id=conn_id, conn_type=CONN_TYPE,
+                extra=encrypt(get_extras(None, key_path, project_id)),
+                is_encrypted=False, is_extra_encrypted=fernet is not None))
+            results[conn_id] = CREATED
+            continue
+        connection_id, extra, is_extra_encrypted = row
+        if extra and is_extra_encrypted:
+            if not fernet:
+                raise DirectWriteUnavailable("Extra of {} is encrypted, but there is no "
+                                             "fernet key".format(conn_id))
+            extra = fernet.decrypt(extra.encode('utf-8')).decode('utf-8')
+        extras = get_extras(extra, key_path, project_id)
+        if extra and extras == json.loads(extra):
+            results[conn_id] = UNCHANGED
+        else:
+            db_connection.execute(update_connection, dict(
+                id=connection_id, extra=encrypt(extras),
+                is_extra_encrypted=fernet is not None))
+            results[conn_id] = UPDATED
+    return results
+
+
+def write_connections_directly(connections, project_id):
+    """Writes the connections in a single transaction without importing airflow.
+
+    Raises DirectWriteUnavailable if airflow has to be used instead.
+    """
+    config = RawConfigParser()
+    config.read(get_airflow_config_file())
+    sql_alchemy_conn = None
+    for section, key in SQL_ALCHEMY_CONN_OPTIONS:
+        sql_alchemy_conn = sql_alchemy_conn or get_airflow_option(config, section, key)
+    if not sql_alchemy_conn:
+        raise DirectWriteUnavailable("sql_alchemy_conn is not configured")
+    fernet = get_fernet(get_airflow_option(config, *FERNET_KEY_OPTION))
+    try:
+        from sqlalchemy import create_engine
+        from sqlalchemy.exc import SQLAlchemyError
+    except ImportError:
+        raise DirectWriteUnavailable("sqlalchemy is not installed")
+    engine = create_engine(sql_alchemy_conn)
+    try:
+        with engine.begin() as db_connection:
+            return upsert_connections_directly(db_connection, fernet, connections,
+                                               project_id)
+    except SQLAlchemyError as e:
+        raise DirectWriteUnavailable("Writing to {} failed: {}".format(
+            repr(engine.url), e))
+    finally:
+        engine.dispose()
+
+
+def write_connections(connections, project_id):
+    """Writes the connections in a single transaction of the airflow db."""
+    from airflow import settings
+    session = settings.Session()
+    try:
+        results = upsert_connections(session, connections, project_id)
+        session.commit()
+        return results
+    except BaseException as e:
+        print('session error' + str(e))
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def print_results(results, connections):
+    for conn_id in sorted(results):
+        print("{:<9}  {} -> {}".format(results[conn_id], conn_id, connections[conn_id]))
+    counts = [list(results.values()).count(result)
+              for result in [CREATED, UPDATED, UNCHANGED]]
+    print("Connections: {} created, {} updated, {} unchanged".format(*counts))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes GCP connections to the airflow db.')
+    parser.add_argument('project_id', help='GCP project id set in the connections')
+    parser.add_argument('--keys-dir', '-k', default=DEFAULT_KEYS_DIR,
+                        help='Directory with the service account keys')
+    parser.add_argument('--connections-file', '-c',
+                        help='JSON file mapping conn_id to key file (relative to keys dir)')
+    parser.add_argument('--all-keys', '-a', action='store_true',
+                        help='Writes a connection for each service account key in keys dir')
+    parser.add_argument('--use-airflow', action='store_true',
+                        help='Writes the connections with airflow models, not directly')
+    args = parser.parse_args()
+
+    all_connections = {}
+    if args.all_keys:
+        all_connections.update(discover_key_files(args.keys_dir))
+    if args.connections_file:
+        all_connections.update(read_connections_file(args.connections_file, args.keys_dir))
+    key_file_name = os.environ.get('GCP_SERVICE_ACCOUNT_KEY_NAME')
+    if key_file_name or not all_connections:
+        full_key_path = os.path.abspath(os.path.join(args.keys_dir, key_file_name or ''))
+        if not os.path.isfile(full_key_path):
+            print()
+            print('The key file ' + full_key_path + ' is missing!')
+            print()
+            sys.exit(1)
+        print('Setting GCP key file to ' + full_key_path)
+        all_connections[DEFAULT_CONN_ID] = full_key_path
+    missing_keys = [key_path for key_path in all_connections.values()
+                    if not os.path.isfile(key_path)]
+    if missing_keys:
+        print()
+        print('The key files {} are missing!'.format(', '.join(sorted(missing_keys))))
+        print()
+        sys.exit(1)
+    if args.use_airflow:
+        connection_results = write_connections(all_connections, args.project_id)
+    else:
+        try:
+            connection_results = write_connections_directly(all_connections, args.project_id)
+        except DirectWriteUnavailable as e:
+            print("Writing the connections with airflow: {}".format(e))
+            connection_results = write_connections(all_connections, args.project_id)
+    print_results(connection_results, all_connections)
@@ -67,7 +67,8 @@ elif [[ -e "${GCP_SERVICE_ACCOUNT_KEY_DIR}/${GCP_SERVICE_ACCOUNT_KEY_NAME}" ]];
   echo
   airflow db reset -y
   echo
-  python ${MY_DIR}/_setup_gcp_connection.py "${GCP_PROJECT_ID}"
+  python ${MY_DIR}/_setup_gcp_connection.py --all-keys \
+      --keys-dir "${GCP_SERVICE_ACCOUNT_KEY_DIR}" "${GCP_PROJECT_ID}"
   echo
   source ${MY_DIR}/_create_links.sh
 else
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Compares the time of writing the connections directly and with airflow.
+
+Run it where airflow is installed (for example in the airflow-breeze container),
+for each database to compare:
+
+  benchmark_setup_gcp_connection.py \\
+      --sql-alchemy-conn sqlite:////tmp/benchmark/airflow.db \\
+      --sql-alchemy-conn postgresql:///airflow/airflow.db
+
+The databases are initialized with 'airflow db init' first (unless
+--skip-init-db is passed) and the connections are written for a set of
+generated service account keys.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MY_DIR = os.path.dirname(os.path.abspath(__file__))
+SETUP_SCRIPT = os.path.join(MY_DIR, '_setup_gcp_connection.py')
+FALLBACK_MESSAGE = 'Writing the connections with airflow'
+
+MODES = [('airflow', ['--use-airflow']), ('direct', [])]
+
+
+def create_keys(keys_dir, number_of_keys):
+    for index in range(number_of_keys):
+        with open(os.path.join(keys_dir, 'gcp_benchmark_{}.json'.format(index)), 'w') as f:
+            json.dump(dict(type='service_account',
+                           client_email='benchmark-{}@example.com'.format(index)), f)
+
+
+def get_environment(sql_alchemy_conn, airflow_home):
+    environment = dict(os.environ)
+    environment['AIRFLOW_HOME'] = airflow_home
+    environment['AIRFLOW__CORE__SQL_ALCHEMY_CONN'] = sql_alchemy_conn
+    environment['AIRFLOW__DATABASE__SQL_ALCHEMY_CONN'] = sql_alchemy_conn
+    environment.pop('GCP_SERVICE_ACCOUNT_KEY_NAME', None)
+    return environment
+
+
+def time_runs(command, environment, runs):
+    """Returns list of wall times of the runs and whether the output had the fallback."""
+    times = []
+    fell_back = False
+    for _ in range(runs):
+        start = time.time()
+        output = subprocess.check_output(command, env=environment, stderr=subprocess.STDOUT)
+        times.append(time.time() - start)
+        fell_back = fell_back or FALLBACK_MESSAGE in output.decode('utf-8')
+    return times, fell_back
+
+
+def benchmark(sql_alchemy_conn, keys_dir, runs, init_db):
+    airflow_home = tempfile.mkdtemp(prefix='benchmark-airflow-home-')
+    try:
+        environment = get_environment(sql_alchemy_conn, airflow_home)
+        if init_db:
+            subprocess.check_call(['airflow', 'db', 'init'], env=environment,
+                                  stdout=subprocess.DEVNULL)
+        results = []
+        for mode, arguments in MODES:
+            command = [sys.executable, SETUP_SCRIPT, '--all-keys', '--keys-dir', keys_dir] + \
+                arguments + ['benchmark-project']
+            times, fell_back = time_runs(command, environment, runs)
+            results.append((sql_alchemy_conn.split(':')[0], mode, times, fell_back))
+        return results
+    finally:
+        shutil.rmtree(airflow_home)
+
+
+def print_results(results):
+    print()
+    print("{:<12} {:<8} {:>8} {:>8} {:>8}  {}".format(
+        'database', 'mode', 'min (s)', 'med (s)', 'max (s)', ''))
+    for database, mode, times, fell_back in results:
+        print("{:<12} {:<8} {:>8.2f} {:>8.2f} {:>8.2f}  {}".format(
+            database, mode, min(times), statistics.median(times), max(times),
+            'fell back to airflow' if fell_back else ''))
+    print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmarks writing the GCP connections directly and with airflow.')
+    parser.add_argument('--sql-alchemy-conn', '-d', action='append',
+                        help='Database URL to benchmark (may be repeated, a temporary '
+                             'SQLite database by default)')
+    parser.add_argument('--runs', '-n', type=int, default=5,
+                        help='Number of runs of each mode')
+    parser.add_argument('--keys', '-k', type=int, default=16,
+                        help='Number of service account keys (connections) written')
+    parser.add_argument('--skip-init-db', action='store_true',
+                        help='Do not initialize the databases with airflow db init')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='benchmark-gcp-connection-')
+    try:
+        benchmark_keys_dir = os.path.join(work_dir, 'keys')
+        os.makedirs(benchmark_keys_dir)
+        create_keys(benchmark_keys_dir, args.keys)
+        database_urls = args.sql_alchemy_conn or \
+            ['sqlite:///{}'.format(os.path.join(work_dir, 'airflow.db'))]
+        all_results = []
+        for database_url in database_urls:
+            all_results.extend(benchmark(database_url, benchmark_keys_dir, args.runs,
+                                         not args.skip_init_db))
+        print_results(all_results)
+    finally:
+        shutil.rmtree(work_dir)
@@ -17,6 +17,8 @@
 # under the License.
 #
 """Bootstraps an empty config project"""
+import atexit
+import collections
 import json
 import random
 import string
@@ -24,16 +26,31 @@ import tempfile
 
 import subprocess
 import sys
+import threading
 
 import argparse
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from os.path import dirname, basename
 
+import command_runner
+from fixture_sync import GcsBucket, build_local_manifest, sync_files
+from iam_policy import apply_bindings, find_missing_bindings, get_iam_policy_backend
+from reconcile import Plan, ProjectSnapshot
+from task_graph import SUCCEEDED, TaskFailedException, TaskGraph
+
 TEMPLATE_PREFIX = "TEMPLATE-"
 
 MY_DIR = dirname(__file__)
 
+# Modules shared with the other airflow-breeze scripts are in the parent directory
+sys.path.insert(0, dirname(dirname(os.path.abspath(__file__))))
+
+import kms_decryption  # noqa: E402
+from template_renderer import render_template  # noqa: E402
+from variables_env import load_variables_env  # noqa: E402
+
 BOOTSTRAP_CONFIG_DIR = os.path.join(MY_DIR, "config")
 HELLO_WORLD_SOURCE_DIR = os.path.join(MY_DIR, "hello-world")
 TEST_FILES_DIR = os.path.join(MY_DIR, "test-files")
@@ -53,8 +70,17 @@ TEST_BUCKET_SUFFIX = '-tests'
 
 TEST_SUITES = ['python27', 'python35', 'python36']
 
+# Service Usage API enables at most 20 services in a single request
+MAX_SERVICES_PER_ENABLE_CALL = 20
+
+# Number of gcloud/gsutil commands run at the same time
+DEFAULT_PARALLELISM = int(os.environ.get('AIRFLOW_BREEZE_BOOTSTRAP_PARALLELISM', '4'))
+
 VARIABLES = {}
 
+# Created on first use - encrypts with the envelope format if it is enabled
+KMS_BACKEND = None
+
 
 def get_config_dir(workspace_dir):
     global TARGET_DIR
@@ -87,21 +113,13 @@ def copy_file(source_path, destination_path):
         source_path, destination_path))
     shutil.copy2(source_path, destination_path)
 
-    # We do not use Jinja2 or another templating system because we want to make
-    # bootstrapping works without external dependencies. Also built-in templating
-    # is not good enough because it uses $variable syntax that would clash with
-    # Bash substitution we use in a number of places. In order to avoid escaping
-    # The '$' we use Jinja2 form of template variables '{{ VARIABLE }}' or
-    # '{{VARIABLE}}'. Note strict single spaces or lack of them!
-
+    # See template_renderer for the template syntax
     if os.path.isfile(source_path):
         with open(source_path, "r") as input_file:
-            content = input_file.read()
-        for key, value in VARIABLES.items():
-            string_to_replace1 = '{{ ' + key + ' }}'
-            content = content.replace(string_to_replace1, value)
-            string_to_replace2 = '{{' + key + '}}'
-            content = content.replace(string_to_replace2, value)
+            content, unresolved = render_template(input_file.read(), VARIABLES)
+        if unresolved:
+            print("WARNING! Values of {} are not known. They are left unchanged "
+                  "in {}".format(', '.join(unresolved), destination_path))
         with open(destination_path, "w") as output_file:
             output_file.write(content)
 
@@ -217,22 +235,28 @@ SERVICE_ACCOUNTS = [
 ]
 
 
+# Keeps the messages of commands run in parallel from interleaving
+OUTPUT_LOCK = threading.Lock()
+
+
 def logged_call(command, cwd=os.getcwd(), stderr=None, stdout=None):
-    print()
-    print("> Running command: '{}' in directory {}".format(' '.join(command), cwd))
-    print()
-    return subprocess.call(command, cwd=cwd, stderr=stderr, stdout=stdout)
+    with OUTPUT_LOCK:
+        print()
+        print("> Running command: '{}' in directory {}".format(' '.join(command), cwd))
+        print()
+        sys.stdout.flush()
+    return command_runner.call(command, cwd=cwd, stderr=stderr, stdout=stdout)
 
 
 def create_keyring_and_keys():
     print()
     print("Creating keyring and keys ... ")
     print()
-    output = subprocess.check_output(['gcloud', 'kms', 'keyrings', 'list',
-                                      '--filter={}'.format(KEYRING),
-                                      '--format=json',
-                                      '--project={}'.format(project_id),
-                                      '--location=global']).decode('utf-8')
+    output = command_runner.check_output(['gcloud', 'kms', 'keyrings', 'list',
+                                          '--filter={}'.format(KEYRING),
+                                          '--format=json',
+                                          '--project={}'.format(project_id),
+                                          '--location=global']).decode('utf-8')
     keyrings = json.loads(output)
     if keyrings and len(keyrings) > 0:
         print("The keyring is already created. Not creating it again!")
@@ -247,42 +271,35 @@ def create_keyring_and_keys():
                      '--location=global'])
 
 
+def get_kms_backend():
+    global KMS_BACKEND
+    if KMS_BACKEND is None:
+        KMS_BACKEND = kms_decryption.get_kms_backend(
+            project_id, keys_dir=os.path.join(TARGET_DIR, "keys"),
+            check_output=command_runner.check_output)
+    return KMS_BACKEND
+
+
 def encrypt_value(value):
-    return subprocess.check_output(
-        [
-            '/bin/bash', '-c',
-            'echo -n {} | '
-            'gcloud kms encrypt --plaintext-file=- --ciphertext-file=- '
-            '--location=global --keyring={} '
-            '--key={} --project={} | base64'.format(value, KEYRING, KEY, project_id)
-        ]
-    ).decode("utf-8").strip()
+    return kms_decryption.encrypt_value(get_kms_backend(), value)
 
 
 def decrypt_value(value):
-    return subprocess.check_output(
-        [
-            '/bin/bash', '-c',
-            'echo -n {} | base64 --decode | '
-            'gcloud kms decrypt --plaintext-file=- --ciphertext-file=- '
-            '--location=global --keyring={} '
-            '--key={} --project={}'.format(value, KEYRING, KEY, project_id)
-        ]
-    ).decode("utf-8")
+    return kms_decryption.decrypt_value(get_kms_backend(), value)
+
 
 def encrypt_file(file):
     print("Encrypting file {}".format(file))
-    return logged_call(
-        [
-            'gcloud', 'kms', 'encrypt',
-            '--plaintext-file={}'.format(file),
-            '--ciphertext-file={}.enc'.format(file),
-            '--location=global',
-            '--keyring={}'.format(KEYRING),
-            '--key={}'.format(KEY),
-            '--project={}'.format(project_id)
-        ]
-    )
+    try:
+        with open(file, 'rb') as f:
+            ciphertext = kms_decryption.get_file_backend(get_kms_backend(), file).encrypt(
+                f.read())
+    except subprocess.CalledProcessError as e:
+        print("Encrypting {} failed: {}".format(file, e))
+        return 1
+    with open(file + '.enc', 'wb') as f:
+        f.write(ciphertext)
+    return 0
 
 
 def bind_service_account_user_role_for_appspot_account(service_account_email):
@@ -340,7 +357,7 @@ def bind_role_to_service_account(service_account_email, role):
 
 
 def bind_roles_to_cloudbuild():
-    project_number = subprocess.check_output(
+    project_number = command_runner.check_output(
         [
             'gcloud', 'projects', 'describe', project_id,
             '--format', 'value(projectNumber)'
@@ -361,28 +378,115 @@ def bind_roles_to_cloudbuild():
                                  'roles/cloudfunctions.developer')
 
 
-def enable_service(service):
-    print("Enabling service {}".format(service))
-    logged_call(['gcloud', 'services', 'enable',
-                 service,
-                 '--project={}'.format(project_id)])
+def get_required_services():
+    services = ['cloudkms.googleapis.com', 'cloudbuild.googleapis.com']
+    for service_account in SERVICE_ACCOUNTS:
+        services.extend(service_account['services'])
+    return list(collections.OrderedDict.fromkeys(services))
 
 
-def create_all_service_accounts(recreate_service_accounts):
-    print()
-    print("Creating all service accounts ... ")
-    print()
-    for service_account in SERVICE_ACCOUNTS:
-        keyfile = service_account['keyfile']
-        account_name = service_account['account_name']
-        service_account_display_name = service_account['account_description']
-        roles = service_account['roles']
-        services = service_account['services']
-        appspot_service_account_impersonation = \
-            service_account['appspot_service_account_impersonation']
-        service_account_email = '{}@{}.iam.gserviceaccount.com'.format(
-            account_name, project_id)
-        key_file = os.path.join(TARGET_DIR, "keys", keyfile)
+def list_enabled_services():
+    try:
+        return set(command_runner.check_output(
+            ['gcloud', 'services', 'list', '--enabled',
+             '--project={}'.format(project_id),
+             '--format=value(config.name)']).decode('utf-8').split())
+    except subprocess.CalledProcessError:
+        print("WARNING! Could not list enabled services. Enabling all of them.")
+        return set()
+
+
+def enable_services(services, enabled_services=None, parallelism=DEFAULT_PARALLELISM):
+    """Enables the services which are not enabled yet with multi-service calls.
+
+    The calls (each enabling up to MAX_SERVICES_PER_ENABLE_CALL services) run
+    concurrently. Returns list of the services which could not be enabled.
+    """
+    if enabled_services is None:
+        enabled_services = list_enabled_services()
+    missing_services = [service for service in services if service not in enabled_services]
+    if not missing_services:
+        print("All {} required services are already enabled".format(len(services)))
+        return []
+    batches = [missing_services[i:i + MAX_SERVICES_PER_ENABLE_CALL]
+               for i in range(0, len(missing_services), MAX_SERVICES_PER_ENABLE_CALL)]
+    print("Enabling services {}".format(', '.join(missing_services)))
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(batches)))) as executor:
+        results = list(executor.map(
+            lambda batch: logged_call(['gcloud', 'services', 'enable'] + batch +
+                                      ['--project={}'.format(project_id)]),
+            batches))
+    return [service for batch, result in zip(batches, results) if result != 0
+            for service in batch]
+
+
+def _check_call(command, error, **kwargs):
+    if logged_call(command, **kwargs) != 0:
+        raise TaskFailedException(error)
+
+
+def get_required_role_bindings(service_accounts):
+    return [(role, 'serviceAccount:{}@{}.iam.gserviceaccount.com'.format(
+        service_account['account_name'], project_id))
+            for service_account in service_accounts
+            for role in service_account['roles']]
+
+
+def bind_roles_to_service_accounts(service_accounts, backend=None):
+    """Adds all missing roles of the service accounts to the project policy at once."""
+    backend = backend or get_iam_policy_backend(project_id)
+    added_bindings = apply_bindings(backend, get_required_role_bindings(service_accounts))
+    for role, member in added_bindings:
+        print("Assigned {} role to {}".format(role, member))
+    print("Added {} role bindings to the IAM policy of {}".format(len(added_bindings),
+                                                                  project_id))
+
+
+def get_service_account_email(service_account):
+    return '{}@{}.iam.gserviceaccount.com'.format(service_account['account_name'],
+                                                  project_id)
+
+
+def get_service_account_key_file(service_account):
+    return os.path.join(TARGET_DIR, "keys", service_account['keyfile'])
+
+
+def create_service_account(service_account):
+    _check_call(['gcloud', 'iam', 'service-accounts',
+                 'create', service_account['account_name'],
+                 '--display-name', service_account['account_description'],
+                 '--project={}'.format(project_id)],
+                "Could not create service account {}".format(
+                    service_account['account_name']))
+
+
+def create_service_account_key(service_account):
+    key_file = get_service_account_key_file(service_account)
+    _check_call(['gcloud', 'iam', 'service-accounts', 'keys',
+                 'create', key_file,
+                 '--iam-account', get_service_account_email(service_account),
+                 '--project={}'.format(project_id)],
+                "Could not create key {}".format(key_file))
+
+
+def encrypt_service_account_key(service_account):
+    key_file = get_service_account_key_file(service_account)
+    if encrypt_file(key_file) != 0:
+        raise TaskFailedException("Could not encrypt key {}".format(key_file))
+
+
+def bind_appspot_role_to_service_account(service_account):
+    if bind_service_account_user_role_for_appspot_account(
+            get_service_account_email(service_account)) != 0:
+        raise TaskFailedException("Could not bind appspot service account user role")
+
+
+def add_service_account_tasks(task_graph, service_account, recreate_service_accounts):
+    account_name = service_account['account_name']
+    service_account_email = get_service_account_email(service_account)
+    account_state = dict(created=False)
+
+    def create_account():
         with open(os.devnull, 'w') as FNULL:
             account_exists = logged_call(['gcloud', 'iam', 'service-accounts',
                                           'describe', service_account_email,
@@ -393,25 +497,52 @@ def create_all_service_accounts(recreate_service_accounts):
                              '--project={}'.format(project_id),
                              '--quiet'], stderr=FNULL)
                 account_exists = False
-            if not account_exists:
-                account_created = logged_call(['gcloud', 'iam', 'service-accounts',
-                                               'create', account_name,
-                                               '--display-name',
-                                               service_account_display_name,
-                                               '--project={}'.format(project_id)]) == 0
-                if account_created:
-                    logged_call(['gcloud', 'iam', 'service-accounts', 'keys',
-                                 'create', key_file,
-                                 '--iam-account', service_account_email,
-                                 '--project={}'.format(project_id)])
-        encrypt_file(key_file)
-        for service in services:
-            enable_service(service)
-        for role in roles:
-            bind_role_to_service_account(service_account_email, role
-                                         )
-        if appspot_service_account_impersonation:
-            bind_service_account_user_role_for_appspot_account(service_account_email)
+        if not account_exists:
+            create_service_account(service_account)
+            account_state['created'] = True
+
+    def create_key():
+        # Keys are only created together with the account
+        if account_state['created']:
+            create_service_account_key(service_account)
+
+    account = task_graph.add_task(account_name + ':account', create_account,
+                                  group=account_name)
+    key = task_graph.add_task(account_name + ':key', create_key,
+                              dependencies=[account], group=account_name)
+    task_graph.add_task(account_name + ':encrypt',
+                        lambda: encrypt_service_account_key(service_account),
+                        dependencies=[key], group=account_name)
+    if service_account['appspot_service_account_impersonation']:
+        task_graph.add_task(account_name + ':appspot',
+                            lambda: bind_appspot_role_to_service_account(service_account),
+                            dependencies=[account], group=account_name)
+
+
+def create_all_service_accounts(recreate_service_accounts, parallelism=DEFAULT_PARALLELISM):
+    print()
+    print("Creating all service accounts with parallelism {} ... ".format(parallelism))
+    print()
+    task_graph = TaskGraph()
+    for service_account in SERVICE_ACCOUNTS:
+        add_service_account_tasks(task_graph, service_account, recreate_service_accounts)
+    statuses = task_graph.run(parallelism)
+    command_runner.DEFAULT_RUNNER.record_task_graph(task_graph)
+    task_graph.print_summary("creating service accounts")
+    failed_accounts = task_graph.failed_groups()
+    # Roles can only be bound to the accounts which exist
+    existing_accounts = [service_account for service_account in SERVICE_ACCOUNTS
+                         if statuses[service_account['account_name'] + ':account'] == SUCCEEDED]
+    try:
+        bind_roles_to_service_accounts(existing_accounts)
+    except Exception as e:
+        print("ERROR! Could not update the IAM policy of {}: {}".format(project_id, e))
+        failed_accounts = sorted(set(failed_accounts).union(
+            service_account['account_name'] for service_account in existing_accounts))
+    if failed_accounts:
+        print("WARNING! Service accounts {} are not fully configured. Re-run the "
+              "bootstrap to retry.".format(', '.join(failed_accounts)))
+    return failed_accounts
 
 
 def configure_google_cloud_source_repository_helper():
@@ -438,27 +569,57 @@ def commit_and_push_google_cloud_repository(directory, initial=True):
     logged_call(['git', 'push', '--set-upstream', 'origin', 'master'], cwd=directory)
 
 
+def make_bucket(bucket_name):
+    return logged_call(["gsutil", "mb", '-c', 'multi_regional', '-p', project_id,
+                        "gs://{}".format(bucket_name)])
+
+
+def make_bucket_readable_by_all(bucket_name):
+    return logged_call(["gsutil", "iam", "ch", "allUsers:objectViewer",
+                        "gs://{}".format(bucket_name)])
+
+
+def upload_files_to_buckets(bucket_names, files_dir, remote_objects=None,
+                            parallelism=DEFAULT_PARALLELISM):
+    """Uploads new and changed files of files_dir to all the buckets."""
+    uploads = sync_files(files_dir, [GcsBucket(bucket_name) for bucket_name in bucket_names],
+                         parallelism=parallelism, remote_objects=remote_objects)
+    for bucket_name in bucket_names:
+        print("Uploaded {} changed files of {} to bucket {}".format(
+            len(uploads[bucket_name]), files_dir, bucket_name))
+
+
+def upload_files_to_bucket(bucket_name, files_dir):
+    try:
+        upload_files_to_buckets([bucket_name], files_dir)
+        return 0
+    except subprocess.CalledProcessError as e:
+        print("ERROR! Could not upload files to {}: {}".format(bucket_name, e))
+        return 1
+
+
+def set_bucket_lifecycle_rule(bucket_name, lifecycle_rule):
+    return logged_call(['gsutil', 'lifecycle', 'set', lifecycle_rule,
+                        "gs://{}".format(bucket_name)], cwd=MY_DIR)
+
+
 def create_bucket(bucket_name, recreate_bucket, read_all,
                   files_dir=None,
                   lifecycle_rule=None):
     if recreate_bucket:
         logged_call(["gsutil", "-m", "rm", '-R', '-a', "gs://{}".format(bucket_name)])
-    logged_call(["gsutil", "mb", '-c', 'multi_regional', '-p', project_id,
-                 "gs://{}".format(bucket_name)])
+    results = [make_bucket(bucket_name)]
     if read_all:
-        logged_call(["gsutil", "iam", "ch", "allUsers:objectViewer",
-                     "gs://{}".format(bucket_name)])
+        results.append(make_bucket_readable_by_all(bucket_name))
     if files_dir:
-        for file in os.listdir(files_dir):
-            if os.path.isfile(os.path.join(files_dir, file)):
-                logged_call(['gsutil', 'cp', file, "gs://{}".format(bucket_name)],
-                            cwd=files_dir)
+        results.append(upload_files_to_bucket(bucket_name, files_dir))
     if lifecycle_rule:
-        logged_call(['gsutil', 'lifecycle', 'set', lifecycle_rule,
-                     "gs://{}".format(bucket_name)], cwd=MY_DIR)
+        results.append(set_bucket_lifecycle_rule(bucket_name, lifecycle_rule))
+    return max(results)
 
 
 def start_section(section):
+    command_runner.DEFAULT_RUNNER.start_section(section)
     print()
     print("#" * 100)
     print("#  " + section)
@@ -466,6 +627,7 @@ def start_section(section):
 
 
 def end_section():
+    command_runner.DEFAULT_RUNNER.end_section()
     print("#" * 100)
     print()
 
@@ -567,27 +729,266 @@ def encrypt_notification_configuration_files():
                 encrypt_file(os.path.join(root, file))
 
 
-def create_and_configure_buckets():
-    build_bucket = "{}{}".format(project_id, BUILD_BUCKET_SUFFIX)
+def get_build_bucket_name():
+    return "{}{}".format(project_id, BUILD_BUCKET_SUFFIX)
+
+
+def get_test_bucket_names():
     test_bucket = "{}{}".format(project_id, TEST_BUCKET_SUFFIX)
-    create_bucket(build_bucket,
-                  recreate_bucket=args.recreate_project, read_all=True,
-                  lifecycle_rule=BUILD_LIFECYCLE_RULE_FILE)
+    return [test_bucket + "-" + test_suite[-2:] for test_suite in TEST_SUITES]
+
+
+def add_bucket_pipeline(task_graph, bucket_name, recreate_bucket, read_all,
+                        lifecycle_rule=None, grants=()):
+    """Adds the steps creating the bucket as chain of tasks run one after another.
+
+    grants is a list of (role, service account) granted in the bucket.
+    """
+    steps = []
+    if recreate_bucket:
+        # Fails when the bucket does not exist yet, which is fine
+        steps.append(('remove', lambda: logged_call(
+            ["gsutil", "-m", "rm", '-R', '-a', "gs://{}".format(bucket_name)])))
+    steps.append(('create', _checked(make_bucket, bucket_name)))
+    if read_all:
+        steps.append(('public', _checked(make_bucket_readable_by_all, bucket_name)))
+    if lifecycle_rule:
+        steps.append(('lifecycle', _checked(set_bucket_lifecycle_rule, bucket_name,
+                                            lifecycle_rule)))
+    for role, service_account in grants:
+        steps.append(('grant-' + role, _checked(grant_storage_role_to_service_account,
+                                                bucket_name, role, service_account)))
+    previous = []
+    for step_name, function in steps:
+        previous = [task_graph.add_task('{}:{}'.format(bucket_name, step_name), function,
+                                        dependencies=previous, group=bucket_name)]
+
+
+def create_and_configure_buckets(parallelism=DEFAULT_PARALLELISM):
+    """Creates the build and test buckets, each in its own pipeline run concurrently."""
+    task_graph = TaskGraph()
+    add_bucket_pipeline(task_graph, get_build_bucket_name(),
+                        recreate_bucket=args.recreate_project, read_all=True,
+                        lifecycle_rule=BUILD_LIFECYCLE_RULE_FILE,
+                        grants=[("objectCreator",
+                                 "{}@appspot.gserviceaccount.com".format(project_id))])
     gcp_cloudsql_service_account = "gcp-cloudsql-account@{}.iam.gserviceaccount.com". \
         format(project_id)
-    for test_suite in TEST_SUITES:
-        test_bucket_full_name = test_bucket + "-" + test_suite[-2:]
-        create_bucket(test_bucket_full_name,
-                      recreate_bucket=args.recreate_project, read_all=False,
-                      files_dir=TEST_FILES_DIR)
-        grant_storage_role_to_service_account(
-            test_bucket_full_name,
-            "admin",
-            gcp_cloudsql_service_account)
-    grant_storage_role_to_service_account(
-        build_bucket,
-        "objectCreator",
-        "{}@appspot.gserviceaccount.com".format(project_id))
+    for test_bucket_full_name in get_test_bucket_names():
+        add_bucket_pipeline(task_graph, test_bucket_full_name,
+                            recreate_bucket=args.recreate_project, read_all=False,
+                            grants=[("admin", gcp_cloudsql_service_account)])
+    statuses = task_graph.run(parallelism)
+    command_runner.DEFAULT_RUNNER.record_task_graph(task_graph)
+    task_graph.print_summary("creating buckets")
+    failed_buckets = task_graph.failed_groups()
+    # Test files are read once and uploaded to all test buckets which were created
+    created_test_buckets = [bucket_name for bucket_name in get_test_bucket_names()
+                            if statuses[bucket_name + ':create'] == SUCCEEDED]
+    try:
+        upload_files_to_buckets(created_test_buckets, TEST_FILES_DIR, parallelism=parallelism)
+    except subprocess.CalledProcessError as e:
+        print("ERROR! Could not upload test files: {}".format(e))
+        failed_buckets = sorted(set(failed_buckets).union(created_test_buckets))
+    if failed_buckets:
+        print("WARNING! Buckets {} are not fully configured. Re-run the "
+              "bootstrap to retry.".format(', '.join(failed_buckets)))
+    return failed_buckets
+
+
+def _checked(function, *arguments):
+    """Returns task running the function which fails if it returns non-zero code."""
+    def run():
+        if function(*arguments) != 0:
+            raise TaskFailedException("{}{} failed".format(function.__name__, arguments))
+    return run
+
+
+def _has_binding(policy, role, member):
+    return not find_missing_bindings(policy, [(role, member)])
+
+
+def take_project_snapshot(parallelism, policy_backend):
+    print("Reading current state of project {} ...".format(project_id))
+    return ProjectSnapshot(project_id, KEYRING, KEY).take(
+        policy_backend, [get_build_bucket_name()] + get_test_bucket_names(), parallelism,
+        buckets_to_list=get_test_bucket_names())
+
+
+def plan_project_changes(snapshot, policy_backend):
+    """Plans the changes bringing the project to the state bootstrap creates."""
+    plan = Plan()
+
+    required_services = get_required_services()
+    missing_services = [service for service in required_services
+                        if service not in snapshot.enabled_services]
+    if missing_services:
+        def enable_missing_services():
+            failed_services = enable_services(missing_services, snapshot.enabled_services)
+            if failed_services:
+                raise TaskFailedException("Could not enable {}".format(
+                    ', '.join(failed_services)))
+        plan.add('services', "Enable services {}".format(', '.join(missing_services)),
+                 enable_missing_services)
+
+    if KEYRING not in snapshot.keyrings:
+        plan.add('keyring', "Create keyring {}".format(KEYRING),
+                 lambda: _check_call(['gcloud', 'kms', 'keyrings', 'create', KEYRING,
+                                      '--project={}'.format(project_id),
+                                      '--location=global'],
+                                     "Could not create keyring {}".format(KEYRING)),
+                 dependencies=['services'], group='kms')
+    if KEY not in snapshot.keys:
+        plan.add('key', "Create key {}".format(KEY),
+                 lambda: _check_call(['gcloud', 'kms', 'keys', 'create', KEY,
+                                      '--project={}'.format(project_id),
+                                      '--keyring={}'.format(KEYRING),
+                                      '--purpose=encryption',
+                                      '--location=global'],
+                                     "Could not create key {}".format(KEY)),
+                 dependencies=['services', 'keyring'], group='kms')
+
+    required_bindings = get_required_role_bindings(SERVICE_ACCOUNTS)
+    if snapshot.project_number is None:
+        plan.add('cloudbuild', "Bind roles to Cloud Build service account",
+                 bind_roles_to_cloudbuild, dependencies=['key'], group='cloudbuild')
+    else:
+        cloudbuild_member = 'serviceAccount:{}@cloudbuild.gserviceaccount.com'.format(
+            snapshot.project_number)
+        if not _has_binding(snapshot.appspot_account_policy,
+                            'roles/iam.serviceAccountUser', cloudbuild_member):
+            plan.add('cloudbuild:appspot',
+                     "Bind appspot service account user role to {}".format(
+                         cloudbuild_member),
+                     _checked(bind_service_account_user_role_for_appspot_account,
+                              cloudbuild_member.split(':', 1)[1]),
+                     group='cloudbuild')
+        if not _has_binding(snapshot.key_policy,
+                            'roles/cloudkms.cryptoKeyDecrypter', cloudbuild_member):
+            plan.add('cloudbuild:key', "Grant decrypter role of {} to {}".format(
+                KEY, cloudbuild_member),
+                lambda: _check_call([
+                    'gcloud', 'kms', 'keys', 'add-iam-policy-binding',
+                    KEY, '--location=global', '--keyring={}'.format(KEYRING),
+                    '--project={}'.format(project_id),
+                    '--member={}'.format(cloudbuild_member),
+                    '--role=roles/cloudkms.cryptoKeyDecrypter'
+                ], "Could not grant decrypter role to {}".format(cloudbuild_member)),
+                dependencies=['key'], group='cloudbuild')
+        required_bindings.append(('roles/cloudfunctions.developer', cloudbuild_member))
+
+    account_actions = []
+    for service_account in SERVICE_ACCOUNTS:
+        account_name = service_account['account_name']
+        email = get_service_account_email(service_account)
+        key_file = get_service_account_key_file(service_account)
+        account = account_name + ':account'
+        if email not in snapshot.service_accounts:
+            account_actions.append(plan.add(
+                account, "Create service account {}".format(email),
+                lambda sa=service_account: create_service_account(sa),
+                group=account_name))
+            plan.add(account_name + ':key', "Create key {}".format(key_file),
+                     lambda sa=service_account: create_service_account_key(sa),
+                     dependencies=[account], group=account_name)
+        # Encrypting again would only change the committed ciphertext
+        if account in plan.task_graph.tasks or (
+                os.path.exists(key_file) and not os.path.exists(key_file + '.enc')):
+            plan.add(account_name + ':encrypt', "Encrypt key {}".format(key_file),
+                     lambda sa=service_account: encrypt_service_account_key(sa),
+                     dependencies=[account_name + ':key', 'key'], group=account_name)
+        if service_account['appspot_service_account_impersonation'] and \
+                not _has_binding(snapshot.appspot_account_policy,
+                                 'roles/iam.serviceAccountUser',
+                                 'serviceAccount:{}'.format(email)):
+            plan.add(account_name + ':appspot',
+                     "Bind appspot service account user role to {}".format(email),
+                     lambda sa=service_account: bind_appspot_role_to_service_account(sa),
+                     dependencies=[account], group=account_name)
+
+    missing_bindings = find_missing_bindings(snapshot.project_policy, required_bindings)
+    if missing_bindings:
+        def bind_roles():
+            apply_bindings(policy_backend, required_bindings)
+        plan.add('project-iam-policy', "Add {} role bindings to the IAM policy "
+                 "of project {}".format(len(missing_bindings), project_id), bind_roles,
+                 dependencies=account_actions, group='project-iam-policy')
+
+    cloudsql_account = 'gcp-cloudsql-account'
+    bucket_bindings = [(get_build_bucket_name(), 'roles/storage.objectCreator',
+                        "{}@appspot.gserviceaccount.com".format(project_id), [])]
+    bucket_bindings.extend((test_bucket, 'roles/storage.admin',
+                            "{}@{}.iam.gserviceaccount.com".format(cloudsql_account,
+                                                                   project_id),
+                            [cloudsql_account + ':account'])
+                           for test_bucket in get_test_bucket_names())
+    build_bucket = get_build_bucket_name()
+    if build_bucket not in snapshot.buckets:
+        plan.add('bucket:' + build_bucket, "Create bucket {}".format(build_bucket),
+                 _checked(create_bucket, build_bucket, False, True, None,
+                          BUILD_LIFECYCLE_RULE_FILE), group=build_bucket)
+    else:
+        if not _has_binding(snapshot.bucket_policies[build_bucket],
+                            'roles/storage.objectViewer', 'allUsers'):
+            plan.add('bucket:' + build_bucket + ':public',
+                     "Make bucket {} readable by all".format(build_bucket),
+                     _checked(make_bucket_readable_by_all, build_bucket),
+                     group=build_bucket)
+        with open(BUILD_LIFECYCLE_RULE_FILE) as f:
+            lifecycle_rules = json.load(f)['lifecycle']['rule']
+        if snapshot.bucket_lifecycle_rules[build_bucket] != lifecycle_rules:
+            plan.add('bucket:' + build_bucket + ':lifecycle',
+                     "Set lifecycle rule of bucket {}".format(build_bucket),
+                     _checked(set_bucket_lifecycle_rule, build_bucket,
+                              BUILD_LIFECYCLE_RULE_FILE), group=build_bucket)
+    for test_bucket in get_test_bucket_names():
+        if test_bucket not in snapshot.buckets:
+            plan.add('bucket:' + test_bucket, "Create bucket {}".format(test_bucket),
+                     _checked(create_bucket, test_bucket, False, False, TEST_FILES_DIR),
+                     group=test_bucket)
+    # Files of all existing test buckets are synchronized in one pass
+    local_manifest = build_local_manifest(TEST_FILES_DIR)
+    buckets_to_sync = collections.OrderedDict()
+    for test_bucket in get_test_bucket_names():
+        if test_bucket not in snapshot.buckets:
+            continue
+        changed_files = [name for name, entry in sorted(local_manifest.items())
+                         if snapshot.bucket_objects[test_bucket].get(name) != entry]
+        if changed_files:
+            buckets_to_sync[test_bucket] = changed_files
+    if buckets_to_sync:
+        plan.add('test-files', "Upload changed test files to buckets: {}".format(
+            '; '.join("{} ({})".format(bucket, ', '.join(files))
+                      for bucket, files in buckets_to_sync.items())),
+            lambda: upload_files_to_buckets(
+                list(buckets_to_sync), TEST_FILES_DIR,
+                remote_objects={bucket: snapshot.bucket_objects[bucket]
+                                for bucket in buckets_to_sync}))
+    for bucket, role, account, dependencies in bucket_bindings:
+        if _has_binding(snapshot.bucket_policies.get(bucket, {}), role,
+                        'serviceAccount:{}'.format(account)):
+            continue
+        plan.add('bucket:' + bucket + ':' + role,
+                 "Grant role {} in bucket {} to {}".format(role, bucket, account),
+                 _checked(grant_storage_role_to_service_account, bucket,
+                          role.split('.')[-1], account),
+                 dependencies=['bucket:' + bucket] + dependencies, group=bucket)
+    return plan
+
+
+def reconcile_project(parallelism, plan_only=False):
+    """Applies only the changes needed. Returns names of groups which failed."""
+    policy_backend = get_iam_policy_backend(project_id)
+    plan = plan_project_changes(take_project_snapshot(parallelism, policy_backend),
+                                policy_backend)
+    plan.print_plan()
+    if plan_only:
+        return []
+    failed_groups = plan.execute(parallelism)
+    if failed_groups:
+        print("WARNING! Changes of {} failed. Re-run the bootstrap to retry.".format(
+            ', '.join(failed_groups)))
+    return failed_groups
 
 
 if __name__ == '__main__':
@@ -604,11 +1005,20 @@ if __name__ == '__main__':
                         help='GCP project id')
     parser.add_argument('--recreate-project', '-r', action='store_true',
                         help='Recreates all service accounts, keys and buckets')
+    parser.add_argument('--parallelism', '-j', type=int, default=DEFAULT_PARALLELISM,
+                        help='Maximum number of gcloud commands run at the same time')
+    parser.add_argument('--plan-only', action='store_true',
+                        help='Only prints changes needed to reconfigure the project')
+    parser.add_argument('--trace-dir',
+                        help='Directory where log and trace of the commands run are '
+                             'written (the workspace by default)')
 
     args = parser.parse_args()
 
     project_id = args.gcp_project_id
 
+    atexit.register(command_runner.write_reports, args.trace_dir or args.workspace)
+
     create_new_config_repo = logged_call(['gcloud', 'source', 'repos', 'describe',
                                           '--project', project_id,
                                           CONFIG_REPO_NAME]) != 0
@@ -628,8 +1038,15 @@ if __name__ == '__main__':
         args.recreate_project = True
     else:
         assert_config_directory_exists()
-        # Read current values from environment to retain their values
-        VARIABLES.update(os.environ)
+        if args.plan_only and not args.recreate_project:
+            start_section("Planning changes of project {}".format(project_id))
+            reconcile_project(args.parallelism, plan_only=True)
+            end_section()
+            sys.exit(0)
+        # Read current values from the environment and variables.env to retain them
+        _variable_names, current_variables = load_variables_env(
+            os.path.join(TARGET_DIR, 'variables.env'))
+        VARIABLES.update(current_variables)
         if VARIABLES.get('SLACK_HOOK_ENCRYPTED'):
             try:
                 VARIABLES['SLACK_HOOK'] = decrypt_value(VARIABLES.get('SLACK_HOOK_ENCRYPTED'))
@@ -665,36 +1082,53 @@ if __name__ == '__main__':
     read_manual_parameters(regenerate_passwords=args.recreate_project)
     end_section()
 
-    start_section("Enabling KMS and Cloud Build for project {}".format(project_id))
-    enable_service('cloudkms.googleapis.com')
-    enable_service('cloudbuild.googleapis.com')
-    end_section()
+    if not args.recreate_project:
+        # Reconfiguring - only the missing parts of the project are created
+        start_section("Copying files (with overwritten values) in configuration dir")
+        copy_configuration_directory()
+        end_section()
 
-    start_section('Binding roles to Cloud Build service account')
-    bind_roles_to_cloudbuild()
-    end_section()
+        start_section("Reconciling services, keys, service accounts and buckets "
+                      "of project {}".format(project_id))
+        reconcile_project(args.parallelism)
+        end_section()
 
-    start_section("Creating keyring and key for encryption for project {}".
-                  format(project_id))
-    create_keyring_and_keys()
-    end_section()
+        start_section("Encrypting secret_variables.yaml files in notifications directory")
+        encrypt_notification_configuration_files()
+        end_section()
+    else:
+        start_section("Enabling services for project {}".format(project_id))
+        failed_services = enable_services(get_required_services(),
+                                          parallelism=args.parallelism)
+        if failed_services:
+            print("WARNING! Could not enable services {}".format(', '.join(failed_services)))
+        end_section()
 
-    start_section("Copying files (with overwritten values) in configuration dir")
-    copy_configuration_directory()
-    end_section()
+        start_section('Binding roles to Cloud Build service account')
+        bind_roles_to_cloudbuild()
+        end_section()
 
-    start_section("Encrypting secret_variables.yaml files in notifications directory")
-    encrypt_notification_configuration_files()
-    end_section()
+        start_section("Creating keyring and key for encryption for project {}".
+                      format(project_id))
+        create_keyring_and_keys()
+        end_section()
 
-    start_section("Creating all service accounts for project {}".format(project_id))
-    create_all_service_accounts(recreate_service_accounts=args.recreate_project)
-    end_section()
+        start_section("Copying files (with overwritten values) in configuration dir")
+        copy_configuration_directory()
+        end_section()
 
-    start_section("Creating build and test buckets for project {}".format(project_id))
+        start_section("Encrypting secret_variables.yaml files in notifications directory")
+        encrypt_notification_configuration_files()
+        end_section()
 
-    create_and_configure_buckets()
-    end_section()
+        start_section("Creating all service accounts for project {}".format(project_id))
+        create_all_service_accounts(recreate_service_accounts=args.recreate_project,
+                                    parallelism=args.parallelism)
+        end_section()
+
+        start_section("Creating build and test buckets for project {}".format(project_id))
+        create_and_configure_buckets(parallelism=args.parallelism)
+        end_section()
 
     start_section("Configuring Cloud Source Repository authentication")
     configure_google_cloud_source_repository_helper()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Records, replays and benchmarks runs of the bootstrap without a GCP project.
+
+Recording runs _bootstrap_airflow_breeze_config.py against a real project with
+gcloud, gsutil and git replaced by fake_cli.py in record mode. It stores the
+invocations, the answers typed and the configuration directory as it was
+before the run in <FIXTURES>/<SCENARIO>. The scenario directory is readable only
+by the owner - outputs of the tools and the configuration may contain secrets
+(see fake_cli.py for what is redacted):
+
+  benchmark_bootstrap.py record -f <FIXTURES> -s fresh -w <WORKSPACE> -p <PROJECT>
+  benchmark_bootstrap.py record -f <FIXTURES> -s reconfigure -w <WORKSPACE> -p <PROJECT>
+  benchmark_bootstrap.py record -f <FIXTURES> -s recreate -w <WORKSPACE> -p <PROJECT> -r
+
+Replaying runs the bootstrap in a temporary workspace with the recorded
+responses (and latency) and benchmarking replays all recorded scenarios and
+reports their total and critical path time:
+
+  benchmark_bootstrap.py replay -f <FIXTURES> -s reconfigure [--latency 0.5]
+  benchmark_bootstrap.py benchmark -f <FIXTURES> [--latency <LATENCY_JSON>]
+"""
+import argparse
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from fake_cli import REDACTED_DIGEST_PREFIX
+
+MY_DIR = os.path.dirname(os.path.abspath(__file__))
+BOOTSTRAP_SCRIPT = os.path.join(MY_DIR, '_bootstrap_airflow_breeze_config.py')
+FAKE_CLI = os.path.join(MY_DIR, 'fake_cli.py')
+FAKE_COMMANDS = ['gcloud', 'gsutil', 'git']
+SCENARIOS = ['fresh', 'reconfigure', 'recreate']
+
+ReplayResult = collections.namedtuple(
+    'ReplayResult', ['scenario', 'exit_code', 'wall_clock', 'command_time',
+                     'critical_path', 'commands', 'missing'])
+
+
+def create_shim_dir():
+    shim_dir = tempfile.mkdtemp(prefix='fake-cli-')
+    for command in FAKE_COMMANDS:
+        os.symlink(FAKE_CLI, os.path.join(shim_dir, command))
+    return shim_dir
+
+
+def bootstrap_command(workspace, scenario_config, trace_dir, parallelism):
+    command = [sys.executable, BOOTSTRAP_SCRIPT,
+               '--workspace', workspace,
+               '--gcp-project-id', scenario_config['gcp_project_id'],
+               '--trace-dir', trace_dir]
+    if scenario_config['recreate_project']:
+        command.append('--recreate-project')
+    if parallelism:
+        command.extend(['--parallelism', str(parallelism)])
+    return command
+
+
+def record(fixtures_dir, scenario, workspace, project_id, recreate_project):
+    scenario_dir = os.path.join(fixtures_dir, scenario)
+    if os.path.exists(scenario_dir):
+        raise Exception("Fixtures {} already exist. Remove them to record "
+                        "again".format(scenario_dir))
+    # The recorded outputs and the copy of the config may contain secrets
+    os.makedirs(os.path.join(scenario_dir, 'commands'), mode=0o700)
+    os.chmod(scenario_dir, 0o700)
+    workspace = os.path.realpath(workspace)
+    config_dir = os.path.join(workspace, 'config')
+    if os.path.isdir(config_dir):
+        shutil.copytree(config_dir, os.path.join(scenario_dir, 'workspace', 'config'),
+                        symlinks=True)
+    scenario_config = dict(gcp_project_id=project_id, recreate_project=recreate_project)
+    with open(os.path.join(scenario_dir, 'scenario.json'), 'w') as f:
+        json.dump(scenario_config, f, indent=2)
+
+    shim_dir = create_shim_dir()
+    environment = dict(os.environ,
+                       PATH=shim_dir + os.pathsep + os.environ['PATH'],
+                       FAKE_CLI_MODE='record',
+                       FAKE_CLI_FIXTURES=os.path.join(scenario_dir, 'commands'),
+                       FAKE_CLI_WORKSPACE=workspace,
+                       FAKE_CLI_REAL_PATH=os.environ['PATH'])
+    process = subprocess.Popen(
+        bootstrap_command(workspace, scenario_config, scenario_dir, None),
+        stdin=subprocess.PIPE, env=environment)
+
+    # The answers typed are passed to the bootstrap and stored for the replay
+    def forward_answers():
+        with open(os.path.join(scenario_dir, 'answers.txt'), 'w') as answers:
+            for line in iter(sys.stdin.readline, ''):
+                answers.write(line)
+                answers.flush()
+                try:
+                    process.stdin.write(line.encode('utf-8'))
+                    process.stdin.flush()
+                except (BrokenPipeError, ValueError):
+                    break
+
+    threading.Thread(target=forward_answers, daemon=True).start()
+    exit_code = process.wait()
+    shutil.rmtree(shim_dir)
+    print("Recorded {} commands in {}".format(
+        len([name for name in os.listdir(os.path.join(scenario_dir, 'commands'))
+             if not name.startswith(REDACTED_DIGEST_PREFIX)]), scenario_dir))
+    return exit_code
+
+
+def _merge_intervals(events):
+    clusters = []
+    for event in sorted(events, key=lambda event: event['ts']):
+        if clusters and event['ts'] < clusters[-1][0]:
+            clusters[-1][0] = max(clusters[-1][0], event['ts'] + event['dur'])
+            clusters[-1][1].append(event)
+        else:
+            clusters.append([event['ts'] + event['dur'], [event]])
+    return [cluster for _, cluster in clusters]
+
+
+def analyze_trace(trace_file):
+    """Returns total time of the commands, critical path time and number of commands.
+
+    The critical path is estimated as the sum of the commands run by the main
+    thread, the critical paths of the task graphs and the longest command of each
+    group of commands run concurrently outside of task graphs.
+    """
+    with open(trace_file) as f:
+        events = json.load(f)['traceEvents']
+    thread_names = {event['tid']: event['args']['name'] for event in events
+                    if event.get('ph') == 'M'}
+    task_graphs = [event for event in events if event.get('cat') == 'task_graph']
+    commands = [event for event in events if event.get('ph') == 'X' and
+                event.get('cat') not in ('section', 'task_graph')]
+    critical_path = sum(task_graph['args']['critical_path'] for task_graph in task_graphs)
+    outside_graphs = [command for command in commands
+                      if not any(task_graph['ts'] <= command['ts'] <
+                                 task_graph['ts'] + task_graph['dur']
+                                 for task_graph in task_graphs)]
+    main_thread = [command for command in outside_graphs
+                   if thread_names.get(command['tid']) == 'MainThread']
+    critical_path += sum(command['dur'] for command in main_thread) / 1000000.0
+    concurrent = [command for command in outside_graphs if command not in main_thread]
+    critical_path += sum(max(command['dur'] for command in cluster)
+                         for cluster in _merge_intervals(concurrent)) / 1000000.0
+    command_time = sum(command['dur'] for command in commands) / 1000000.0
+    return command_time, critical_path, len(commands)
+
+
+def replay(fixtures_dir, scenario, latency=None, latency_scale=None, parallelism=None,
+           quiet=False):
+    scenario_dir = os.path.join(fixtures_dir, scenario)
+    with open(os.path.join(scenario_dir, 'scenario.json')) as f:
+        scenario_config = json.load(f)
+    run_dir = tempfile.mkdtemp(prefix='bootstrap-replay-')
+    workspace = os.path.join(run_dir, 'workspace')
+    state_dir = os.path.join(run_dir, 'state')
+    os.makedirs(state_dir)
+    if os.path.isdir(os.path.join(scenario_dir, 'workspace')):
+        shutil.copytree(os.path.join(scenario_dir, 'workspace'), workspace, symlinks=True)
+    else:
+        os.makedirs(workspace)
+    shim_dir = create_shim_dir()
+    environment = dict(os.environ,
+                       PATH=shim_dir + os.pathsep + os.environ['PATH'],
+                       FAKE_CLI_MODE='replay',
+                       FAKE_CLI_FIXTURES=os.path.join(scenario_dir, 'commands'),
+                       FAKE_CLI_WORKSPACE=workspace,
+                       FAKE_CLI_STATE=state_dir)
+    if latency is not None:
+        environment['FAKE_CLI_LATENCY'] = latency
+    if latency_scale is not None:
+        environment['FAKE_CLI_LATENCY_SCALE'] = str(latency_scale)
+    start = time.time()
+    with open(os.path.join(scenario_dir, 'answers.txt')) as answers, \
+            open(os.path.join(run_dir, 'output.log'), 'w') as output:
+        exit_code = subprocess.call(
+            bootstrap_command(workspace, scenario_config, run_dir, parallelism),
+            stdin=answers, stdout=output if quiet else None,
+            stderr=subprocess.STDOUT if quiet else None, env=environment)
+    wall_clock = time.time() - start
+    missing = 0
+    if os.path.exists(os.path.join(state_dir, 'missing.jsonl')):
+        with open(os.path.join(state_dir, 'missing.jsonl')) as f:
+            missing = len(f.readlines())
+    trace_file = os.path.join(run_dir, 'bootstrap-trace.json')
+    command_time, critical_path, commands = analyze_trace(trace_file) \
+        if os.path.exists(trace_file) else (0, 0, 0)
+    shutil.rmtree(shim_dir)
+    if exit_code == 0 and not missing:
+        shutil.rmtree(run_dir)
+    else:
+        print("Replay of {} failed (exit code {}, {} commands not recorded). See {}".format(
+            scenario, exit_code, missing, run_dir))
+    return ReplayResult(scenario, exit_code, wall_clock, command_time, critical_path,
+                        commands, missing)
+
+
+def print_results(results):
+    print()
+    print("{:<12} {:>10} {:>10} {:>14} {:>9} {:>8} {:>5}".format(
+        'scenario', 'total (s)', 'cmds (s)', 'critical (s)', 'commands', 'missing',
+        'exit'))
+    for result in results:
+        print("{:<12} {:>10.1f} {:>10.1f} {:>14.1f} {:>9d} {:>8d} {:>5d}".format(
+            result.scenario, result.wall_clock, result.command_time, result.critical_path,
+            result.commands, result.missing, result.exit_code))
+    print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Records, replays and benchmarks bootstrap runs.')
+    parser.add_argument('command', choices=['record', 'replay', 'benchmark'])
+    parser.add_argument('--fixtures', '-f', required=True,
+                        help='Directory with the recorded scenarios')
+    parser.add_argument('--scenario', '-s', action='append',
+                        help='Scenario (fresh, reconfigure, recreate or any other name). '
+                             'Benchmark uses all recorded scenarios by default')
+    parser.add_argument('--workspace', '-w', help='(record) Path to the workspace')
+    parser.add_argument('--gcp-project-id', '-p', help='(record) GCP project id')
+    parser.add_argument('--recreate-project', '-r', action='store_true',
+                        help='(record) Run the bootstrap with --recreate-project')
+    parser.add_argument('--latency',
+                        help="(replay) 'recorded', seconds per command or JSON file "
+                             "mapping command prefixes to seconds")
+    parser.add_argument('--latency-scale', type=float,
+                        help='(replay) Multiplier of the latency')
+    parser.add_argument('--parallelism', '-j', type=int,
+                        help='(replay) Parallelism passed to the bootstrap')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        if not args.scenario or len(args.scenario) != 1 or not args.workspace \
+                or not args.gcp_project_id:
+            parser.error('record requires single --scenario, --workspace and '
+                         '--gcp-project-id')
+        sys.exit(record(args.fixtures, args.scenario[0], args.workspace,
+                        args.gcp_project_id, args.recreate_project))
+    if args.command == 'replay':
+        if not args.scenario or len(args.scenario) != 1:
+            parser.error('replay requires single --scenario')
+        replay_result = replay(args.fixtures, args.scenario[0], args.latency,
+                               args.latency_scale, args.parallelism)
+        print_results([replay_result])
+        sys.exit(replay_result.exit_code)
+    scenarios = args.scenario or [
+        scenario for scenario in SCENARIOS + sorted(os.listdir(args.fixtures))
+        if os.path.isfile(os.path.join(args.fixtures, scenario, 'scenario.json'))]
+    replay_results = [replay(args.fixtures, scenario, args.latency, args.latency_scale,
+                             args.parallelism, quiet=True)
+                      for scenario in collections.OrderedDict.fromkeys(scenarios)]
+    print_results(replay_results)
+    sys.exit(1 if any(replay_result.exit_code for replay_result in replay_results) else 0)
@@ -0,0 +1,220 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Runs external commands of the bootstrap and records their timing.
+
+Every command is recorded with the section it was run in, start and end time,
+exit code and size of its output. The records can be written as JSON lines and
+as Chrome trace events (open in chrome://tracing or https://ui.perfetto.dev).
+"""
+import collections
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+CommandRecord = collections.namedtuple(
+    'CommandRecord', ['command', 'section', 'start', 'end', 'exit_code', 'output_size',
+                      'thread'])
+SectionRecord = collections.namedtuple('SectionRecord', ['name', 'start', 'end'])
+TaskGraphRecord = collections.namedtuple(
+    'TaskGraphRecord', ['section', 'start', 'end', 'critical_path', 'critical_tasks'])
+
+NO_SECTION = '(no section)'
+
+
+class CommandRunner(object):
+    def __init__(self):
+        self.commands = []
+        self.sections = []
+        self.task_graphs = []
+        self.current_section = NO_SECTION
+        self._section_start = None
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    def start_section(self, name):
+        self.end_section()
+        self.current_section = name
+        self._section_start = time.time()
+
+    def end_section(self):
+        if self._section_start is not None:
+            self.sections.append(SectionRecord(self.current_section, self._section_start,
+                                               time.time()))
+        self.current_section = NO_SECTION
+        self._section_start = None
+
+    def _record(self, command, start, exit_code, output_size):
+        with self._lock:
+            self.commands.append(CommandRecord(
+                command=list(command), section=self.current_section, start=start,
+                end=time.time(), exit_code=exit_code, output_size=output_size,
+                thread=threading.current_thread().name))
+
+    def record_task_graph(self, task_graph):
+        """Records the time span and critical path of the task graph which was run."""
+        if not task_graph.timings:
+            return
+        critical_path, critical_tasks = task_graph.critical_path()
+        self.task_graphs.append(TaskGraphRecord(
+            section=self.current_section,
+            start=min(start for start, _ in task_graph.timings.values()),
+            end=max(end for _, end in task_graph.timings.values()),
+            critical_path=critical_path, critical_tasks=critical_tasks))
+
+    def run(self, command, cwd=None, input=None, stdout=None, stderr=None):
+        """Runs the command and returns (exit code, stdout, stderr).
+
+        stdout and stderr are the same as for subprocess.Popen. Output which is
+        not captured (stdout=None) is still passed through to sys.stdout so that
+        its size can be recorded.
+        """
+        start = time.time()
+        relay_stdout = stdout is None
+        process = subprocess.Popen(command, cwd=cwd,
+                                   stdin=subprocess.PIPE if input is not None else None,
+                                   stdout=subprocess.PIPE if relay_stdout else stdout,
+                                   stderr=stderr)
+        output_size = 0
+        if relay_stdout and input is None and stderr != subprocess.PIPE:
+            # Streamed, so that progress of long running commands is visible
+            sys.stdout.flush()
+            for chunk in iter(lambda: process.stdout.read1(65536), b''):
+                output_size += len(chunk)
+                sys.stdout.buffer.write(chunk)
+                sys.stdout.buffer.flush()
+            process.wait()
+            out, err = None, None
+        else:
+            out, err = process.communicate(input)
+            output_size = len(out or b'') + len(err or b'')
+            if relay_stdout:
+                sys.stdout.flush()
+                sys.stdout.buffer.write(out)
+                sys.stdout.buffer.flush()
+                out = None
+        self._record(command, start, process.returncode, output_size)
+        return process.returncode, out, err
+
+    def call(self, command, cwd=None, stdout=None, stderr=None):
+        """The same as subprocess.call."""
+        return self.run(command, cwd=cwd, stdout=stdout, stderr=stderr)[0]
+
+    def check_output(self, command, cwd=None, input=None, stderr=None):
+        """The same as subprocess.check_output."""
+        returncode, out, _ = self.run(command, cwd=cwd, input=input,
+                                      stdout=subprocess.PIPE, stderr=stderr)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, output=out)
+        return out
+
+    def write_log(self, log_file):
+        """Writes the commands as JSON lines."""
+        with open(log_file, 'w') as f:
+            for record in sorted(self.commands, key=lambda record: record.start):
+                f.write(json.dumps(dict(record._asdict(),
+                                        duration=record.end - record.start)))
+                f.write('\n')
+
+    def write_trace(self, trace_file):
+        """Writes the sections and commands as Chrome trace events."""
+        thread_ids = {}
+        events = []
+
+        def microseconds(timestamp):
+            return int((timestamp - self._start) * 1000000)
+
+        for section in self.sections:
+            events.append(dict(name=section.name, cat='section', ph='X', pid=1, tid=0,
+                               ts=microseconds(section.start),
+                               dur=microseconds(section.end) - microseconds(section.start)))
+        for record in self.commands:
+            thread_id = thread_ids.setdefault(record.thread, len(thread_ids) + 1)
+            events.append(dict(name=' '.join(record.command[:4]), cat=record.section,
+                               ph='X', pid=1, tid=thread_id,
+                               ts=microseconds(record.start),
+                               dur=microseconds(record.end) - microseconds(record.start),
+                               args=dict(command=' '.join(record.command),
+                                         exit_code=record.exit_code,
+                                         output_size=record.output_size)))
+        for task_graph in self.task_graphs:
+            events.append(dict(name='task graph', cat='task_graph', ph='X', pid=1, tid=0,
+                               ts=microseconds(task_graph.start),
+                               dur=microseconds(task_graph.end) -
+                               microseconds(task_graph.start),
+                               args=dict(critical_path=task_graph.critical_path,
+                                         critical_tasks=task_graph.critical_tasks)))
+        events.append(dict(name='thread_name', ph='M', pid=1, tid=0,
+                           args=dict(name='sections')))
+        for thread, thread_id in thread_ids.items():
+            events.append(dict(name='thread_name', ph='M', pid=1, tid=thread_id,
+                               args=dict(name=thread)))
+        with open(trace_file, 'w') as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+
+    def print_summary(self):
+        self.end_section()
+        print()
+        print("Time spent in sections:")
+        print()
+        print("  {:>9}  {:>9}  {:>8}  {}".format('wall (s)', 'cmds (s)', 'commands',
+                                                 'section'))
+        by_section = collections.defaultdict(list)
+        for record in self.commands:
+            by_section[record.section].append(record)
+        for section in self.sections:
+            records = by_section.pop(section.name, [])
+            print("  {:9.1f}  {:9.1f}  {:8d}  {}".format(
+                section.end - section.start,
+                sum(record.end - record.start for record in records),
+                len(records), section.name))
+        for name, records in by_section.items():
+            print("  {:>9}  {:9.1f}  {:8d}  {}".format(
+                '-', sum(record.end - record.start for record in records),
+                len(records), name))
+        print()
+        print("  {:9.1f}  total wall-clock time, {} commands".format(
+            time.time() - self._start, len(self.commands)))
+        print()
+
+
+DEFAULT_RUNNER = CommandRunner()
+
+
+def call(command, cwd=None, stdout=None, stderr=None):
+    return DEFAULT_RUNNER.call(command, cwd=cwd, stdout=stdout, stderr=stderr)
+
+
+def check_output(command, cwd=None, input=None, stderr=None):
+    return DEFAULT_RUNNER.check_output(command, cwd=cwd, input=input, stderr=stderr)
+
+
+def run(command, cwd=None, input=None, stdout=None, stderr=None):
+    return DEFAULT_RUNNER.run(command, cwd=cwd, input=input, stdout=stdout, stderr=stderr)
+
+
+def write_reports(directory, prefix='bootstrap'):
+    """Writes the log and trace of DEFAULT_RUNNER and prints the summary."""
+    DEFAULT_RUNNER.print_summary()
+    log_file = os.path.join(directory, prefix + '-commands.jsonl')
+    trace_file = os.path.join(directory, prefix + '-trace.json')
+    DEFAULT_RUNNER.write_log(log_file)
+    DEFAULT_RUNNER.write_trace(trace_file)
+    print("Commands are logged in {} and traced in {}".format(log_file, trace_file))
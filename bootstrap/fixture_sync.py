@@ -0,0 +1,160 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Uploads the test fixture files to the test buckets incrementally.
+
+Objects are compared by size and MD5 (the hash GCS reports for objects uploaded
+in one piece). Each bucket is listed once, only new or changed files are
+uploaded and every file is read once, no matter how many buckets it goes to.
+Directories can stand in for the buckets (--local-bucket-dir):
+
+  fixture_sync.py sync <FILES_DIR> [--bucket <BUCKET>]... [--local-bucket-dir <DIR>]...
+"""
+import argparse
+import base64
+import hashlib
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import command_runner
+
+DEFAULT_PARALLELISM = 8
+
+
+def _md5(content):
+    return base64.b64encode(hashlib.md5(content).digest()).decode('ascii')
+
+
+def _read_files(files_dir):
+    for name in sorted(os.listdir(files_dir)):
+        path = os.path.join(files_dir, name)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                content = f.read()
+            yield name, content, dict(size=len(content), md5=_md5(content))
+
+
+def build_local_manifest(files_dir):
+    """Returns {name: dict(size, md5)} of the files (not directories) in files_dir."""
+    return {name: entry for name, _, entry in _read_files(files_dir)}
+
+
+class GcsBucket(object):
+    """Bucket accessed with gsutil."""
+
+    def __init__(self, bucket_name):
+        self.name = bucket_name
+
+    def list_objects(self):
+        """Returns {name: dict(size, md5)} of the objects with a single listing."""
+        prefix = 'gs://{}/'.format(self.name)
+        returncode, out, err = command_runner.run(
+            ['gsutil', 'ls', '-L', prefix + '**'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if returncode != 0:
+            if b'matched no objects' in err:
+                return {}
+            raise subprocess.CalledProcessError(returncode, 'gsutil ls', output=err)
+        objects = {}
+        current = None
+        for line in out.decode('utf-8').splitlines():
+            if line.startswith(prefix) and line.endswith(':'):
+                current = objects.setdefault(line[len(prefix):-1], dict(size=None, md5=None))
+            elif current is not None and ':' in line:
+                key, value = [part.strip() for part in line.split(':', 1)]
+                if key == 'Content-Length':
+                    current['size'] = int(value)
+                elif key == 'Hash (md5)':
+                    current['md5'] = value
+        return objects
+
+    def upload(self, name, content):
+        command_runner.check_output(['gsutil', '-q', 'cp', '-',
+                                     'gs://{}/{}'.format(self.name, name)],
+                                    input=content)
+
+
+class DirectoryBucket(object):
+    """Stand-in for a bucket keeping the objects in a local directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.name = directory
+        self.uploads = []
+
+    def list_objects(self):
+        return build_local_manifest(self.directory) if os.path.isdir(self.directory) else {}
+
+    def upload(self, name, content):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with open(os.path.join(self.directory, name), 'wb') as f:
+            f.write(content)
+        self.uploads.append(name)
+
+
+def sync_files(files_dir, buckets, parallelism=DEFAULT_PARALLELISM, remote_objects=None):
+    """Uploads the new and changed files of files_dir to all buckets.
+
+    remote_objects ({bucket name: listing}) skips listing of the buckets already
+    listed. Returns {bucket name: names of the files uploaded}.
+    """
+    remote_objects = dict(remote_objects or {})
+    uploads = {bucket.name: [] for bucket in buckets}
+    with ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+        to_list = [bucket for bucket in buckets if bucket.name not in remote_objects]
+        remote_objects.update(zip([bucket.name for bucket in to_list],
+                                  executor.map(lambda bucket: bucket.list_objects(),
+                                               to_list)))
+        futures = []
+        for name, content, entry in _read_files(files_dir):
+            for bucket in buckets:
+                if remote_objects[bucket.name].get(name) != entry:
+                    uploads[bucket.name].append(name)
+                    futures.append(executor.submit(bucket.upload, name, content))
+        for future in futures:
+            future.result()
+    return uploads
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Uploads changed files to buckets.')
+    subparsers = parser.add_subparsers(dest='command')
+    sync_parser = subparsers.add_parser('sync', help='Uploads new and changed files')
+    sync_parser.add_argument('files_dir', help='Directory with the files')
+    sync_parser.add_argument('--bucket', '-b', action='append', default=[],
+                             help='Name of the GCS bucket')
+    sync_parser.add_argument('--local-bucket-dir', '-l', action='append', default=[],
+                             help='Directory used instead of a GCS bucket')
+    sync_parser.add_argument('--parallelism', '-j', type=int, default=DEFAULT_PARALLELISM,
+                             help='Maximum number of uploads at the same time')
+    args = parser.parse_args()
+
+    if args.command == 'sync':
+        if not args.bucket and not args.local_bucket_dir:
+            parser.error('--bucket or --local-bucket-dir is required')
+        sync_buckets = [GcsBucket(name) for name in args.bucket] + \
+            [DirectoryBucket(directory) for directory in args.local_bucket_dir]
+        sync_uploads = sync_files(args.files_dir, sync_buckets, parallelism=args.parallelism)
+        for sync_bucket in sync_buckets:
+            print("Uploaded {} changed files of {} to {}".format(
+                len(sync_uploads[sync_bucket.name]), args.files_dir, sync_bucket.name))
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,201 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Adds role bindings to the project IAM policy in a single write."""
+import base64
+import copy
+import fcntl
+import hashlib
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+
+import command_runner
+
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Status lines of gcloud errors returned when the etag of the policy is stale:
+# ERROR: (gcloud.projects.set-iam-policy) ABORTED: There were concurrent policy changes...
+CONFLICT_STATUS = 'ABORTED:'
+CONFLICT_MESSAGE = 'There were concurrent policy changes'
+
+
+class EtagConflictException(Exception):
+    """Raised when the policy was modified since it was read."""
+
+
+def is_conflict_error(error):
+    """Returns True if the gcloud error output reports a stale etag."""
+    for line in error.splitlines():
+        if (line.startswith('ERROR:') and CONFLICT_STATUS in line) or CONFLICT_MESSAGE in line:
+            return True
+    return False
+
+
+class IamPolicyBackend(object):
+    """Base class of the backends reading and writing the project policy."""
+
+    def get_policy(self):
+        raise NotImplementedError()
+
+    def set_policy(self, policy):
+        """Writes the policy if its etag is still current, else raises EtagConflictException."""
+        raise NotImplementedError()
+
+
+class GcloudIamPolicyBackend(IamPolicyBackend):
+    """Reads and writes the policy of the project using gcloud."""
+
+    def __init__(self, project_id):
+        self.project_id = project_id
+
+    def get_policy(self):
+        return json.loads(command_runner.check_output(
+            ['gcloud', 'projects', 'get-iam-policy', self.project_id,
+             '--format=json']).decode('utf-8'))
+
+    def set_policy(self, policy):
+        fd, policy_file = tempfile.mkstemp(suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(policy, f)
+            returncode, _, error = command_runner.run(
+                ['gcloud', 'projects', 'set-iam-policy', self.project_id, policy_file,
+                 '--format=json'],
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        finally:
+            os.remove(policy_file)
+        if returncode != 0:
+            error = error.decode('utf-8')
+            if is_conflict_error(error):
+                raise EtagConflictException(error)
+            raise Exception("Setting IAM policy of {} failed: {}".format(
+                self.project_id, error))
+
+
+class JsonFileIamPolicyBackend(IamPolicyBackend):
+    """Stand-in for the project policy kept in a local JSON file.
+
+    The etag is recomputed on every write, so writing a policy read before
+    another write fails the same way as in GCP. Checking the etag and writing
+    is done under a lock of <POLICY_FILE>.lock, so it is safe across threads
+    and processes.
+    """
+
+    def __init__(self, policy_file):
+        self.policy_file = policy_file
+        self.writes = 0
+        self.conflicts = 0
+
+    @staticmethod
+    def compute_etag(policy):
+        content = json.dumps(policy.get('bindings', []), sort_keys=True).encode('utf-8')
+        return base64.b64encode(hashlib.sha256(content).digest()[:8]).decode('ascii')
+
+    def get_policy(self):
+        if not os.path.exists(self.policy_file):
+            policy = dict(bindings=[], version=1)
+        else:
+            with open(self.policy_file) as f:
+                policy = json.load(f)
+        policy['etag'] = self.compute_etag(policy)
+        return policy
+
+    def set_policy(self, policy):
+        with open(self.policy_file + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if policy.get('etag') != self.get_policy()['etag']:
+                self.conflicts += 1
+                raise EtagConflictException("Policy of {} was modified concurrently".format(
+                    self.policy_file))
+            policy = dict(policy)
+            policy.pop('etag')
+            with open(self.policy_file + '.tmp', 'w') as f:
+                json.dump(policy, f, indent=2, sort_keys=True)
+            os.replace(self.policy_file + '.tmp', self.policy_file)
+        self.writes += 1
+
+
+def get_iam_policy_backend(project_id):
+    """Returns backend of the project policy.
+
+    AIRFLOW_BREEZE_IAM_POLICY_FILE replaces the policy of the project with
+    a local JSON file (for example when replaying the bootstrap).
+    """
+    policy_file = os.environ.get('AIRFLOW_BREEZE_IAM_POLICY_FILE')
+    if policy_file:
+        return JsonFileIamPolicyBackend(policy_file)
+    return GcloudIamPolicyBackend(project_id)
+
+
+def find_missing_bindings(policy, required_bindings):
+    """Returns (role, member) pairs of required_bindings not granted by the policy.
+
+    Conditional bindings are not taken into account - they do not grant the role
+    unconditionally.
+    """
+    granted = set()
+    for binding in policy.get('bindings', []):
+        if binding.get('condition'):
+            continue
+        for member in binding.get('members', []):
+            granted.add((binding['role'], member))
+    missing = []
+    for role, member in required_bindings:
+        if (role, member) not in granted and (role, member) not in missing:
+            missing.append((role, member))
+    return missing
+
+
+def add_bindings(policy, bindings):
+    """Returns copy of the policy with the bindings added."""
+    policy = copy.deepcopy(policy)
+    policy_bindings = policy.setdefault('bindings', [])
+    by_role = {binding['role']: binding for binding in policy_bindings
+               if not binding.get('condition')}
+    for role, member in bindings:
+        if role not in by_role:
+            by_role[role] = dict(role=role, members=[])
+            policy_bindings.append(by_role[role])
+        by_role[role]['members'].append(member)
+    return policy
+
+
+def apply_bindings(backend, required_bindings, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Grants the missing bindings with a single etag-guarded policy write.
+
+    The policy is read again and the write retried (with random backoff) when
+    it was modified concurrently. Returns the list of the added bindings.
+    """
+    for attempt in range(1, max_attempts + 1):
+        policy = backend.get_policy()
+        missing = find_missing_bindings(policy, required_bindings)
+        if not missing:
+            return []
+        try:
+            backend.set_policy(add_bindings(policy, missing))
+            return missing
+        except EtagConflictException:
+            if attempt == max_attempts:
+                raise
+            print("IAM policy was modified concurrently. Retrying ({}/{})".format(
+                attempt, max_attempts))
+            time.sleep(random.uniform(0.5, 1.5) * attempt)
+
@@ -0,0 +1,233 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Snapshots the state of the project and plans the changes needed to bootstrap it.
+
+The snapshot is taken with a handful of list calls run concurrently. The plan
+contains only the actions needed to reach the desired state, so reconfiguring
+an unchanged project does not run any modifying commands.
+"""
+import json
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import command_runner
+from fixture_sync import GcsBucket
+from task_graph import TaskGraph
+
+
+def _run_lines(command):
+    return [line.strip() for line in command_runner.check_output(
+        command, stderr=subprocess.DEVNULL).decode('utf-8').splitlines() if line.strip()]
+
+
+def _run_json(command):
+    return json.loads(command_runner.check_output(
+        command, stderr=subprocess.DEVNULL).decode('utf-8') or 'null')
+
+
+class ProjectSnapshot(object):
+    """Current state of the resources managed by the bootstrap.
+
+    Failing list calls (for example of an API which is not enabled yet) are
+    reported and result in empty state, so the resources are (re)created
+    as without the snapshot.
+    """
+
+    def __init__(self, project_id, keyring, key, location='global'):
+        self.project_id = project_id
+        self.keyring = keyring
+        self.key = key
+        self.location = location
+        self.project_number = None
+        self.enabled_services = set()
+        self.service_accounts = set()
+        self.keyrings = set()
+        self.keys = set()
+        self.buckets = set()
+        self.project_policy = {}
+        self.appspot_account_policy = {}
+        self.key_policy = {}
+        self.bucket_policies = {}
+        self.bucket_objects = {}
+        self.bucket_lifecycle_rules = {}
+
+    def _safe(self, description, function, default):
+        try:
+            return function()
+        except (subprocess.CalledProcessError, OSError, ValueError) as e:
+            sys.stderr.write("Could not list {}: {}\n".format(description, e))
+            return default
+
+    def _list_project_number(self):
+        lines = _run_lines(['gcloud', 'projects', 'describe', self.project_id,
+                            '--format=value(projectNumber)'])
+        return lines[0] if lines else None
+
+    def _list_enabled_services(self):
+        return set(_run_lines(['gcloud', 'services', 'list', '--enabled',
+                               '--project={}'.format(self.project_id),
+                               '--format=value(config.name)']))
+
+    def _list_service_accounts(self):
+        return set(_run_lines(['gcloud', 'iam', 'service-accounts', 'list',
+                               '--project={}'.format(self.project_id),
+                               '--format=value(email)']))
+
+    def _list_keyrings_and_keys(self):
+        keyrings = set(name.split('/')[-1] for name in _run_lines(
+            ['gcloud', 'kms', 'keyrings', 'list',
+             '--location={}'.format(self.location),
+             '--project={}'.format(self.project_id),
+             '--format=value(name)']))
+        keys = set()
+        if self.keyring in keyrings:
+            keys = set(name.split('/')[-1] for name in _run_lines(
+                ['gcloud', 'kms', 'keys', 'list',
+                 '--keyring={}'.format(self.keyring),
+                 '--location={}'.format(self.location),
+                 '--project={}'.format(self.project_id),
+                 '--format=value(name)']))
+        return keyrings, keys
+
+    def _list_buckets(self):
+        return set(line.rstrip('/')[len('gs://'):] for line in _run_lines(
+            ['gsutil', 'ls', '-p', self.project_id]))
+
+    def _get_project_policy(self, policy_backend):
+        return policy_backend.get_policy()
+
+    def _get_appspot_account_policy(self):
+        return _run_json(['gcloud', 'iam', 'service-accounts', 'get-iam-policy',
+                          '{}@appspot.gserviceaccount.com'.format(self.project_id),
+                          '--project={}'.format(self.project_id), '--format=json']) or {}
+
+    def _get_key_policy(self):
+        return _run_json(['gcloud', 'kms', 'keys', 'get-iam-policy', self.key,
+                          '--keyring={}'.format(self.keyring),
+                          '--location={}'.format(self.location),
+                          '--project={}'.format(self.project_id), '--format=json']) or {}
+
+    def _get_bucket_policy(self, bucket):
+        return _run_json(['gsutil', 'iam', 'get', 'gs://{}'.format(bucket)]) or {}
+
+    def _list_bucket_objects(self, bucket):
+        return GcsBucket(bucket).list_objects()
+
+    def _get_bucket_lifecycle_rules(self, bucket):
+        output = command_runner.check_output(
+            ['gsutil', 'lifecycle', 'get', 'gs://{}'.format(bucket)],
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+        # Buckets without the configuration print a message rather than JSON
+        return json.loads(output).get('rule', []) if output.startswith('{') else []
+
+    def take(self, policy_backend, buckets_to_inspect, parallelism, buckets_to_list=()):
+        """Lists the project resources and inspects the buckets which exist.
+
+        buckets_to_inspect is a list of bucket names for which IAM policy and
+        lifecycle rules are needed, objects are listed only in buckets_to_list.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+            futures = dict(
+                project_number=executor.submit(
+                    self._safe, 'project number', self._list_project_number, None),
+                enabled_services=executor.submit(
+                    self._safe, 'enabled services', self._list_enabled_services, set()),
+                service_accounts=executor.submit(
+                    self._safe, 'service accounts', self._list_service_accounts, set()),
+                keyrings_and_keys=executor.submit(
+                    self._safe, 'keyrings', self._list_keyrings_and_keys, (set(), set())),
+                buckets=executor.submit(
+                    self._safe, 'buckets', self._list_buckets, set()),
+                project_policy=executor.submit(
+                    self._safe, 'project IAM policy',
+                    lambda: self._get_project_policy(policy_backend), {}),
+                appspot_account_policy=executor.submit(
+                    self._safe, 'appspot account IAM policy',
+                    self._get_appspot_account_policy, {}),
+            )
+            self.project_number = futures['project_number'].result()
+            self.enabled_services = futures['enabled_services'].result()
+            self.service_accounts = futures['service_accounts'].result()
+            self.keyrings, self.keys = futures['keyrings_and_keys'].result()
+            self.buckets = futures['buckets'].result()
+            self.project_policy = futures['project_policy'].result()
+            self.appspot_account_policy = futures['appspot_account_policy'].result()
+
+            key_policy = None
+            if self.key in self.keys:
+                key_policy = executor.submit(self._safe, 'key IAM policy',
+                                             self._get_key_policy, {})
+            bucket_futures = {}
+            for bucket in buckets_to_inspect:
+                if bucket not in self.buckets:
+                    continue
+                bucket_futures[bucket] = (
+                    executor.submit(self._safe, 'IAM policy of ' + bucket,
+                                    lambda b=bucket: self._get_bucket_policy(b), {}),
+                    executor.submit(self._safe, 'objects of ' + bucket,
+                                    lambda b=bucket: self._list_bucket_objects(b), {})
+                    if bucket in buckets_to_list else None,
+                    executor.submit(self._safe, 'lifecycle rules of ' + bucket,
+                                    lambda b=bucket: self._get_bucket_lifecycle_rules(b), []))
+            self.key_policy = key_policy.result() if key_policy else {}
+            for bucket, (policy, objects, rules) in bucket_futures.items():
+                self.bucket_policies[bucket] = policy.result()
+                self.bucket_objects[bucket] = objects.result() if objects else {}
+                self.bucket_lifecycle_rules[bucket] = rules.result()
+        return self
+
+
+class Plan(object):
+    """Ordered list of actions with dependencies between them."""
+
+    def __init__(self):
+        self.task_graph = TaskGraph()
+        self.descriptions = []
+
+    def add(self, name, description, function, dependencies=(), group=None):
+        """Adds the action. Dependencies not in the plan (already satisfied) are ignored."""
+        self.descriptions.append(description)
+        return self.task_graph.add_task(
+            name, function,
+            dependencies=[dependency for dependency in dependencies
+                          if dependency in self.task_graph.tasks],
+            group=group)
+
+    def is_empty(self):
+        return not self.descriptions
+
+    def print_plan(self):
+        print()
+        if self.is_empty():
+            print("The project is up-to-date. Nothing to do.")
+        else:
+            print("Planned {} changes:".format(len(self.descriptions)))
+            print()
+            for description in self.descriptions:
+                print("  + {}".format(description))
+        print()
+
+    def execute(self, parallelism):
+        """Executes the actions and returns names of the groups which failed."""
+        if self.is_empty():
+            return []
+        self.task_graph.run(parallelism)
+        command_runner.DEFAULT_RUNNER.record_task_graph(self.task_graph)
+        self.task_graph.print_summary("applying the plan")
+        return self.task_graph.failed_groups()
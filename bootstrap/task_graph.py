@@ -0,0 +1,152 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Runs bootstrap steps concurrently respecting dependencies between them."""
+import collections
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class TaskFailedException(Exception):
+    """Raised by tasks to fail without printing the stack trace."""
+
+
+Task = collections.namedtuple('Task', ['name', 'function', 'dependencies', 'group'])
+
+
+class TaskGraph(object):
+    """Graph of tasks run on a pool of threads.
+
+    A task starts when all its dependencies succeeded. When a task fails (raises
+    an exception) all the tasks depending on it are skipped, the other tasks
+    continue to run. Tasks belong to groups (for example a service account) which
+    are used to summarize the results.
+    """
+
+    def __init__(self):
+        self.tasks = collections.OrderedDict()
+        self.statuses = {}
+        self.errors = {}
+        self.timings = {}
+
+    def add_task(self, name, function, dependencies=(), group=None):
+        if name in self.tasks:
+            raise Exception("Task {} is already added".format(name))
+        for dependency in dependencies:
+            if dependency not in self.tasks:
+                raise Exception("Task {} depends on unknown task {}".format(name, dependency))
+        self.tasks[name] = Task(name, function, tuple(dependencies), group or name)
+        return name
+
+    def _skip_dependants(self, failed_task_name):
+        for task in self.tasks.values():
+            if task.name not in self.statuses and failed_task_name in task.dependencies:
+                self.statuses[task.name] = SKIPPED
+                self.errors[task.name] = "{} did not succeed".format(failed_task_name)
+                self._skip_dependants(task.name)
+
+    def _run_task(self, task):
+        start = time.time()
+        try:
+            task.function()
+        finally:
+            self.timings[task.name] = (start, time.time())
+
+    def run(self, parallelism):
+        """Runs all tasks with at most parallelism of them at a time.
+
+        Returns dictionary of task name -> status.
+        """
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+            while True:
+                for task in self.tasks.values():
+                    if task.name in self.statuses or task.name in running.values():
+                        continue
+                    if all(self.statuses.get(dependency) == SUCCEEDED
+                           for dependency in task.dependencies):
+                        running[executor.submit(self._run_task, task)] = task.name
+                if not running:
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    task_name = running.pop(future)
+                    exception = future.exception()
+                    if exception is None:
+                        self.statuses[task_name] = SUCCEEDED
+                        continue
+                    self.statuses[task_name] = FAILED
+                    self.errors[task_name] = str(exception)
+                    if not isinstance(exception, TaskFailedException):
+                        traceback.print_exception(type(exception), exception,
+                                                  exception.__traceback__)
+                    self._skip_dependants(task_name)
+        return self.statuses
+
+    def critical_path(self):
+        """Returns length (in seconds) and names of the longest chain of dependent tasks run.
+
+        That is the time the graph would take with unlimited parallelism.
+        """
+        finish = {}
+        previous = {}
+        for task in self.tasks.values():
+            if task.name not in self.timings:
+                continue
+            # Dependencies are always added before the tasks depending on them
+            length, dependency = max(((finish[dependency], dependency)
+                                      for dependency in task.dependencies
+                                      if dependency in finish), default=(0, None))
+            start, end = self.timings[task.name]
+            finish[task.name] = length + end - start
+            previous[task.name] = dependency
+        if not finish:
+            return 0, []
+        name = max(finish, key=finish.get)
+        length = finish[name]
+        path = []
+        while name:
+            path.append(name)
+            name = previous[name]
+        return length, list(reversed(path))
+
+    def failed_groups(self):
+        return sorted(set(task.group for task in self.tasks.values()
+                          if self.statuses.get(task.name) != SUCCEEDED))
+
+    def print_summary(self, title):
+        print()
+        print("Summary of {}:".format(title))
+        print()
+        groups = collections.OrderedDict()
+        for task in self.tasks.values():
+            groups.setdefault(task.group, []).append(task)
+        for group, tasks in groups.items():
+            problems = [task for task in tasks if self.statuses.get(task.name) != SUCCEEDED]
+            if not problems:
+                print("  {}: OK".format(group))
+                continue
+            print("  {}: FAILED".format(group))
+            for task in problems:
+                print("      {} {}: {}".format(task.name, self.statuses.get(task.name),
+                                               self.errors.get(task.name)))
+        print()
@@ -30,13 +30,21 @@ export BUILD_ID="${BUILD_ID:=build}"
 
 export DOC_SOURCES_DIR=${DOC_SOURCES_DIR:=${AIRFLOW_SOURCES}/docs}
 export DOC_OUTPUT_DIR=${AIRFLOW_OUTPUT}/${BUILD_ID}/docs
+export DOC_ARCHIVE=${AIRFLOW_OUTPUT}/${BUILD_ID}/docs.gz
+# The summary page and Slack link to the archive (read it with log_archive.py
+# extract). Set it to true to also upload the browsable docs tree
+export AIRFLOW_BREEZE_COPY_DOCS_TREE=${AIRFLOW_BREEZE_COPY_DOCS_TREE:="false"}
 
 pushd ${DOC_SOURCES_DIR}
 
 ./build.sh
 
-mkdir -pv ${DOC_OUTPUT_DIR}
-rm -rvf ${DOC_OUTPUT_DIR}
-cp -rv ${DOC_SOURCES_DIR}/_build/html/ ${DOC_OUTPUT_DIR}
+python3 ${MY_DIR}/log_archive.py pack ${DOC_ARCHIVE} ${DOC_SOURCES_DIR}/_build/html
+
+rm -rf ${DOC_OUTPUT_DIR}
+if [[ "${AIRFLOW_BREEZE_COPY_DOCS_TREE}" == "true" ]]; then
+    mkdir -p $(dirname ${DOC_OUTPUT_DIR})
+    cp -r ${DOC_SOURCES_DIR}/_build/html/ ${DOC_OUTPUT_DIR}
+fi
 
 popd
@@ -31,11 +31,10 @@ export AIRFLOW_BREEZE_TEST_SUITES=${AIRFLOW_BREEZE_TEST_SUITES:=""}
 
 for AIRFLOW_BREEZE_TEST_SUITE in ${AIRFLOW_BREEZE_TEST_SUITES}; do
     export AIRFLOW_BREEZE_TEST_SUITE
-    # Re-source variables for test suite
-    set -a
-    source ${GCP_CONFIG_DIR}/variables.env
-    set +a
     echo "Creating CloudSQL database for test suite ${AIRFLOW_BREEZE_TEST_SUITE}"
-    python ${AIRFLOW_SOURCES}/tests/contrib/operators/test_gcp_sql_operator.py --action=create
+    # Variables are re-evaluated for the test suite by the loader shared with
+    # the IDE and bootstrap scripts
+    python ${AIRFLOW_HOME}/variables_env.py ${GCP_CONFIG_DIR}/variables.env -- \
+        python ${AIRFLOW_SOURCES}/tests/contrib/operators/test_gcp_sql_operator.py --action=create
     echo "Created CloudSQL database for test suite ${AIRFLOW_BREEZE_TEST_SUITE}"
 done
@@ -32,19 +32,12 @@ export LOG_OUTPUT_DIR=${AIRFLOW_OUTPUT}/${BUILD_ID}/logs/
 mkdir -pv ${LOG_OUTPUT_DIR}
 
 echo "Decrypting variables"
-bash ${AIRFLOW_HOME}/_decrypt_encrypted_variables.sh ${GCP_PROJECT_ID} \
-   > ${AIRFLOW_SOURCES}/decrypted_variables.env
+python3 ${AIRFLOW_HOME}/kms_decryption.py decrypt-environment \
+   --gcp-project-id ${GCP_PROJECT_ID} > ${AIRFLOW_SOURCES}/decrypted_variables.env
 echo "Decrypted variables. Number of variables decrypted: "\
      "$(wc -l ${AIRFLOW_SOURCES}/decrypted_variables.env)"
 
 echo "Decrypting keys from ${GCP_SERVICE_ACCOUNT_KEY_DIR}"
-pushd ${GCP_SERVICE_ACCOUNT_KEY_DIR}
-for FILE in *.json.enc *.pem.enc;
-do
-  gcloud kms decrypt --plaintext-file $(basename ${FILE} .enc) --ciphertext-file ${FILE} \
-     --location=global --keyring=airflow --key=airflow_crypto_key \
-     --project=${GCP_PROJECT_ID}\
-     && echo Decrypted ${FILE}
-done
-chmod -v og-rw *
-popd
+python3 ${AIRFLOW_HOME}/decrypt_files.py decrypt --gcp-project-id ${GCP_PROJECT_ID} \
+   --keys-dir ${GCP_SERVICE_ACCOUNT_KEY_DIR}
+chmod -v og-rw ${GCP_SERVICE_ACCOUNT_KEY_DIR}/*
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Packs directory trees into one compressed archive with a JSON index.
+
+Every file is a separate gzip member of the archive, so the archive is a
+valid .gz file and a single file can be read with a byte-range request of
+its member (curl -r <START>-<END> <URL> | gunzip). The index
+(<ARCHIVE>.index.json) maps the path of each file to the offset and length
+of its member and to its uncompressed size.
+
+  log_archive.py pack <ARCHIVE> [PREFIX=]<DIR>... [--exclude <PATH>]
+  log_archive.py list <ARCHIVE> [--url <URL OF THE ARCHIVE>]
+  log_archive.py cat <ARCHIVE> <PATH>
+  log_archive.py extract <ARCHIVE> <DIR>
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+import zlib
+
+INDEX_SUFFIX = '.index.json'
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_index_file(archive_file):
+    return archive_file + INDEX_SUFFIX
+
+
+def parse_source(source):
+    """Returns (prefix, directory) of the PREFIX=DIR or DIR source."""
+    if '=' in source:
+        prefix, directory = source.split('=', 1)
+        return prefix.strip('/'), directory
+    return '', source
+
+
+def find_files(directory, excludes):
+    """Yields (relative path, path) of files in the tree, sorted.
+
+    Files and directories are skipped if their path relative to the directory
+    is one of the excludes - 'scheduler' skips only <DIR>/scheduler.
+    """
+    excludes = set(exclude.strip('/') for exclude in excludes)
+    for root, dirs, files in os.walk(directory):
+        relative_root = os.path.relpath(root, directory)
+
+        def get_relative_path(name):
+            return name if relative_root == os.curdir else \
+                '/'.join(relative_root.split(os.sep) + [name])
+
+        dirs[:] = sorted(name for name in dirs if get_relative_path(name) not in excludes)
+        for name in sorted(files):
+            relative_path = get_relative_path(name)
+            if relative_path not in excludes:
+                yield relative_path, os.path.join(root, name)
+
+
+def pack(archive_file, sources, excludes=()):
+    """Writes the archive and its index. Returns the index."""
+    files = {}
+    archive_dir = os.path.dirname(os.path.abspath(archive_file))
+    if not os.path.isdir(archive_dir):
+        os.makedirs(archive_dir)
+    temporary_file = archive_file + '.tmp'
+    with open(temporary_file, 'wb') as archive:
+        for prefix, directory in sources:
+            if not os.path.isdir(directory):
+                print("Skipping missing directory {}".format(directory))
+                continue
+            for relative_path, path in find_files(directory, excludes):
+                archive_path = '/'.join(part for part in [prefix, relative_path] if part)
+                offset = archive.tell()
+                with open(path, 'rb') as source_file, \
+                        gzip.GzipFile(filename=archive_path, mode='wb', fileobj=archive,
+                                      mtime=int(os.path.getmtime(path))) as member:
+                    shutil.copyfileobj(source_file, member, CHUNK_SIZE)
+                    size = source_file.tell()
+                files[archive_path] = dict(offset=offset, length=archive.tell() - offset,
+                                           size=size)
+    os.replace(temporary_file, archive_file)
+    index = dict(archive=os.path.basename(archive_file), files=files)
+    with open(get_index_file(archive_file) + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(get_index_file(archive_file) + '.tmp', get_index_file(archive_file))
+    return index
+
+
+def read_index(archive_file):
+    with open(get_index_file(archive_file)) as f:
+        return json.load(f)
+
+
+def copy_member(archive, entry, output):
+    """Decompresses the member of the entry to the output, chunk by chunk."""
+    archive.seek(entry['offset'])
+    remaining = entry['length']
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while remaining > 0:
+        chunk = archive.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise Exception("The archive {} is truncated".format(archive.name))
+        remaining -= len(chunk)
+        output.write(decompressor.decompress(chunk))
+    output.write(decompressor.flush())
+
+
+def cat_file(archive_file, path, output):
+    entry = read_index(archive_file)['files'].get(path)
+    if entry is None:
+        raise Exception("There is no {} in {}".format(path, archive_file))
+    with open(archive_file, 'rb') as archive:
+        copy_member(archive, entry, output)
+
+
+def get_destination(destination_dir, path):
+    """Returns where the file of the index is extracted to.
+
+    The index comes with the archive, so absolute paths and '..' are rejected
+    to keep the files inside the destination directory.
+    """
+    parts = path.split('/')
+    if os.path.isabs(path) or any(part in ('', os.curdir, os.pardir) for part in parts):
+        raise Exception("Refusing to extract {} outside of {}".format(path, destination_dir))
+    return os.path.join(destination_dir, *parts)
+
+
+def extract(archive_file, destination_dir):
+    index = read_index(archive_file)
+    destinations = {path: get_destination(destination_dir, path) for path in index['files']}
+    with open(archive_file, 'rb') as archive:
+        for path, entry in sorted(index['files'].items()):
+            destination = destinations[path]
+            if not os.path.isdir(os.path.dirname(destination)):
+                os.makedirs(os.path.dirname(destination))
+            with open(destination, 'wb') as output:
+                copy_member(archive, entry, output)
+    return len(index['files'])
+
+
+def print_index(index, url=None):
+    for path, entry in sorted(index['files'].items()):
+        if url:
+            print("curl -s -r {}-{} {} | gunzip  # {}".format(
+                entry['offset'], entry['offset'] + entry['length'] - 1, url, path))
+        else:
+            print("{:>12} {:>12} {:>12}  {}".format(entry['size'], entry['offset'],
+                                                    entry['length'], path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Packs directory trees into one compressed, indexed archive.')
+    subparsers = parser.add_subparsers(dest='command')
+    pack_parser = subparsers.add_parser('pack', help='Packs the directories')
+    pack_parser.add_argument('archive', help='Archive to write')
+    pack_parser.add_argument('sources', nargs='+',
+                             help='Directories to pack, optionally as PREFIX=DIR')
+    pack_parser.add_argument('--exclude', '-e', action='append', default=[],
+                             help='Path of a file or directory to skip, relative to '
+                                  'the packed directory')
+    list_parser = subparsers.add_parser('list', help='Lists files of the archive')
+    list_parser.add_argument('archive', help='Archive file')
+    list_parser.add_argument('--url', help='URL of the archive - prints range requests')
+    cat_parser = subparsers.add_parser('cat', help='Prints a file of the archive')
+    cat_parser.add_argument('archive', help='Archive file')
+    cat_parser.add_argument('path', help='Path of the file in the archive')
+    extract_parser = subparsers.add_parser('extract', help='Extracts all files')
+    extract_parser.add_argument('archive', help='Archive file')
+    extract_parser.add_argument('destination', help='Directory to extract to')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        archive_index = pack(args.archive, [parse_source(source) for source in args.sources],
+                             set(args.exclude))
+        print("Packed {} files ({} bytes) into {} ({} bytes)".format(
+            len(archive_index['files']),
+            sum(entry['size'] for entry in archive_index['files'].values()),
+            args.archive, os.path.getsize(args.archive)))
+    elif args.command == 'list':
+        print_index(read_index(args.archive), args.url)
+    elif args.command == 'cat':
+        cat_file(args.archive, args.path, sys.stdout.buffer)
+    elif args.command == 'extract':
+        print("Extracted {} files to {}".format(extract(args.archive, args.destination),
+                                                args.destination))
+    else:
+        parser.print_help()
+        sys.exit(1)
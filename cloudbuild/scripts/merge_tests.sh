@@ -28,10 +28,65 @@ export AIRFLOW_OUTPUT="${AIRFLOW_SOURCES}/output"
 export BUILD_ID="${BUILD_ID:=build}"
 
 export TEST_OUTPUT_DIR=${AIRFLOW_OUTPUT}/${BUILD_ID}/tests
+export AIRFLOW_BREEZE_TEST_DURATIONS_DB="${AIRFLOW_BREEZE_TEST_DURATIONS_DB:=${AIRFLOW_OUTPUT}/test_durations.sqlite}"
+# The database of all builds is kept in the build bucket (only locally if empty)
+if [[ -n "${AIRFLOW_BREEZE_GCP_BUILD_BUCKET:-}" ]]; then
+    DEFAULT_TEST_DURATIONS_URL="gs://${AIRFLOW_BREEZE_GCP_BUILD_BUCKET}/test_durations.sqlite"
+fi
+export AIRFLOW_BREEZE_TEST_DURATIONS_URL="${AIRFLOW_BREEZE_TEST_DURATIONS_URL:=${DEFAULT_TEST_DURATIONS_URL:-}}"
+MAX_TEST_DURATIONS_UPLOADS=3
+
+function ingest_test_durations() {
+    for PREFIX in "$@"; do
+        python3 ${MY_DIR}/test_durations.py ingest \
+            --build-id ${BUILD_ID} \
+            --commit "${COMMIT_SHA:-}" \
+            --branch "${BRANCH_NAME:-}" \
+            --suite ${PREFIX} \
+            ${TEST_OUTPUT_DIR} || echo "Could not store the test durations of ${PREFIX}"
+    done
+}
+
+# Downloads the database, ingests this build and uploads it unless another build
+# uploaded it in the meantime (generation 0 means that the object does not exist).
+# Ingesting a build again replaces it, so the whole cycle is retried then.
+function sync_test_durations() {
+    for ATTEMPT in $(seq 1 ${MAX_TEST_DURATIONS_UPLOADS}); do
+        rm -f ${AIRFLOW_BREEZE_TEST_DURATIONS_DB}
+        GENERATION=$(gsutil stat ${AIRFLOW_BREEZE_TEST_DURATIONS_URL} 2>/dev/null \
+            | awk '/Generation:/ {print $2}' || true)
+        if [[ -n "${GENERATION}" ]]; then
+            gsutil -q cp "${AIRFLOW_BREEZE_TEST_DURATIONS_URL}#${GENERATION}" \
+                ${AIRFLOW_BREEZE_TEST_DURATIONS_DB} || continue
+        fi
+        ingest_test_durations "$@"
+        if gsutil -q -h "x-goog-if-generation-match:${GENERATION:-0}" \
+                cp ${AIRFLOW_BREEZE_TEST_DURATIONS_DB} ${AIRFLOW_BREEZE_TEST_DURATIONS_URL}; then
+            return 0
+        fi
+        echo "Test durations were uploaded by another build. Retrying (${ATTEMPT}/${MAX_TEST_DURATIONS_UPLOADS})"
+    done
+    echo "Could not upload the test durations to ${AIRFLOW_BREEZE_TEST_DURATIONS_URL}"
+}
 
 for PREFIX in $@; do
     export MERGED_XUNIT_FILE=${TEST_OUTPUT_DIR}/${PREFIX}.xml
-    xunitmerge ${TEST_OUTPUT_DIR}/${PREFIX}-*.xml ${MERGED_XUNIT_FILE}
-
-    junit2html ${MERGED_XUNIT_FILE} ${MERGED_XUNIT_FILE}.html
+    # Streams the testcases once, writing the merged xunit file, HTML report
+    # and JSON summary (totals, per-module counts and failed tests)
+    python3 ${MY_DIR}/merge_xunit.py \
+        --name ${PREFIX} \
+        --output ${MERGED_XUNIT_FILE} \
+        --html ${MERGED_XUNIT_FILE}.html \
+        --summary ${TEST_OUTPUT_DIR}/${PREFIX}.summary.json \
+        ${TEST_OUTPUT_DIR}/${PREFIX}-*.xml
 done
+
+if [[ -n "${AIRFLOW_BREEZE_TEST_DURATIONS_URL}" ]]; then
+    sync_test_durations "$@"
+else
+    ingest_test_durations "$@"
+fi
+
+# Informational only - slower tests do not fail the build
+python3 ${MY_DIR}/test_durations.py regressions --build-id ${BUILD_ID} || true
+python3 ${MY_DIR}/test_durations.py slowest --build-id ${BUILD_ID} || true
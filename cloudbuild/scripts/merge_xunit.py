@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Merges xunit files into one test suite, with HTML report and JSON summary.
+
+The input files are parsed incrementally and every testcase is written out
+(and dropped) as soon as it is read, so only one testcase is kept in memory
+at a time. The testcases go to temporary body files first - the totals of
+the suite are known at the end and are written in the header of the merged
+XML and HTML files, followed by the bodies.
+
+  merge_xunit.py -n <SUITE> -o <MERGED XML> [--html <HTML>] [--summary <JSON>] XML...
+"""
+import argparse
+import html
+import io
+import json
+import os
+import shutil
+import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import quoteattr
+
+PASSED = 'passed'
+FAILED = 'failed'
+ERROR = 'error'
+SKIPPED = 'skipped'
+
+# Child elements of a testcase marking its status
+STATUS_ELEMENTS = [('failure', FAILED), ('error', ERROR), ('skipped', SKIPPED)]
+
+# Maximum length of a failure message kept in the JSON summary
+MAX_SUMMARY_MESSAGE_LENGTH = 500
+
+HTML_HEADER = """<!doctype html>
+<html lang="en">
+<head>
+  <meta charset="utf-8">
+  <title>{name} test results</title>
+  <style>
+    body {{ font-family: sans-serif; }}
+    table {{ border-collapse: collapse; }}
+    td, th {{ border: 1px solid #ccc; padding: 2px 6px; text-align: left; vertical-align: top; }}
+    .passed {{ color: green; }}
+    .failed, .error {{ color: red; }}
+    .skipped {{ color: gray; }}
+    pre {{ white-space: pre-wrap; max-width: 120em; }}
+  </style>
+</head>
+<body>
+  <h1>{name} test results</h1>
+  <p>Tests: {tests}, failures: {failures}, errors: {errors}, skipped: {skipped},
+     time: {time:.3f}s</p>
+  <table>
+    <tr><th>Status</th><th>Class</th><th>Test</th><th>Time (s)</th></tr>
+"""
+
+HTML_FOOTER = """  </table>
+</body>
+</html>
+"""
+
+
+class SuiteTotals(object):
+    """Counts of the testcases of the merged suite and of each input file."""
+
+    def __init__(self):
+        self.tests = 0
+        self.failures = 0
+        self.errors = 0
+        self.skipped = 0
+        self.time = 0.0
+
+    def add(self, status, seconds):
+        self.tests += 1
+        self.failures += status == FAILED
+        self.errors += status == ERROR
+        self.skipped += status == SKIPPED
+        self.time += seconds
+
+    def as_dict(self):
+        return dict(tests=self.tests, failures=self.failures, errors=self.errors,
+                    skipped=self.skipped, time=round(self.time, 3))
+
+
+def get_status(testcase):
+    """Returns the status of the testcase and the element describing it (or None)."""
+    for tag, status in STATUS_ELEMENTS:
+        element = testcase.find(tag)
+        if element is not None:
+            return status, element
+    return PASSED, None
+
+
+def iterate_testcases(xunit_file):
+    """Yields the testcases of the file, each removed from its parent afterwards."""
+    parents = []
+    for event, element in ElementTree.iterparse(xunit_file, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag == 'testcase':
+            yield element
+            if parents:
+                parents[-1].remove(element)
+
+
+def write_html_testcase(html_body, testcase, status, status_element):
+    html_body.write('    <tr class="{status}"><td>{status}</td><td>{classname}</td>'
+                    '<td>{name}</td><td>{time}</td></tr>\n'.format(
+                        status=status,
+                        classname=html.escape(testcase.get('classname', '')),
+                        name=html.escape(testcase.get('name', '')),
+                        time=html.escape(testcase.get('time', ''))))
+    if status_element is None:
+        return
+    details = [status_element.get('message', ''), status_element.text or '']
+    for output_tag in ['system-out', 'system-err']:
+        output = testcase.find(output_tag)
+        if output is not None and output.text:
+            details.append('{}:\n{}'.format(output_tag, output.text))
+    html_body.write('    <tr class="{}"><td colspan="4"><details><summary>{}</summary>'
+                    '<pre>{}</pre></details></td></tr>\n'.format(
+                        status, html.escape(status_element.get('type', status)),
+                        html.escape('\n'.join(detail for detail in details if detail))))
+
+
+def merge(xunit_files, xml_body, html_body):
+    """Writes testcases of the files to the bodies.
+
+    Returns (totals of the suite, {file: totals}, [failed testcases]).
+    """
+    totals = SuiteTotals()
+    file_totals = {}
+    failed_tests = []
+    for xunit_file in xunit_files:
+        totals_of_file = file_totals[os.path.basename(xunit_file)] = SuiteTotals()
+        for testcase in iterate_testcases(xunit_file):
+            status, status_element = get_status(testcase)
+            seconds = float(testcase.get('time') or 0)
+            totals.add(status, seconds)
+            totals_of_file.add(status, seconds)
+            if status in [FAILED, ERROR]:
+                failed_tests.append(dict(
+                    classname=testcase.get('classname', ''), name=testcase.get('name', ''),
+                    status=status, file=os.path.basename(xunit_file),
+                    message=(status_element.get('message') or
+                             '')[:MAX_SUMMARY_MESSAGE_LENGTH]))
+            testcase.tail = None
+            xml_body.write(ElementTree.tostring(testcase, encoding='unicode'))
+            xml_body.write('\n')
+            if html_body:
+                write_html_testcase(html_body, testcase, status, status_element)
+    return totals, file_totals, failed_tests
+
+
+def write_with_header(output_file, header, body_file, footer):
+    """Writes the header, the body (copied in chunks) and the footer, atomically."""
+    temporary_file = output_file + '.tmp'
+    with io.open(temporary_file, 'w', encoding='utf-8') as output:
+        output.write(header)
+        body_file.seek(0)
+        shutil.copyfileobj(body_file, output)
+        output.write(footer)
+    os.replace(temporary_file, output_file)
+
+
+def merge_files(name, xunit_files, output_file, html_file=None, summary_file=None):
+    body_prefix = output_file + '.body'
+    xml_body = io.open(body_prefix + '.xml', 'w+', encoding='utf-8')
+    html_body = io.open(body_prefix + '.html', 'w+', encoding='utf-8') if html_file else None
+    try:
+        totals, file_totals, failed_tests = merge(xunit_files, xml_body, html_body)
+        write_with_header(
+            output_file,
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<testsuite name={} tests="{}" errors="{}" failures="{}" skip="{}" '
+            'time="{:.3f}">\n'.format(quoteattr(name), totals.tests, totals.errors,
+                                      totals.failures, totals.skipped, totals.time),
+            xml_body, '</testsuite>\n')
+        if html_file:
+            write_with_header(html_file, HTML_HEADER.format(name=html.escape(name),
+                                                            **totals.as_dict()),
+                              html_body, HTML_FOOTER)
+    finally:
+        for body in [xml_body, html_body]:
+            if body:
+                body.close()
+                os.remove(body.name)
+    if summary_file:
+        summary = dict(name=name, failed_tests=failed_tests,
+                       files={file_name: file_totals[file_name].as_dict()
+                              for file_name in sorted(file_totals)},
+                       **totals.as_dict())
+        with open(summary_file + '.tmp', 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        os.replace(summary_file + '.tmp', summary_file)
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merges xunit files into one test suite.')
+    parser.add_argument('xunit_files', nargs='*', help='Xunit files to merge')
+    parser.add_argument('--name', '-n', required=True, help='Name of the merged test suite')
+    parser.add_argument('--output', '-o', required=True, help='Merged xunit file to write')
+    parser.add_argument('--html', help='HTML report to write')
+    parser.add_argument('--summary', help='JSON summary to write')
+    args = parser.parse_args()
+
+    existing_files = [xunit_file for xunit_file in args.xunit_files
+                      if os.path.isfile(xunit_file)]
+    for missing_file in sorted(set(args.xunit_files) - set(existing_files)):
+        print("Skipping missing {}".format(missing_file))
+    suite_totals = merge_files(args.name, existing_files, args.output, args.html,
+                               args.summary)
+    print("Merged {} files of {}: {} tests, {} failures, {} errors, {} skipped".format(
+        len(existing_files), args.name, suite_totals.tests, suite_totals.failures,
+        suite_totals.errors, suite_totals.skipped))
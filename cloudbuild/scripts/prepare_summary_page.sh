@@ -40,81 +40,8 @@ export TAG_NAME=${TAG_NAME:-""}
 export BRANCH_NAME=${BRANCH_NAME:-""}
 export COMMIT_SHA=${COMMIT_SHA:-""}
 
-TEST_ENV_SUMMARY=""
+mkdir -pv ${HTML_OUTPUT_DIR}
 
-FAILED="false"
-
-for AIRFLOW_BREEZE_TEST_SUITE in ${AIRFLOW_BREEZE_TEST_SUITES}
-do
-    ENVIRONMENT_STATUS="<font color=\"green\">Passed</font>"
-    set +e
-    ls ${TEST_OUTPUT_DIR}/${AIRFLOW_BREEZE_TEST_SUITE}-*-failure.txt
-    FAILURE_FILES_EXIST=$?
-    set -e
-    if [[ "${FAILURE_FILES_EXIST}" == "0" ]]; then
-        ENVIRONMENT_STATUS="<font color=\"red\">Failed!</font>"
-        FAILED="true"
-    fi
-    TEST_ENV_SUMMARY="""${TEST_ENV_SUMMARY}
-                       <li><a href=\"https://storage.googleapis.com/${AIRFLOW_BREEZE_GCP_BUILD_BUCKET}/${BUILD_ID}/tests/${AIRFLOW_BREEZE_TEST_SUITE}.xml.html\">
- ${AIRFLOW_BREEZE_TEST_SUITE} test results</a>:  ${ENVIRONMENT_STATUS}</li>
-"""
-done
-
-STATUS="Overall status: <font color=\"green\">Passed!</font>"
-
-if [[ ${FAILED} == "true" ]]; then
-    STATUS="Overall status: <font color=\"red\">Failed!</font>"
-fi
-
-export GITHUB_COMMIT_API_URL=https://api.github.com/repos/${AIRFLOW_BREEZE_GITHUB_ORGANIZATION}/${AIRFLOW_REPO_NAME}/commits/${COMMIT_SHA}
-curl -s ${GITHUB_COMMIT_API_URL} >/tmp/commit.json
-export COMMIT_MESSAGE=$(cat /tmp/commit.json | jq -r ".commit.message" | head -n 1)
-export COMMITTER=$(cat /tmp/commit.json | jq -r ".commit.committer.name")
-export AUTHOR=$(cat /tmp/commit.json | jq -r ".commit.author.name")
-
-export CURRENT_DATE=$(date)
-
-export HTML_CONTENT="""
-<!doctype html>
-<html lang="en">
-<head>
-  <meta charset="utf-8">
-
-  <title>Summary page for the ${AIRFLOW_REPO_NAME} ${BRANCH_NAME} build ${BUILD_ID} in project ${GCP_PROJECT_ID}</title>
-  <meta name=\"description\" content=\"Summary page for the ${AIRFLOW_REPO_NAME} ${BRANCH_NAME} build ${BUILD_ID}\">
-
-</head>
-
-    <body>
-
-          <h1>${AIRFLOW_REPO_NAME}[${BRANCH_NAME}] - ${CURRENT_DATE}</h1>
-          <h2>${STATUS}</h2>
-          <h2>Build info:</h2>
-          <ul>
-              <li>GCP project id: ${GCP_PROJECT_ID}</li>
-              <li>Build id: ${BUILD_ID}</li>
-              <li>Build time and date: ${CURRENT_DATE}</li>
-              <li>Branch name: ${BRANCH_NAME}</li>
-              <li>Tag name: ${TAG_NAME}</li>
-              <li>Commit SHA: ${COMMIT_SHA}</li>
-              <li>Commit message: ${COMMIT_MESSAGE}</li>
-              <li>Committer: ${COMMITTER}</li>
-              <li>Author: ${AUTHOR}</li>
-         </ul>
-          <h2>Links:</h2>
-          <ul>
-            <li><a href=\"https://console.cloud.google.com/cloud-build/builds/${BUILD_ID}?project=${GCP_PROJECT_ID}\">Google Cloud Build</a></li>
-            <li><a href=\"https://console.cloud.google.com/storage/browser/${AIRFLOW_BREEZE_GCP_BUILD_BUCKET}/${BUILD_ID}/logs/?project=${GCP_PROJECT_ID}\">Task logs in GCS bucket</a></li>
-            <li><a href=\"https://console.cloud.google.com/logs/viewer?authuser=0&project=${GCP_PROJECT_ID}&minLogLevel=0&expandAll=false&resource=build%2Fbuild_id%2F${BUILD_ID}\">Stackdriver logs</a></li>
-            <li><a href=\"https://storage.googleapis.com/${AIRFLOW_BREEZE_GCP_BUILD_BUCKET}/${BUILD_ID}/docs/index.html\">Generated documentation</a></li>
-            <li>Branch: <a href=\"https://github.com/${AIRFLOW_BREEZE_GITHUB_ORGANIZATION}/${AIRFLOW_REPO_NAME}/tree/${BRANCH_NAME}\">GitHub ${AIRFLOW_REPO_NAME}: ${BRANCH_NAME}</a></li>
-            <li>Commit: <a href=\"https://github.com/${AIRFLOW_BREEZE_GITHUB_ORGANIZATION}/${AIRFLOW_REPO_NAME}/commit/${COMMIT_SHA}\">${COMMIT_MESSAGE}</a></li>
-            ${TEST_ENV_SUMMARY}
-            <li><a href=\"https://storage.googleapis.com/${AIRFLOW_BREEZE_GCP_BUILD_BUCKET}/${BUILD_ID}/build_resource.json\">Build Resource (for Cloud Function Triggering)</a></li>
-          </ul>
-    </body>
-</html>
-"""
-
-echo "${HTML_CONTENT}" > ${HTML_OUTPUT_DIR}/index.html
+# Per-suite statistics come from the xunit files and the results manifest.
+# Commit metadata is cached and read with git log before asking GitHub.
+python3 ${MY_DIR}/summary_page.py
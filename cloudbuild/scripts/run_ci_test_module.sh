@@ -0,0 +1,106 @@
+#!/usr/bin/env bash
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Runs the tests of a single module (with its 'before-tests' and 'after-tests'
+# helper) - called by schedule_ci_tests.py from the AIRFLOW_SOURCES directory.
+# Exits with 1 if the tests failed.
+
+set -euo pipefail
+set -x
+
+MY_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
+
+MODULE_TO_TEST=${1}
+
+export AIRFLOW_BREEZE_TEST_SUITE="${AIRFLOW_BREEZE_TEST_SUITE:=none}"
+export AIRFLOW_SOURCES="${AIRFLOW_SOURCES:=/workspace}"
+
+echo "Running tests for '" ${MODULE_TO_TEST} "'"
+export XUNIT_FILE=${TEST_OUTPUT_DIR}/${AIRFLOW_BREEZE_TEST_SUITE}-${MODULE_TO_TEST}.xml
+
+mkdir -pv $(dirname ${XUNIT_FILE})
+rm -fv ${XUNIT_FILE} ${XUNIT_FILE}.html
+
+NOSE_ARGS="${MODULE_TO_TEST}"
+
+# Add coverage if all tests are run
+if [[ "${MODULE_TO_TEST}" == "." ]]; then
+    NOSE_ARGS="--with-coverage \
+    --cover-erase \
+    --cover-html \
+    --cover-package=airflow \
+    --cover-html-dir=${AIRFLOW_SOURCES}/airflow/www/static/coverage"
+fi
+
+# Add common parameters to nose
+NOSE_ARGS="${NOSE_ARGS} \
+--with-xunit \
+--xunit-file=${XUNIT_FILE} \
+--xunit-testsuite-name=${AIRFLOW_BREEZE_TEST_SUITE} \
+--with-ignore-docstrings \
+--rednose \
+--debug=tests \
+--with-timer \
+-v \
+--logging-level=DEBUG "
+
+echo "Starting the unit tests with the following nose arguments: "${NOSE_ARGS}
+
+# We do not fail if the tests fail as we want to do post-processing and
+# send results anyway, but we mark the test as failed
+set +e
+
+FAILED="false"
+MODULE_START=${SECONDS}
+
+MODULE_PATH=$(echo ${MODULE_TO_TEST} | tr '.' '/')
+HELPER_PATH="./${MODULE_PATH}_helper.py"
+
+if [[ -f ${HELPER_PATH} ]]; then
+    echo "Running 'before-tests' for the ${MODULE_TO_TEST} using ${HELPER_PATH}"
+    ${HELPER_PATH} --action before-tests
+else
+    echo "Helper ${HELPER_PATH} does not exist. Skipping 'before-tests'"
+fi
+nosetests ${NOSE_ARGS}
+if [[ $? != 0 ]]; then
+    FAILED="true"
+fi
+if [[ -f ${HELPER_PATH} ]]; then
+    echo "Running 'after-tests' for the ${MODULE_TO_TEST} using ${HELPER_PATH}"
+    ${HELPER_PATH} --action after-tests
+else
+    echo "Helper ${HELPER_PATH} does not exist. Skipping 'after-tests'"
+fi
+set -e
+
+MODULE_STATUS="passed"
+if [[ "${FAILED}" == "true" ]]; then
+    MODULE_STATUS="failed"
+fi
+python3 ${MY_DIR}/test_results.py record-module \
+    --suite ${AIRFLOW_BREEZE_TEST_SUITE} \
+    --module ${MODULE_TO_TEST} \
+    --status ${MODULE_STATUS} \
+    --xunit-file ${XUNIT_FILE} \
+    --duration $(( SECONDS - MODULE_START ))
+
+if [[ "${FAILED}" == "true" ]]; then
+    exit 1
+fi
@@ -34,6 +34,8 @@ export LOG_OUTPUT_DIR=/logs/
 
 mkdir -pv ${AIRFLOW_HOME}/logs
 rm -rvf ${AIRFLOW_HOME}/logs/*
+# Homes of the parallel workers of previous runs (their logs would be packed)
+rm -rf ${AIRFLOW_HOME}/ci-workers
 mkdir -pv ${LOG_OUTPUT_DIR}
 rm -rvf ${LOG_OUTPUT_DIR}/*
 
@@ -43,6 +45,20 @@ export PYTHONPATH=${PYTHONPATH:=""}:${AIRFLOW_SOURCES}/tests/test_utils
 # Generate the `airflow` executable if needed
 which airflow > /dev/null || python setup.py develop
 
+export AIRFLOW_BREEZE_CI_TEST_WORKERS="${AIRFLOW_BREEZE_CI_TEST_WORKERS:=1}"
+export TEST_PLAN_FILE=${AIRFLOW_HOME}/ci-test-plan-${AIRFLOW_BREEZE_TEST_SUITE}.json
+
+# The plan uses durations from the XML files of previous builds, so it is
+# prepared before the XML files of this suite are removed
+echo "Assign test modules to ${AIRFLOW_BREEZE_CI_TEST_WORKERS} worker(s)"
+python3 ${MY_DIR}/schedule_ci_tests.py plan \
+    --suite ${AIRFLOW_BREEZE_TEST_SUITE} \
+    --workers ${AIRFLOW_BREEZE_CI_TEST_WORKERS} \
+    --history "${TEST_OUTPUT_DIR}" \
+    --history "${AIRFLOW_OUTPUT}/*/tests" \
+    --output ${TEST_PLAN_FILE} \
+    ${AIRFLOW_BREEZE_CI_TEST_MODULES:=""}
+
 echo "Remove output XML files with ${TEST_OUTPUT_DIR}/${AIRFLOW_BREEZE_TEST_SUITE} prefix"
 rm -rfv ${TEST_OUTPUT_DIR}/${AIRFLOW_BREEZE_TEST_SUITE}-*.xml
 echo "Remove all symlinked DAGs with ${AIRFLOW_HOME}/dags/ prefix"
@@ -52,85 +68,36 @@ pushd ${AIRFLOW_SOURCES}
 
 FAILED="false"
 
-export TEST_SUITE_FAILURE_FILE=${TEST_OUTPUT_DIR}/${AIRFLOW_BREEZE_TEST_SUITE}-failure.txt
-export TEST_SUITE_SUCCESS_FILE=${TEST_OUTPUT_DIR}/${AIRFLOW_BREEZE_TEST_SUITE}-success.txt
-rm -f ${TEST_SUITE_FAILURE_FILE}
-rm -f ${TEST_SUITE_SUCCESS_FILE}
-
-for MODULE_TO_TEST in ${AIRFLOW_BREEZE_CI_TEST_MODULES:=""}; do
-    if [[ ${MODULE_TO_TEST} == "" ]]; then
-       continue
-    fi
-    echo "Running tests for '" ${MODULE_TO_TEST} "'"
-    export XUNIT_FILE=${TEST_OUTPUT_DIR}/${AIRFLOW_BREEZE_TEST_SUITE}-${MODULE_TO_TEST}.xml
-    export TEST_FAILURE_FILE=${TEST_OUTPUT_DIR}/${AIRFLOW_BREEZE_TEST_SUITE}-${MODULE_TO_TEST}-failure.txt
-
-    mkdir -pv $(dirname ${XUNIT_FILE})
-    rm -fv ${XUNIT_FILE} ${XUNIT_FILE}.html
-
-    mkdir -pv $(dirname ${TEST_FAILURE_FILE})
-    rm -fv ${TEST_FAILURE_FILE}
-
-    NOSE_ARGS="${MODULE_TO_TEST}"
-
-    # Add coverage if all tests are run
-    if [[ "${MODULE_TO_TEST}" == "." ]]; then
-        NOSE_ARGS="--with-coverage \
-        --cover-erase \
-        --cover-html \
-        --cover-package=airflow \
-        --cover-html-dir=${AIRFLOW_SOURCES}/airflow/www/static/coverage"
-    fi
+# Status of the suite and its modules is kept in the results manifest of the build
+python3 ${MY_DIR}/test_results.py start-suite --suite ${AIRFLOW_BREEZE_TEST_SUITE}
 
-    # Add common parameters to nose
-    NOSE_ARGS="${NOSE_ARGS} \
-    --with-xunit \
-    --xunit-file=${XUNIT_FILE} \
-    --xunit-testsuite-name=${AIRFLOW_BREEZE_TEST_SUITE} \
-    --with-ignore-docstrings \
-    --rednose \
-    --debug=tests \
-    --with-timer \
-    -v \
-    --logging-level=DEBUG "
-
-    echo "Starting the unit tests with the following nose arguments: "${NOSE_ARGS}
-
-
-    # We do not fail if the tests fail as we want to do post-processing and
-    # send results anyway, but we mark the test as failed
-    set +e
-
-    MODULE_PATH=$(echo ${MODULE_TO_TEST} | tr '.' '/')
-    HELPER_PATH="./${MODULE_PATH}_helper.py"
-
-    if [[ -f ${HELPER_PATH} ]]; then
-        echo "Running 'before-tests' for the ${MODULE_TO_TEST} using ${HELPER_PATH}"
-        ${HELPER_PATH} --action before-tests
-    else
-        echo "Helper ${HELPER_PATH} does not exist. Skipping 'before-tests'"
-    fi
-    nosetests ${NOSE_ARGS}
-    if [[ $? != 0 ]]; then
-        touch ${TEST_FAILURE_FILE}
-        FAILED="true"
-    fi
-    if [[ -f ${HELPER_PATH} ]]; then
-        echo "Running 'after-tests' for the ${MODULE_TO_TEST} using ${HELPER_PATH}"
-        ${HELPER_PATH} --action after-tests
-    else
-        echo "Helper ${HELPER_PATH} does not exist. Skipping 'after-tests'"
-    fi
-    set -e
-done
+# We do not fail if the tests fail as we want to do post-processing and
+# send results anyway, but we mark the test as failed
+set +e
+python3 ${MY_DIR}/schedule_ci_tests.py run ${TEST_PLAN_FILE}
+if [[ $? != 0 ]]; then
+    FAILED="true"
+fi
+set -e
 
 if [[ "${FAILED}" == "true" ]]; then
-    touch ${TEST_SUITE_FAILURE_FILE}
+    python3 ${MY_DIR}/test_results.py finish-suite --suite ${AIRFLOW_BREEZE_TEST_SUITE} --failed
 else
-    touch ${TEST_SUITE_SUCCESS_FILE}
+    python3 ${MY_DIR}/test_results.py finish-suite --suite ${AIRFLOW_BREEZE_TEST_SUITE}
 fi
 
-cp -rv ${AIRFLOW_HOME}/logs/* ${LOG_OUTPUT_DIR}
-rm -rvf ${LOG_OUTPUT_DIR}/scheduler
+# The logs (also of the parallel workers, each with its own AIRFLOW_HOME) are
+# packed into one archive with an index - see log_archive.py for reading them.
+# Only the top-level scheduler directory of each logs directory is skipped.
+LOG_SOURCES=("${AIRFLOW_HOME}/logs")
+for WORKER_HOME in ${AIRFLOW_HOME}/ci-workers/worker-*; do
+    if [[ -d ${WORKER_HOME}/logs ]]; then
+        LOG_SOURCES+=("$(basename ${WORKER_HOME})=${WORKER_HOME}/logs")
+    fi
+done
+python3 ${MY_DIR}/log_archive.py pack \
+    ${LOG_OUTPUT_DIR}/${AIRFLOW_BREEZE_TEST_SUITE}-logs.gz \
+    "${LOG_SOURCES[@]}" \
+    --exclude scheduler
 
 popd
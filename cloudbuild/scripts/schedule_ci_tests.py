@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Runs the test modules of a suite on parallel workers.
+
+The modules are assigned to the workers longest first (LPT), using durations
+of the modules from the xunit files of previous builds. Modules without
+history are assumed to take the median duration of the known ones. Every
+worker runs its modules one after another with run_ci_test_module.sh (which
+runs the 'before-tests' and 'after-tests' helpers of the module around the
+tests) and - when there is more than one worker - in its own AIRFLOW_HOME
+with its own SQLite metadata database, initialized with 'airflow db init'.
+More than one worker is refused when the suite uses another database
+backend. The XUNIT and failure files are per module, so they do not clash.
+
+  schedule_ci_tests.py plan -s <SUITE> -w <WORKERS> -o <PLAN> [-H <GLOB>] MODULE...
+  schedule_ci_tests.py run <PLAN>
+"""
+import argparse
+import glob
+import heapq
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+try:
+    from configparser import RawConfigParser
+except ImportError:
+    from ConfigParser import RawConfigParser
+
+MY_DIR = os.path.dirname(os.path.abspath(__file__))
+RUN_MODULE_SCRIPT = os.path.join(MY_DIR, 'run_ci_test_module.sh')
+
+# Assumed when there is no history at all
+DEFAULT_MODULE_DURATION = 60.0
+
+OUTPUT_LOCK = threading.Lock()
+
+# Metadata database of each worker, in its AIRFLOW_HOME
+WORKER_DATABASE_URL = 'sqlite:///{worker_home}/airflow.db'
+
+
+def read_xunit_duration(xunit_file):
+    """Returns the sum of the testcase times of the xunit file.
+
+    The file is parsed incrementally as it contains the captured output.
+    """
+    duration = 0.0
+    for _, element in ElementTree.iterparse(xunit_file):
+        if element.tag == 'testcase':
+            duration += float(element.get('time') or 0)
+            element.clear()
+    return duration
+
+
+def read_module_durations(history_glob, suite):
+    """Returns {module: duration} from the newest xunit file of each module."""
+    newest_files = {}
+    prefix = suite + '-'
+    for xunit_file in glob.glob(os.path.join(history_glob, prefix + '*.xml')):
+        module = os.path.basename(xunit_file)[len(prefix):-len('.xml')]
+        modified = os.path.getmtime(xunit_file)
+        if module not in newest_files or newest_files[module][0] < modified:
+            newest_files[module] = (modified, xunit_file)
+    durations = {}
+    for module, (_, xunit_file) in newest_files.items():
+        try:
+            durations[module] = read_xunit_duration(xunit_file)
+        except (ElementTree.ParseError, ValueError) as e:
+            print("Skipping unreadable {}: {}".format(xunit_file, e))
+    return durations
+
+
+def estimate_durations(modules, known_durations):
+    default = statistics.median(known_durations.values()) if known_durations \
+        else DEFAULT_MODULE_DURATION
+    return {module: known_durations.get(module, default) for module in modules}
+
+
+def schedule_lpt(modules, durations, workers):
+    """Assigns modules to workers, longest first, each to the least loaded worker.
+
+    A single worker runs the modules in the order given. Returns list of
+    (estimated load, [modules]) per worker.
+    """
+    if workers <= 1:
+        return [(sum(durations[module] for module in modules), list(modules))]
+    loads = [(0.0, index) for index in range(workers)]
+    assigned = [[] for _ in loads]
+    for module in sorted(durations, key=lambda module: (-durations[module], module)):
+        load, index = heapq.heappop(loads)
+        assigned[index].append(module)
+        heapq.heappush(loads, (load + durations[module], index))
+    totals = {index: load for load, index in loads}
+    return [(totals[index], modules) for index, modules in enumerate(assigned)]
+
+
+def print_plan(plan):
+    print()
+    print("{:>6}  {:>10}  {}".format('worker', 'estimate', 'modules'))
+    for index, worker in enumerate(plan['workers']):
+        print("{:>6}  {:>9.0f}s  {}".format(index, worker['estimate'],
+                                           ' '.join(worker['modules'])))
+    print()
+
+
+def get_sql_alchemy_conn(airflow_home):
+    """Returns the metadata database URL - the same way airflow reads it."""
+    for section in ['database', 'core']:
+        environment_variable = 'AIRFLOW__{}__SQL_ALCHEMY_CONN'.format(section.upper())
+        if os.environ.get(environment_variable):
+            return os.environ[environment_variable]
+    config = RawConfigParser()
+    config.read(os.path.join(airflow_home, 'airflow.cfg'))
+    for section in ['database', 'core']:
+        if config.has_option(section, 'sql_alchemy_conn'):
+            return config.get(section, 'sql_alchemy_conn')
+    return 'sqlite:///{}'.format(os.path.join(airflow_home, 'airflow.db'))
+
+
+def check_parallel_workers_supported(airflow_home, workers):
+    """Raises if the workers can not have their own metadata database.
+
+    Each worker gets its own SQLite database, which only replaces a SQLite
+    database of the suite - other backends are what the suite tests.
+    """
+    sql_alchemy_conn = get_sql_alchemy_conn(airflow_home)
+    if workers > 1 and not sql_alchemy_conn.startswith('sqlite'):
+        raise Exception("Running tests on {} workers needs the SQLite metadata database, "
+                        "the suite uses {}. Set AIRFLOW_BREEZE_CI_TEST_WORKERS to "
+                        "1".format(workers, sql_alchemy_conn.split(':')[0]))
+
+
+def prepare_worker_home(airflow_home, index):
+    """Returns AIRFLOW_HOME of the worker, with the files of the main AIRFLOW_HOME."""
+    worker_home = os.path.join(airflow_home, 'ci-workers', 'worker-{}'.format(index))
+    if os.path.isdir(worker_home):
+        shutil.rmtree(worker_home)
+    os.makedirs(os.path.join(worker_home, 'dags'))
+    os.makedirs(os.path.join(worker_home, 'logs'))
+    for name in os.listdir(airflow_home):
+        if os.path.isfile(os.path.join(airflow_home, name)):
+            shutil.copy2(os.path.join(airflow_home, name), worker_home)
+    return worker_home
+
+
+def run_command(command, environment, worker_name):
+    """Runs the command, prefixing its output with the worker name. Returns exit code."""
+    process = subprocess.Popen(command, env=environment,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    for line in iter(process.stdout.readline, b''):
+        with OUTPUT_LOCK:
+            sys.stdout.write("[{}] {}".format(worker_name,
+                                              line.decode('utf-8', errors='replace')))
+    sys.stdout.flush()
+    return process.wait()
+
+
+def run_plan(plan):
+    """Runs the workers of the plan. Returns list of (module, worker, seconds, exit code)."""
+    airflow_home = os.environ.get('AIRFLOW_HOME', '/airflow')
+    results = []
+    results_lock = threading.Lock()
+
+    def run_worker(index, modules):
+        environment = dict(os.environ)
+        worker_name = 'worker-{}'.format(index)
+        if len(plan['workers']) > 1:
+            worker_home = prepare_worker_home(airflow_home, index)
+            environment['AIRFLOW_HOME'] = worker_home
+            # The copied airflow.cfg may still point to the main AIRFLOW_HOME
+            environment['AIRFLOW__CORE__DAGS_FOLDER'] = os.path.join(worker_home, 'dags')
+            environment['AIRFLOW__CORE__BASE_LOG_FOLDER'] = os.path.join(worker_home, 'logs')
+            database_url = WORKER_DATABASE_URL.format(worker_home=worker_home)
+            environment['AIRFLOW__CORE__SQL_ALCHEMY_CONN'] = database_url
+            environment['AIRFLOW__DATABASE__SQL_ALCHEMY_CONN'] = database_url
+            init_exit_code = run_command(['airflow', 'db', 'init'], environment, worker_name)
+            if init_exit_code:
+                print("[{}] Initializing {} failed".format(worker_name, database_url))
+                with results_lock:
+                    results.extend((module, worker_name, 0.0, init_exit_code)
+                                   for module in modules)
+                return
+        for module in modules:
+            start = time.time()
+            exit_code = run_command(['bash', RUN_MODULE_SCRIPT, module], environment,
+                                    worker_name)
+            with results_lock:
+                results.append((module, worker_name, time.time() - start, exit_code))
+
+    threads = [threading.Thread(target=run_worker, args=(index, worker['modules']))
+               for index, worker in enumerate(plan['workers']) if worker['modules']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def print_results(results, wall_time):
+    print()
+    print("{:<9}  {:>9}  {:<6}  {}".format('worker', 'duration', 'status', 'module'))
+    for module, worker_name, seconds, exit_code in sorted(results):
+        print("{:<9}  {:>8.0f}s  {:<6}  {}".format(worker_name, seconds,
+                                                   'failed' if exit_code else 'ok', module))
+    print()
+    print("Wall time {:.0f}s, sum of module times {:.0f}s".format(
+        wall_time, sum(seconds for _, _, seconds, _ in results)))
+    print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs test modules on parallel workers.')
+    subparsers = parser.add_subparsers(dest='command')
+    plan_parser = subparsers.add_parser('plan', help='Assigns the modules to the workers')
+    plan_parser.add_argument('modules', nargs='*', help='Modules to test')
+    plan_parser.add_argument('--suite', '-s', required=True, help='Test suite name')
+    plan_parser.add_argument('--workers', '-w', type=int, default=1,
+                             help='Number of parallel workers')
+    plan_parser.add_argument('--history', '-H', action='append', default=[],
+                             help='Glob of directories with xunit files of previous builds')
+    plan_parser.add_argument('--output', '-o', required=True, help='Plan file to write')
+    run_parser = subparsers.add_parser('run', help='Runs the modules of the plan')
+    run_parser.add_argument('plan', help='Plan file written by the plan command')
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        check_parallel_workers_supported(os.environ.get('AIRFLOW_HOME', '/airflow'),
+                                         args.workers)
+        module_durations = {}
+        for history in args.history:
+            for known_module, known_duration in read_module_durations(history,
+                                                                      args.suite).items():
+                module_durations.setdefault(known_module, known_duration)
+        modules_to_test = []
+        for module_to_test in args.modules:
+            if module_to_test and module_to_test not in modules_to_test:
+                modules_to_test.append(module_to_test)
+        estimates = estimate_durations(modules_to_test, module_durations)
+        test_plan = dict(suite=args.suite, workers=[
+            dict(estimate=estimate, modules=modules)
+            for estimate, modules in schedule_lpt(modules_to_test, estimates,
+                                                  args.workers)])
+        with open(args.output, 'w') as plan_file:
+            json.dump(test_plan, plan_file, indent=2)
+        print_plan(test_plan)
+    elif args.command == 'run':
+        with open(args.plan) as plan_file:
+            test_plan = json.load(plan_file)
+        plan_start = time.time()
+        module_results = run_plan(test_plan)
+        print_results(module_results, time.time() - plan_start)
+        sys.exit(1 if any(exit_code for _, _, _, exit_code in module_results) else 0)
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Generates the summary page (index.html) of the build.
+
+Statistics of each suite (counts, total duration, slowest tests and histogram
+of test durations) are computed in one streaming pass over the xunit files of
+its modules, the status comes from the results manifest. Commit metadata is
+read from the local cache, then from git log in AIRFLOW_SOURCES and only then
+from the GitHub API. The page is rendered from TEMPLATE-summary_page.html.
+
+Configured with the same environment variables as prepare_summary_page.sh.
+"""
+import heapq
+import html
+import json
+import os
+import subprocess
+import sys
+import time
+from os.path import abspath, dirname
+from urllib.request import urlopen
+
+from merge_xunit import SuiteTotals, get_status, iterate_testcases
+from test_results import FAILED, MISSING, PASSED, get_suite_status, read_manifest
+
+MY_DIR = dirname(abspath(__file__))
+sys.path.insert(0, dirname(dirname(MY_DIR)))
+
+from template_renderer import render_template  # noqa: E402
+
+TEMPLATE_FILE = os.path.join(MY_DIR, 'TEMPLATE-summary_page.html')
+
+GITHUB_COMMIT_API_URL = 'https://api.github.com/repos/{organization}/{repo}/commits/{sha}'
+GITHUB_TIMEOUT = 10
+
+DEFAULT_COMMIT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'airflow-breeze',
+                                        'commits')
+
+# Upper bounds (seconds) of the buckets of the test duration histogram
+HISTOGRAM_BOUNDS = [0.1, 1, 10, 60]
+
+SLOWEST_TESTS = 10
+
+STATUS_LABELS = {PASSED: 'Passed', FAILED: 'Failed', MISSING: 'Not run'}
+
+
+class SuiteStatistics(object):
+    def __init__(self, name):
+        self.name = name
+        self.totals = SuiteTotals()
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.slowest = []
+
+    def add(self, module, testcase):
+        seconds = float(testcase.get('time') or 0)
+        self.totals.add(get_status(testcase)[0], seconds)
+        self.histogram[sum(seconds >= bound for bound in HISTOGRAM_BOUNDS)] += 1
+        test = (seconds, module, testcase.get('classname', ''), testcase.get('name', ''))
+        if len(self.slowest) < SLOWEST_TESTS:
+            heapq.heappush(self.slowest, test)
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, test)
+
+
+def read_suite_statistics(test_output_dir, suite):
+    """Returns statistics of the suite from the xunit files of its modules."""
+    statistics = SuiteStatistics(suite)
+    prefix = suite + '-'
+    for file_name in sorted(os.listdir(test_output_dir)):
+        if file_name.startswith(prefix) and file_name.endswith('.xml'):
+            module = file_name[len(prefix):-len('.xml')]
+            for testcase in iterate_testcases(os.path.join(test_output_dir, file_name)):
+                statistics.add(module, testcase)
+    return statistics
+
+
+def get_histogram_labels():
+    labels = ['< {}s'.format(HISTOGRAM_BOUNDS[0])]
+    labels.extend('{}-{}s'.format(low, high)
+                  for low, high in zip(HISTOGRAM_BOUNDS, HISTOGRAM_BOUNDS[1:]))
+    labels.append('>= {}s'.format(HISTOGRAM_BOUNDS[-1]))
+    return labels
+
+
+def read_commit_from_git(sources_dir, commit_sha):
+    try:
+        output = subprocess.check_output(
+            ['git', '-C', sources_dir, 'log', '-1', '--format=%s%n%cn%n%an', commit_sha],
+            stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    lines = output.decode('utf-8', errors='replace').splitlines()
+    if len(lines) < 3:
+        return None
+    return dict(message=lines[0], committer=lines[1], author=lines[2])
+
+
+def read_commit_from_github(organization, repo, commit_sha):
+    url = GITHUB_COMMIT_API_URL.format(organization=organization, repo=repo, sha=commit_sha)
+    try:
+        with urlopen(url, timeout=GITHUB_TIMEOUT) as response:
+            commit = json.loads(response.read().decode('utf-8'))['commit']
+    except (IOError, ValueError, KeyError) as e:
+        print("Could not read commit {} from GitHub: {}".format(commit_sha, e))
+        return None
+    return dict(message=commit['message'].split('\n')[0],
+                committer=commit['committer']['name'], author=commit['author']['name'])
+
+
+def get_commit_metadata(commit_sha, sources_dir, organization, repo,
+                        cache_dir=DEFAULT_COMMIT_CACHE_DIR):
+    """Returns message, committer and author of the commit (empty if unknown)."""
+    if not commit_sha:
+        return dict(message='', committer='', author='')
+    cache_file = os.path.join(cache_dir, commit_sha + '.json')
+    if os.path.isfile(cache_file):
+        with open(cache_file) as f:
+            return json.load(f)
+    commit = read_commit_from_git(sources_dir, commit_sha) or \
+        read_commit_from_github(organization, repo, commit_sha)
+    if commit is None:
+        return dict(message='', committer='', author='')
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    with open(cache_file + '.tmp', 'w') as f:
+        json.dump(commit, f)
+    os.replace(cache_file + '.tmp', cache_file)
+    return commit
+
+
+def render_suite_link(bucket, build_id, suite, status):
+    status_html = {PASSED: '<font color="green">Passed</font>',
+                   FAILED: '<font color="red">Failed!</font>'}.get(status, 'Not run')
+    return '            <li><a href="https://storage.googleapis.com/{bucket}/{build_id}/tests/' \
+        '{suite}.xml.html">{suite} test results</a>:  {status}</li>'.format(
+            bucket=bucket, build_id=build_id, suite=html.escape(suite), status=status_html)
+
+
+def render_suite_row(statistics, status):
+    totals = statistics.totals
+    histogram = ', '.join('{}: {}'.format(html.escape(label), count)
+                          for label, count in zip(get_histogram_labels(),
+                                                  statistics.histogram))
+    return '            <tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td>' \
+        '<td>{}</td><td>{:.1f}s</td><td>{}</td></tr>'.format(
+            html.escape(statistics.name), STATUS_LABELS.get(status, status), totals.tests,
+            totals.failures, totals.errors, totals.skipped, totals.time, histogram)
+
+
+def render_slowest_tests(all_statistics):
+    parts = []
+    for statistics in all_statistics:
+        if not statistics.slowest:
+            continue
+        parts.append('          <h3>Slowest {} tests:</h3>'.format(html.escape(statistics.name)))
+        parts.append('          <ol>')
+        for seconds, module, classname, name in sorted(statistics.slowest, reverse=True):
+            parts.append('            <li>{:.2f}s {} {}.{}</li>'.format(
+                seconds, html.escape(module), html.escape(classname), html.escape(name)))
+        parts.append('          </ol>')
+    return '\n'.join(parts)
+
+
+def generate_page(environment):
+    airflow_output = os.path.join(environment['AIRFLOW_SOURCES'], 'output')
+    test_output_dir = os.path.join(airflow_output, environment['BUILD_ID'], 'tests')
+    manifest = read_manifest(os.path.join(test_output_dir, 'results.json'))
+    has_test_output = os.path.isdir(test_output_dir)
+    all_statistics = []
+    links = []
+    rows = []
+    failed = False
+    for suite in environment['AIRFLOW_BREEZE_TEST_SUITES'].split():
+        status = get_suite_status(manifest, suite)
+        failed = failed or status == FAILED
+        statistics = read_suite_statistics(test_output_dir, suite) if has_test_output \
+            else SuiteStatistics(suite)
+        all_statistics.append(statistics)
+        links.append(render_suite_link(environment['AIRFLOW_BREEZE_GCP_BUILD_BUCKET'],
+                                       environment['BUILD_ID'], suite, status))
+        rows.append(render_suite_row(statistics, status))
+    commit = get_commit_metadata(
+        environment['COMMIT_SHA'], environment['AIRFLOW_SOURCES'],
+        environment['AIRFLOW_BREEZE_GITHUB_ORGANIZATION'], environment['AIRFLOW_REPO_NAME'],
+        environment.get('AIRFLOW_BREEZE_COMMIT_CACHE_DIR') or DEFAULT_COMMIT_CACHE_DIR)
+    variables = {name: html.escape(value) for name, value in environment.items()}
+    variables.update(
+        CURRENT_DATE=time.strftime('%a %b %d %H:%M:%S %Z %Y'),
+        STATUS='Overall status: <font color="red">Failed!</font>' if failed else
+        'Overall status: <font color="green">Passed!</font>',
+        COMMIT_MESSAGE=html.escape(commit['message']),
+        COMMITTER=html.escape(commit['committer']),
+        AUTHOR=html.escape(commit['author']),
+        TEST_SUITE_LINKS='\n'.join(links),
+        TEST_SUITE_ROWS='\n'.join(rows),
+        SLOWEST_TESTS=render_slowest_tests(all_statistics))
+    with open(TEMPLATE_FILE) as f:
+        page, unresolved = render_template(f.read(), variables)
+    if unresolved:
+        raise Exception("Unresolved variables in {}: {}".format(TEMPLATE_FILE,
+                                                               ', '.join(unresolved)))
+    return page
+
+
+if __name__ == '__main__':
+    page_file = os.path.join(os.environ['AIRFLOW_SOURCES'], 'output', os.environ['BUILD_ID'],
+                             'index.html')
+    page_content = generate_page(dict(os.environ))
+    with open(page_file + '.tmp', 'w') as page_output:
+        page_output.write(page_content)
+    os.replace(page_file + '.tmp', page_file)
+    print("Summary page written to {}".format(page_file))
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Keeps durations and outcomes of the tests of all builds in a SQLite database.
+
+The xunit files of a build (${SUITE}-${MODULE}.xml) are ingested with the build
+id, commit and branch. Regressions of tests and modules are reported against
+the median duration of the previous builds of the same branch.
+
+  test_durations.py ingest -b <BUILD_ID> [-c <COMMIT>] [-r <BRANCH>] [-s <SUITE>] <TEST_OUTPUT_DIR>
+  test_durations.py regressions [-b <BUILD_ID>] [-n <BASELINE BUILDS>] [-t <THRESHOLD>]
+  test_durations.py slowest [-b <BUILD_ID>] [--top <N>]
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import statistics
+import sys
+import time
+
+from merge_xunit import get_status, iterate_testcases
+
+DEFAULT_DATABASE = os.environ.get(
+    'AIRFLOW_BREEZE_TEST_DURATIONS_DB',
+    os.path.join(os.environ.get('AIRFLOW_SOURCES', '/workspace'), 'output',
+                 'test_durations.sqlite'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS build (
+    build_id TEXT PRIMARY KEY,
+    commit_sha TEXT,
+    branch TEXT,
+    ingested_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS build_branch ON build (branch, ingested_at);
+CREATE TABLE IF NOT EXISTS test (
+    test_id INTEGER PRIMARY KEY,
+    suite TEXT NOT NULL,
+    module TEXT NOT NULL,
+    classname TEXT NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (suite, module, classname, name)
+);
+CREATE TABLE IF NOT EXISTS result (
+    build_id TEXT NOT NULL REFERENCES build (build_id),
+    test_id INTEGER NOT NULL REFERENCES test (test_id),
+    status TEXT NOT NULL,
+    duration REAL NOT NULL,
+    PRIMARY KEY (build_id, test_id)
+);
+CREATE INDEX IF NOT EXISTS result_test ON result (test_id, build_id);
+"""
+
+
+def connect(database_file):
+    database_dir = os.path.dirname(os.path.abspath(database_file))
+    if not os.path.isdir(database_dir):
+        os.makedirs(database_dir)
+    connection = sqlite3.connect(database_file)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def find_xunit_files(test_output_dir, suite=None):
+    """Returns [(suite, module, file)] of the per-module xunit files of the build.
+
+    Module names may contain '-', so without the suite the name of the file is
+    split at its first '-' (suite names do not contain it).
+    """
+    xunit_files = []
+    pattern = '{}-*.xml'.format(suite) if suite else '*-*.xml'
+    for xunit_file in sorted(glob.glob(os.path.join(test_output_dir, pattern))):
+        name = os.path.basename(xunit_file)[:-len('.xml')]
+        if suite:
+            xunit_files.append((suite, name[len(suite) + 1:], xunit_file))
+        else:
+            file_suite, module = name.split('-', 1)
+            xunit_files.append((file_suite, module, xunit_file))
+    return xunit_files
+
+
+def get_test_id(connection, test_ids, key):
+    if key not in test_ids:
+        connection.execute("INSERT OR IGNORE INTO test (suite, module, classname, name) "
+                           "VALUES (?, ?, ?, ?)", key)
+        test_ids[key] = connection.execute(
+            "SELECT test_id FROM test WHERE suite = ? AND module = ? AND classname = ? "
+            "AND name = ?", key).fetchone()[0]
+    return test_ids[key]
+
+
+def ingest(connection, build_id, commit_sha, branch, xunit_files):
+    """Stores results of the testcases of the files. Ingesting a build again replaces it.
+
+    Returns number of stored results.
+    """
+    test_ids = {}
+    count = 0
+    with connection:
+        connection.execute("INSERT OR IGNORE INTO build (build_id, ingested_at) "
+                           "VALUES (?, ?)", (build_id, time.time()))
+        connection.execute("UPDATE build SET commit_sha = ?, branch = ? WHERE build_id = ?",
+                           (commit_sha, branch, build_id))
+        for suite, module, xunit_file in xunit_files:
+            connection.execute("DELETE FROM result WHERE build_id = ? AND test_id IN "
+                               "(SELECT test_id FROM test WHERE suite = ? AND module = ?)",
+                               (build_id, suite, module))
+            for testcase in iterate_testcases(xunit_file):
+                test_id = get_test_id(connection, test_ids, (
+                    suite, module, testcase.get('classname', ''), testcase.get('name', '')))
+                connection.execute("INSERT OR REPLACE INTO result (build_id, test_id, "
+                                   "status, duration) VALUES (?, ?, ?, ?)",
+                                   (build_id, test_id, get_status(testcase)[0],
+                                    float(testcase.get('time') or 0)))
+                count += 1
+    return count
+
+
+def get_build(connection, build_id=None):
+    """Returns (build_id, branch, ingested_at) of the build, the latest one by default."""
+    if build_id:
+        row = connection.execute("SELECT build_id, branch, ingested_at FROM build "
+                                 "WHERE build_id = ?", (build_id,)).fetchone()
+    else:
+        row = connection.execute("SELECT build_id, branch, ingested_at FROM build "
+                                 "ORDER BY ingested_at DESC LIMIT 1").fetchone()
+    if row is None:
+        raise Exception("The build {} is not in the database".format(build_id or ''))
+    return row
+
+
+def get_baseline_builds(connection, branch, ingested_at, baseline_builds):
+    return [row[0] for row in connection.execute(
+        "SELECT build_id FROM build WHERE branch IS ? AND ingested_at < ? "
+        "ORDER BY ingested_at DESC LIMIT ?", (branch, ingested_at, baseline_builds))]
+
+
+def get_durations(connection, build_ids, group_by_module):
+    """Returns {(suite, module[, classname, name]): {build_id: duration}}."""
+    if not build_ids:
+        return {}
+    key_columns = 'suite, module' if group_by_module else 'suite, module, classname, name'
+    durations = {}
+    for row in connection.execute(
+            "SELECT {columns}, build_id, SUM(duration) FROM result "
+            "JOIN test USING (test_id) WHERE build_id IN ({builds}) "
+            "GROUP BY {columns}, build_id".format(
+                columns=key_columns, builds=', '.join('?' * len(build_ids))), build_ids):
+        durations.setdefault(tuple(row[:-2]), {})[row[-2]] = row[-1]
+    return durations
+
+
+def find_regressions(connection, build_id=None, baseline_builds=10, threshold=0.5,
+                     min_seconds=1.0, group_by_module=False):
+    """Returns [(key, duration, baseline)] of tests or modules slower than the baseline.
+
+    The baseline is the median duration in the previous builds of the branch; a
+    regression is slower by more than threshold (relative) and min_seconds.
+    """
+    build_id, branch, ingested_at = get_build(connection, build_id)
+    baseline_build_ids = get_baseline_builds(connection, branch, ingested_at,
+                                             baseline_builds)
+    current = get_durations(connection, [build_id], group_by_module)
+    history = get_durations(connection, baseline_build_ids, group_by_module)
+    regressions = []
+    for key, durations in current.items():
+        if key not in history:
+            continue
+        duration = durations[build_id]
+        baseline = statistics.median(history[key].values())
+        if duration > baseline * (1 + threshold) and duration - baseline > min_seconds:
+            regressions.append((key, duration, baseline))
+    return sorted(regressions, key=lambda regression: regression[2] - regression[1])
+
+
+def find_slowest(connection, build_id=None, top=10):
+    """Returns {suite: [(module, classname, name, duration)]} of the slowest tests."""
+    build_id = get_build(connection, build_id)[0]
+    slowest = {}
+    for suite, module, classname, name, duration in connection.execute(
+            "SELECT suite, module, classname, name, duration FROM result "
+            "JOIN test USING (test_id) WHERE build_id = ? "
+            "ORDER BY suite, duration DESC", (build_id,)):
+        tests = slowest.setdefault(suite, [])
+        if len(tests) < top:
+            tests.append((module, classname, name, duration))
+    return slowest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keeps durations of tests of all builds.')
+    parser.add_argument('--database', '-d', default=DEFAULT_DATABASE,
+                        help='SQLite database file')
+    subparsers = parser.add_subparsers(dest='command')
+    ingest_parser = subparsers.add_parser('ingest', help='Stores results of a build')
+    ingest_parser.add_argument('test_output_dir', help='Directory with the xunit files')
+    ingest_parser.add_argument('--build-id', '-b', required=True, help='Id of the build')
+    ingest_parser.add_argument('--commit', '-c', default='', help='Commit SHA of the build')
+    ingest_parser.add_argument('--branch', '-r', default='', help='Branch of the build')
+    ingest_parser.add_argument('--suite', '-s', help='Only ingest this test suite')
+    regressions_parser = subparsers.add_parser(
+        'regressions', help='Lists tests and modules slower than in previous builds')
+    regressions_parser.add_argument('--build-id', '-b', help='Build (the latest by default)')
+    regressions_parser.add_argument('--baseline-builds', '-n', type=int, default=10,
+                                    help='Number of previous builds of the branch compared')
+    regressions_parser.add_argument('--threshold', '-t', type=float, default=0.5,
+                                    help='Relative slowdown reported (0.5 is 50%%)')
+    regressions_parser.add_argument('--min-seconds', type=float, default=1.0,
+                                    help='Minimum slowdown in seconds reported')
+    slowest_parser = subparsers.add_parser('slowest', help='Lists slowest tests per suite')
+    slowest_parser.add_argument('--build-id', '-b', help='Build (the latest by default)')
+    slowest_parser.add_argument('--top', type=int, default=10,
+                                help='Number of tests listed per suite')
+    args = parser.parse_args()
+
+    if args.command is None:
+        parser.print_help()
+        sys.exit(1)
+    database = connect(args.database)
+    try:
+        if args.command == 'ingest':
+            stored = ingest(database, args.build_id, args.commit, args.branch,
+                            find_xunit_files(args.test_output_dir, args.suite))
+            print("Stored {} test results of build {} in {}".format(
+                stored, args.build_id, args.database))
+        elif args.command == 'regressions':
+            for kind, by_module in [('Modules', True), ('Tests', False)]:
+                found = find_regressions(database, args.build_id, args.baseline_builds,
+                                         args.threshold, args.min_seconds, by_module)
+                print()
+                print("{} slower than the median of {} previous builds: {}".format(
+                    kind, args.baseline_builds, len(found)))
+                for regression_key, current_duration, baseline_duration in found:
+                    print("  {:>9.2f}s (was {:>9.2f}s)  {}".format(
+                        current_duration, baseline_duration, ' '.join(regression_key)))
+            print()
+        elif args.command == 'slowest':
+            for test_suite, slowest_tests in sorted(find_slowest(database, args.build_id,
+                                                                 args.top).items()):
+                print()
+                print("Slowest tests of {}:".format(test_suite))
+                for test_module, test_class, test_name, test_duration in slowest_tests:
+                    print("  {:>9.2f}s  {} {}.{}".format(test_duration, test_module,
+                                                        test_class, test_name))
+            print()
+    finally:
+        database.close()
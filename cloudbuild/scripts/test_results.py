@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Maintains the results manifest of the build (tests/results.json).
+
+The manifest has the status, test counts and duration of every suite and of
+every module of the suite. It is the only place where the CI scripts, the
+summary page and the Slack notifier learn whether the tests passed:
+
+  {"build_id": "...", "suites": {"python3": {"status": "failed", "tests": 10,
+   "failures": 1, "errors": 0, "skipped": 2, "duration": 12.5,
+   "modules": {"tests.core": {"status": "failed", "tests": 10, ...}}}}}
+
+Updates are serialized with a lock file (modules run on parallel workers)
+and the manifest is replaced atomically, so readers never see partial content.
+
+  test_results.py start-suite -s <SUITE>
+  test_results.py record-module -s <SUITE> -m <MODULE> --status <STATUS> [-x <XUNIT>] [-d <SECONDS>]
+  test_results.py finish-suite -s <SUITE> [--failed]
+  test_results.py status -s <SUITE>
+  test_results.py verify
+"""
+import argparse
+import fcntl
+import json
+import os
+import sys
+from contextlib import contextmanager
+
+from merge_xunit import SuiteTotals, get_status, iterate_testcases
+
+MANIFEST_FILE_NAME = 'results.json'
+
+PASSED = 'passed'
+FAILED = 'failed'
+RUNNING = 'running'
+MISSING = 'missing'
+
+COUNTS = ['tests', 'failures', 'errors', 'skipped']
+
+
+def get_default_manifest_file():
+    airflow_output = os.path.join(os.environ.get('AIRFLOW_SOURCES', '/workspace'), 'output')
+    return os.path.join(airflow_output, os.environ.get('BUILD_ID', 'build'), 'tests',
+                        MANIFEST_FILE_NAME)
+
+
+def read_manifest(manifest_file):
+    """Returns the manifest, an empty one if it does not exist."""
+    try:
+        with open(manifest_file) as f:
+            return json.load(f)
+    except IOError:
+        return dict(build_id=os.environ.get('BUILD_ID', 'build'), suites={})
+
+
+def write_manifest(manifest_file, manifest):
+    temporary_file = manifest_file + '.tmp'
+    with open(temporary_file, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temporary_file, manifest_file)
+
+
+@contextmanager
+def updated_manifest(manifest_file):
+    """Yields the manifest for updates and writes it back, holding the lock.
+
+    The directory of the manifest is locked, so no lock file gets uploaded.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+    if not os.path.isdir(manifest_dir):
+        os.makedirs(manifest_dir)
+    lock_fd = os.open(manifest_dir, os.O_RDONLY)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        manifest = read_manifest(manifest_file)
+        yield manifest
+        write_manifest(manifest_file, manifest)
+    finally:
+        os.close(lock_fd)
+
+
+def count_results(xunit_file):
+    """Returns test counts of the xunit file (zeros if it was not written)."""
+    totals = SuiteTotals()
+    if xunit_file and os.path.isfile(xunit_file):
+        for testcase in iterate_testcases(xunit_file):
+            totals.add(get_status(testcase)[0], float(testcase.get('time') or 0))
+    return totals
+
+
+def summarize_suite(suite):
+    """Sets the counts and duration of the suite from its modules."""
+    for count in COUNTS + ['duration']:
+        suite[count] = sum(module[count] for module in suite['modules'].values())
+    suite['duration'] = round(suite['duration'], 3)
+
+
+def start_suite(manifest, suite_name):
+    manifest['suites'][suite_name] = dict(status=RUNNING, modules={})
+    summarize_suite(manifest['suites'][suite_name])
+
+
+def record_module(manifest, suite_name, module_name, status, xunit_file=None, duration=None):
+    suite = manifest['suites'].setdefault(suite_name, dict(status=RUNNING, modules={}))
+    totals = count_results(xunit_file)
+    suite['modules'][module_name] = dict(
+        status=status, tests=totals.tests, failures=totals.failures, errors=totals.errors,
+        skipped=totals.skipped,
+        duration=round(duration if duration is not None else totals.time, 3))
+    summarize_suite(suite)
+
+
+def finish_suite(manifest, suite_name, failed=False):
+    """Sets the suite status - failed if any of its modules failed."""
+    suite = manifest['suites'].setdefault(suite_name, dict(modules={}))
+    failed = failed or any(module['status'] != PASSED for module in suite['modules'].values())
+    suite['status'] = FAILED if failed else PASSED
+    summarize_suite(suite)
+
+
+def get_suite_status(manifest, suite_name):
+    return manifest['suites'].get(suite_name, {}).get('status', MISSING)
+
+
+def get_failed_steps(manifest):
+    """Returns names of failed suites and modules ('suite' and 'suite-module')."""
+    failed_steps = []
+    for suite_name, suite in sorted(manifest['suites'].items()):
+        if suite['status'] == FAILED:
+            failed_steps.append(suite_name)
+        failed_steps.extend('{}-{}'.format(suite_name, module_name)
+                            for module_name, module in sorted(suite['modules'].items())
+                            if module['status'] == FAILED)
+    return failed_steps
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintains the results manifest of the build.')
+    parser.add_argument('--manifest', default=get_default_manifest_file(),
+                        help='Results manifest file')
+    subparsers = parser.add_subparsers(dest='command')
+    start_parser = subparsers.add_parser('start-suite', help='Clears results of the suite')
+    start_parser.add_argument('--suite', '-s', required=True, help='Test suite name')
+    module_parser = subparsers.add_parser('record-module', help='Records result of a module')
+    module_parser.add_argument('--suite', '-s', required=True, help='Test suite name')
+    module_parser.add_argument('--module', '-m', required=True, help='Module tested')
+    module_parser.add_argument('--status', required=True, choices=[PASSED, FAILED],
+                               help='Status of the module')
+    module_parser.add_argument('--xunit-file', '-x', help='Xunit file with the test counts')
+    module_parser.add_argument('--duration', '-d', type=float,
+                               help='Duration in seconds (sum of the tests by default)')
+    finish_parser = subparsers.add_parser('finish-suite',
+                                          help='Sets the suite status from its modules')
+    finish_parser.add_argument('--suite', '-s', required=True, help='Test suite name')
+    finish_parser.add_argument('--failed', action='store_true',
+                               help='Marks the suite as failed regardless of its modules')
+    status_parser = subparsers.add_parser('status', help='Prints status of the suite')
+    status_parser.add_argument('--suite', '-s', required=True, help='Test suite name')
+    subparsers.add_parser('verify', help='Fails if any suite or module failed')
+    args = parser.parse_args()
+
+    if args.command == 'start-suite':
+        with updated_manifest(args.manifest) as results:
+            start_suite(results, args.suite)
+    elif args.command == 'record-module':
+        with updated_manifest(args.manifest) as results:
+            record_module(results, args.suite, args.module, args.status, args.xunit_file,
+                          args.duration)
+    elif args.command == 'finish-suite':
+        with updated_manifest(args.manifest) as results:
+            finish_suite(results, args.suite, args.failed)
+        print("Suite {}: {}".format(args.suite, get_suite_status(results, args.suite)))
+    elif args.command == 'status':
+        print(get_suite_status(read_manifest(args.manifest), args.suite))
+    elif args.command == 'verify':
+        failed = get_failed_steps(read_manifest(args.manifest))
+        print()
+        if failed:
+            print("Some test steps failed!: ")
+            for step in failed:
+                print(step)
+            print()
+            sys.exit(1)
+        print("All test steps succeeded !!!!")
+        print()
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -29,22 +29,5 @@ export BUILD_ID="${BUILD_ID:=build}"
 
 export TEST_OUTPUT_DIR=${AIRFLOW_OUTPUT}/${BUILD_ID}/tests
 
-set +e
-FAILED_STEPS="$(ls ${TEST_OUTPUT_DIR}/*-failure.txt 2>/dev/null)"
-set -e
-
-if [[ ${FAILED_STEPS} == "" ]]; then
-   echo
-   echo "All test steps succeeded !!!!"
-   echo
-   exit 0
-else
-   echo
-   echo "Some test steps failed!: "
-   for STEP in ${FAILED_STEPS}
-   do
-        echo $(basename ${STEP} -failure.txt)
-   done
-   echo
-   exit 1
-fi
+python3 ${MY_DIR}/test_results.py \
+    --manifest ${TEST_OUTPUT_DIR}/results.json verify
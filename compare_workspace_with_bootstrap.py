@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
+import argparse
 import difflib
 import errno
+import hashlib
+import io
+import json
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-import subprocess
+from template_renderer import compile_template, render_template
 
 ENCRYPTED_SUFFIX = '_ENCRYPTED'
 TEMPLATE_PREFIX = 'TEMPLATE-'
@@ -28,6 +33,12 @@ TEMPLATE_PREFIX = 'TEMPLATE-'
 
 MY_DIR = os.path.dirname(__file__)
 
+DEFAULT_PARALLELISM = 8
+
+# Keeps the state of the files from the last comparison in the workspace
+MANIFEST_FILE_NAME = '.compare_manifest.json'
+MANIFEST_VERSION = 1
+
 confirm = False
 
 VARIABLES = {}
@@ -85,13 +96,14 @@ def read_all_variable_keys(file):
     return keys
 
 
-def compare_variable_keys(variable_file, bootstrap_variable_file):
+def compare_variable_keys(variable_file, bootstrap_variable_file, quiet=False):
     current_keys = read_all_variable_keys(variable_file)
     bootstrap_keys = read_all_variable_keys(bootstrap_variable_file)
-    new_current_keys = current_keys - bootstrap_keys
-    new_bootstrap_keys = bootstrap_keys - current_keys
+    new_current_keys = sorted(current_keys - bootstrap_keys)
+    new_bootstrap_keys = sorted(bootstrap_keys - current_keys)
     if len(new_bootstrap_keys) > 0:
         set_confirm()
+    if len(new_bootstrap_keys) > 0 and not quiet:
         print("!" * 80)
         print()
         print("There are new keys added in bootstrap file {}".format(
@@ -106,6 +118,7 @@ def compare_variable_keys(variable_file, bootstrap_variable_file):
         print("!" * 80)
     if len(new_current_keys) > 0:
         set_confirm()
+    if len(new_current_keys) > 0 and not quiet:
         print("!" * 80)
         print()
         print("There are new keys added in your config file {}".format(
@@ -118,22 +131,18 @@ def compare_variable_keys(variable_file, bootstrap_variable_file):
             bootstrap_variable_file))
         print()
         print("!" * 80)
+    return dict(new_bootstrap_keys=new_bootstrap_keys, new_current_keys=new_current_keys)
 
 
 def process_templates(content):
-    new_content = []
-    for line in content:
-        for key, value in VARIABLES.items():
-            string_to_replace1 = '{{ ' + key + ' }}'
-            line = line.replace(string_to_replace1, value)
-            string_to_replace2 = '{{' + key + '}}'
-            line = line.replace(string_to_replace2, value)
-        new_content.append(line)
-    return new_content
-
-
-def check_all_files(config_directory, bootstrap_config_directory):
+    processed_text, unresolved = render_template(''.join(content), VARIABLES)
+    return io.StringIO(processed_text).readlines(), unresolved
+
+
+def find_files_to_compare(config_directory, bootstrap_config_directory):
+    """Returns sorted list of (workspace file, bootstrap template) pairs."""
     real_config_path = os.path.realpath(config_directory)
+    files_to_compare = []
     for root, dirs, fnames in os.walk(top=real_config_path, topdown=True):
         dirs[:] = [d for d in dirs if d not in ['node_modules', '.git', 'keys']]
         for f in fnames:
@@ -145,32 +154,178 @@ def check_all_files(config_directory, bootstrap_config_directory):
             bootstrap_path = os.path.join(
                 bootstrap_config_directory + root[len(real_config_path):],
                 TEMPLATE_PREFIX + f)
-            print("Comparing {} <> {}".format(file_path, bootstrap_path))
-            with open(bootstrap_path, "rt") as bootstrap_file:
-                text_bootstrap = bootstrap_file.readlines()
-            with open(file_path, "rt") as config_file:
-                text_config = config_file.readlines()
-            # Check if the content is the same after we process it using variables
-            processed_bootstrap = process_templates(text_bootstrap)
-            if text_config != processed_bootstrap:
-                set_confirm()
-                print("!" * 80)
-                print()
-                print("The file in your workspace {} is different than in "
-                      "bootstrap {} after processing with current variables".
-                      format(file_path, bootstrap_path))
-                print()
-                for line in difflib.unified_diff(text_config,
-                                                 processed_bootstrap):
-                    sys.stdout.write(line)  # EOL is there already
-                    sys.stdout.flush()
-                print()
-                print("Please make sure to align them!")
-                print()
-                print("!" * 80)
+            files_to_compare.append((file_path, bootstrap_path))
+    return sorted(files_to_compare)
+
+
+def compare_file(file_path, bootstrap_path):
+    result = dict(path=file_path, bootstrap_path=bootstrap_path, status='same',
+                  diff=[], unresolved=[])
+    try:
+        with open(bootstrap_path, "rt") as bootstrap_file:
+            text_bootstrap = bootstrap_file.readlines()
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        result['status'] = 'missing_in_bootstrap'
+        return result
+    with open(file_path, "rt") as config_file:
+        text_config = config_file.readlines()
+    # Check if the content is the same after we process it using variables
+    processed_bootstrap, result['unresolved'] = process_templates(text_bootstrap)
+    if text_config != processed_bootstrap:
+        result['status'] = 'different'
+        result['diff'] = list(difflib.unified_diff(text_config, processed_bootstrap))
+    return result
+
+
+def print_file_result(result):
+    print("Comparing {} <> {}".format(result['path'], result['bootstrap_path']))
+    if result.get('unresolved'):
+        print("Values of {} are not known".format(', '.join(result['unresolved'])))
+    if result['status'] == 'same':
+        return
+    print("!" * 80)
+    print()
+    if result['status'] == 'missing_in_bootstrap':
+        print("The file in your workspace {} is missing in bootstrap {}".
+              format(result['path'], result['bootstrap_path']))
+    else:
+        print("The file in your workspace {} is different than in "
+              "bootstrap {} after processing with current variables".
+              format(result['path'], result['bootstrap_path']))
+        print()
+        for line in result['diff']:
+            sys.stdout.write(line)  # EOL is there already
+        sys.stdout.flush()
+    print()
+    print("Please make sure to align them!")
+    print()
+    print("!" * 80)
+
+
+def _file_state(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _hash_bytes(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def _hash_variables(names):
+    values = [[name, VARIABLES.get(name)] for name in names]
+    return _hash_bytes(json.dumps(values).encode('utf-8'))
+
+
+def compare_file_incrementally(file_path, bootstrap_path, entry):
+    """Compares the files unless none of the inputs changed since entry was made.
+
+    The inputs are the content of both files and values of the variables used by
+    the template. File content is only hashed when modification time or size of
+    the file changed. Returns the result and the new manifest entry.
+    """
+    try:
+        workspace_state = _file_state(file_path)
+        bootstrap_state = _file_state(bootstrap_path)
+    except OSError:
+        return compare_file(file_path, bootstrap_path), None
+    entry = entry or {}
+    if entry.get('workspace_state') == workspace_state:
+        workspace_hash = entry['workspace_hash']
+    else:
+        with open(file_path, "rb") as config_file:
+            workspace_hash = _hash_bytes(config_file.read())
+    if entry.get('bootstrap_path') == bootstrap_path and \
+            entry.get('bootstrap_state') == bootstrap_state:
+        bootstrap_hash = entry['bootstrap_hash']
+        variable_names = entry['variables']
+    else:
+        with open(bootstrap_path, "rb") as bootstrap_file:
+            content = bootstrap_file.read()
+        bootstrap_hash = _hash_bytes(content)
+        variable_names = sorted(compile_template(content.decode('utf-8')).names)
+    new_entry = dict(bootstrap_path=bootstrap_path,
+                     workspace_state=workspace_state,
+                     bootstrap_state=bootstrap_state,
+                     workspace_hash=workspace_hash,
+                     bootstrap_hash=bootstrap_hash,
+                     variables=variable_names,
+                     variables_hash=_hash_variables(variable_names))
+    unchanged = 'result' in entry and all(
+        entry.get(key) == new_entry[key]
+        for key in ['bootstrap_path', 'workspace_hash', 'bootstrap_hash', 'variables_hash'])
+    new_entry['result'] = entry['result'] if unchanged \
+        else compare_file(file_path, bootstrap_path)
+    return new_entry['result'], new_entry
+
+
+def load_manifest(manifest_file):
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest['files']
+
+
+def save_manifest(manifest_file, entries):
+    temporary_file = manifest_file + '.tmp'
+    # The diffs might contain secrets
+    fd = os.open(temporary_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(dict(version=MANIFEST_VERSION, files=entries), f)
+    os.replace(temporary_file, manifest_file)
+
+
+def check_all_files(config_directory, bootstrap_config_directory,
+                    parallelism=DEFAULT_PARALLELISM, quiet=False,
+                    manifest_file=None, full=False):
+    """Compares all files on a pool of workers.
+
+    If manifest_file is specified, only files whose inputs changed since the
+    previous run are compared (all of them when full is True). Results are
+    returned (and printed unless quiet) in the order of the paths.
+    """
+    files_to_compare = find_files_to_compare(config_directory, bootstrap_config_directory)
+    if manifest_file:
+        entries = {} if full else load_manifest(manifest_file)
+        with ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+            compared = list(executor.map(
+                lambda paths: compare_file_incrementally(paths[0], paths[1],
+                                                         entries.get(paths[0])),
+                files_to_compare))
+        results = [result for result, _ in compared]
+        save_manifest(manifest_file, {
+            file_path: entry for (file_path, _), (_, entry) in zip(files_to_compare, compared)
+            if entry is not None})
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+            results = list(executor.map(lambda paths: compare_file(*paths),
+                                        files_to_compare))
+    for result in results:
+        if result['status'] != 'same':
+            set_confirm()
+        if not quiet:
+            print_file_result(result)
+    return results
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compares workspace configuration with the bootstrap templates. '
+                    'Exits with 1 if they are not aligned.')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the result as JSON instead of the human readable report')
+    parser.add_argument('--parallelism', type=int, default=DEFAULT_PARALLELISM,
+                        help='Number of files compared in parallel')
+    parser.add_argument('--full', action='store_true',
+                        help='Compare all files, even if they did not change since the '
+                             'last comparison')
+    args = parser.parse_args()
+
     VARIABLES.update(os.environ)
     _project_id, _workspace_dir, _config_dir, _keys_dir, _variable_file = \
         get_current_workspace_info()
@@ -178,8 +333,15 @@ if __name__ == '__main__':
     _bootstrap_variable_file = os.path.join(_bootstrap_config_dir,
                                             TEMPLATE_PREFIX + "variables.env")
 
-    compare_variable_keys(_variable_file, _bootstrap_variable_file)
-    check_all_files(_config_dir, _bootstrap_config_dir)
+    _variable_keys = compare_variable_keys(_variable_file, _bootstrap_variable_file,
+                                           quiet=args.json)
+    _files = check_all_files(_config_dir, _bootstrap_config_dir,
+                             parallelism=args.parallelism, quiet=args.json,
+                             manifest_file=os.path.join(_workspace_dir, MANIFEST_FILE_NAME),
+                             full=args.full)
+    if args.json:
+        print(json.dumps(dict(aligned=not confirm, variable_keys=_variable_keys,
+                              files=_files), indent=2))
 
     if confirm:
         sys.exit(1)
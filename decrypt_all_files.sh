@@ -48,35 +48,13 @@ if [[ -z "${AIRFLOW_BREEZE_PROJECT_ID}" ]]; then
   fi
 fi
 
-echo "TEST" | gcloud kms encrypt --plaintext-file=- --ciphertext-file=- \
-     --location=global --keyring=airflow --key=airflow_crypto_key \
-     --project=${AIRFLOW_BREEZE_PROJECT_ID} >/dev/null || \
-     (echo "ERROR! You should have KMS Encrypt/Decrypt Role assigned in Google Cloud Platform. Exiting!" && exit 1)
-
-pushd ${AIRFLOW_BREEZE_KEYS_DIR}
-FILES=$(ls *.enc 2>/dev/null || true)
-echo "Decrypting all files '${FILES}'"
-for FILE in ${FILES}
-do
-  gcloud kms decrypt --plaintext-file $(basename ${FILE} .enc) --ciphertext-file ${FILE} \
-     --location=global --keyring=airflow --key=airflow_crypto_key \
-     --project=${AIRFLOW_BREEZE_PROJECT_ID} \
-        && echo Decrypted ${FILE}
-done
-chmod -v og-rw *
-popd
-
-if [[ -d ${AIRFLOW_BREEZE_NOTIFICATIONS_DIR} ]]; then
-    echo "Decrypting variables from ${AIRFLOW_BREEZE_NOTIFICATIONS_DIR} dir"
-    pushd ${AIRFLOW_BREEZE_NOTIFICATIONS_DIR}
-    for FILE in */*.enc
-    do
-      gcloud kms decrypt --plaintext-file $(dirname ${FILE})/$(basename ${FILE} .enc) \
-         --ciphertext-file ${FILE} \
-         --location=global --keyring=airflow --key=airflow_crypto_key \
-         --project=${AIRFLOW_BREEZE_PROJECT_ID} \
-         && echo Decrypted ${FILE}
-    done
-    chmod -v og-rw *
-    popd
-fi
+python3 ${MY_DIR}/decrypt_files.py check-permission \
+    --gcp-project-id ${AIRFLOW_BREEZE_PROJECT_ID} \
+    --keys-dir ${AIRFLOW_BREEZE_KEYS_DIR}
+
+echo "Decrypting all files from ${AIRFLOW_BREEZE_KEYS_DIR} and ${AIRFLOW_BREEZE_NOTIFICATIONS_DIR}"
+python3 ${MY_DIR}/decrypt_files.py decrypt \
+    --gcp-project-id ${AIRFLOW_BREEZE_PROJECT_ID} \
+    --keys-dir ${AIRFLOW_BREEZE_KEYS_DIR} \
+    --notifications-dir ${AIRFLOW_BREEZE_NOTIFICATIONS_DIR}
+chmod -v og-rw ${AIRFLOW_BREEZE_KEYS_DIR}/*
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Decrypts the encrypted key and notification files of the workspace config.
+
+The digests of the ciphertext and of the plaintext written from it are kept in
+a manifest in the keys directory, so a file is only decrypted again when its
+ciphertext changed or the plaintext was removed or modified.
+"""
+import argparse
+import errno
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from kms_decryption import get_kms_backend, get_max_workers, get_secret_cache_ttl
+
+ENCRYPTED_FILE_SUFFIX = '.enc'
+
+# Kept next to the decrypted service account keys. The name is matched by the
+# *.json pattern of the keys .gitignore.
+MANIFEST_FILE_NAME = '.decrypted_files.json'
+
+PERMISSION_ERROR = "ERROR! You should have KMS Encrypt/Decrypt Role assigned " \
+                   "in Google Cloud Platform. Exiting!"
+
+
+def _digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def write_private_file(path, content):
+    """Writes the file atomically, readable only by the owner."""
+    temporary_file = path + '.tmp'
+    fd = os.open(temporary_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.chmod(temporary_file, 0o600)
+    os.replace(temporary_file, path)
+
+
+def find_encrypted_files(keys_dir, notifications_dir=None):
+    """Returns paths of keys/*.enc and notifications/*/*.enc files."""
+    files = sorted(glob.glob(os.path.join(keys_dir, '*' + ENCRYPTED_FILE_SUFFIX)))
+    if notifications_dir and os.path.isdir(notifications_dir):
+        files.extend(sorted(glob.glob(os.path.join(notifications_dir, '*',
+                                                   '*' + ENCRYPTED_FILE_SUFFIX))))
+    return files
+
+
+class DecryptedFilesManifest(object):
+    """Digests of the encrypted files and of the plaintext decrypted from them."""
+
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        try:
+            with open(manifest_file) as f:
+                self._content = json.load(f)
+        except (OSError, IOError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self._content = {}
+        except ValueError:
+            # Corrupted manifest only results in decrypting all files again
+            self._content = {}
+        self._content.setdefault('files', {})
+
+    def _key(self, encrypted_file):
+        # Relative, so that the workspace can be moved or mounted elsewhere
+        return os.path.relpath(os.path.abspath(encrypted_file),
+                               os.path.dirname(os.path.abspath(self.manifest_file)))
+
+    def clear(self):
+        self._content = dict(files={})
+
+    def is_up_to_date(self, encrypted_file, ciphertext):
+        entry = self._content['files'].get(self._key(encrypted_file))
+        if not entry or entry['ciphertext'] != _digest(ciphertext):
+            return False
+        try:
+            with open(encrypted_file[:-len(ENCRYPTED_FILE_SUFFIX)], 'rb') as f:
+                return entry['plaintext'] == _digest(f.read())
+        except (OSError, IOError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+    def update(self, encrypted_file, ciphertext, plaintext):
+        self._content['files'][self._key(encrypted_file)] = dict(
+            ciphertext=_digest(ciphertext), plaintext=_digest(plaintext))
+
+    def permission_checked(self, backend, ttl):
+        checked = self._content.get('permission_checked', {}).get(backend.project_id)
+        return checked is not None and checked + ttl >= time.time()
+
+    def set_permission_checked(self, backend):
+        self._content.setdefault('permission_checked', {})[backend.project_id] = time.time()
+
+    def save(self):
+        write_private_file(self.manifest_file,
+                           json.dumps(self._content, indent=2, sort_keys=True).encode('utf-8'))
+
+
+def decrypt_files(backend, encrypted_files, manifest, max_workers=None):
+    """Decrypts the files which are not up to date concurrently.
+
+    Returns (decrypted files, skipped files).
+    """
+    to_decrypt = []
+    skipped = []
+    for encrypted_file in encrypted_files:
+        with open(encrypted_file, 'rb') as f:
+            ciphertext = f.read()
+        if manifest.is_up_to_date(encrypted_file, ciphertext):
+            skipped.append(encrypted_file)
+        else:
+            to_decrypt.append((encrypted_file, ciphertext))
+
+    def decrypt(encrypted_file, ciphertext):
+        plaintext = backend.decrypt(ciphertext)
+        write_private_file(encrypted_file[:-len(ENCRYPTED_FILE_SUFFIX)], plaintext)
+        return plaintext
+
+    if to_decrypt:
+        workers = max(1, min(max_workers or get_max_workers(), len(to_decrypt)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(decrypt, encrypted_file, ciphertext)
+                       for encrypted_file, ciphertext in to_decrypt]
+            try:
+                for (encrypted_file, ciphertext), future in zip(to_decrypt, futures):
+                    manifest.update(encrypted_file, ciphertext, future.result())
+                manifest.set_permission_checked(backend)
+            finally:
+                # Files decrypted before the failure are not decrypted again
+                manifest.save()
+    return [encrypted_file for encrypted_file, _ in to_decrypt], skipped
+
+
+def check_permission(backend, manifest, ttl=None):
+    """Checks that the key can be used for encryption (also needed by the bootstrap).
+
+    A successful check (or decryption) is remembered for ttl seconds.
+    Returns True if the key can be used.
+    """
+    ttl = get_secret_cache_ttl() if ttl is None else ttl
+    if ttl > 0 and manifest.permission_checked(backend, ttl):
+        return True
+    try:
+        backend.encrypt(b'TEST')
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return False
+    manifest.set_permission_checked(backend)
+    manifest.save()
+    return True
+
+
+# Replaces the gcloud kms decrypt loops of the shell scripts:
+#
+#   decrypt_files.py decrypt -p <PROJECT> -k <KEYS_DIR> [-n <NOTIFICATIONS_DIR>]
+#   decrypt_files.py check-permission -p <PROJECT> -k <KEYS_DIR>
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Decrypts the encrypted key and notification files.')
+    parser.add_argument('command', choices=['decrypt', 'check-permission'])
+    parser.add_argument('--gcp-project-id', '-p', required=True, help='GCP project id')
+    parser.add_argument('--keys-dir', '-k', required=True,
+                        help='Directory with the encrypted keys (keeps the manifest)')
+    parser.add_argument('--notifications-dir', '-n',
+                        help='Directory with the notification subdirectories')
+    parser.add_argument('--max-workers', '-w', type=int,
+                        help='Number of files decrypted at the same time '
+                             '[AIRFLOW_BREEZE_KMS_MAX_WORKERS or 8]')
+    parser.add_argument('--force', '-f', action='store_true',
+                        help='Decrypt the files and check permission even if up to date')
+    args = parser.parse_args()
+
+    kms_backend = get_kms_backend(args.gcp_project_id)
+    files_manifest = DecryptedFilesManifest(os.path.join(args.keys_dir, MANIFEST_FILE_NAME))
+    if args.command == 'check-permission':
+        # The KMS key itself is checked, not the envelope data key
+        if not check_permission(kms_backend.backend, files_manifest,
+                                ttl=0 if args.force else None):
+            print(PERMISSION_ERROR)
+            sys.exit(1)
+        sys.exit(0)
+    if args.force:
+        files_manifest.clear()
+    try:
+        decrypted, up_to_date = decrypt_files(
+            kms_backend, find_encrypted_files(args.keys_dir, args.notifications_dir),
+            files_manifest, max_workers=args.max_workers)
+    except subprocess.CalledProcessError as e:
+        print("Decryption failed: {}".format(e))
+        print(PERMISSION_ERROR)
+        sys.exit(1)
+    for decrypted_file in decrypted:
+        print("Decrypted {}".format(decrypted_file))
+    print("Decrypted {} files, skipped {} unchanged and already decrypted files".format(
+        len(decrypted), len(up_to_date)))
@@ -48,25 +48,14 @@ if [[ -z "${AIRFLOW_BREEZE_PROJECT_ID}" ]]; then
   fi
 fi
 
-pushd ${AIRFLOW_BREEZE_KEYS_DIR}
-FILES=$(ls *.json *.pem 2>/dev/null || true)
-echo "Encrypting all files '${FILES}'"
-for FILE in ${FILES}
-do
-  gcloud kms encrypt --plaintext-file ${FILE} --ciphertext-file ${FILE}.enc \
-     --location=global --keyring=airflow --key=airflow_crypto_key \
-     --project=${AIRFLOW_BREEZE_PROJECT_ID} \
-     && echo Encrypted ${FILE}
-done
-popd
-
-pushd ${AIRFLOW_BREEZE_NOTIFICATIONS_DIR}
-FILES=$(ls */secret.variables.yaml 2>/dev/null || true)
-for FILE in ${FILES}
-do
-  gcloud kms encrypt --plaintext-file ${FILE} --ciphertext-file ${FILE}.enc \
-     --location=global --keyring=airflow --key=airflow_crypto_key \
-     --project=${AIRFLOW_BREEZE_PROJECT_ID} \
-     && echo Encrypted ${FILE}
-done
-
+shopt -s nullglob
+FILES=(${AIRFLOW_BREEZE_KEYS_DIR}/*.json ${AIRFLOW_BREEZE_KEYS_DIR}/*.pem \
+       ${AIRFLOW_BREEZE_NOTIFICATIONS_DIR}/*/secret.variables.yaml)
+shopt -u nullglob
+echo "Encrypting all files '${FILES[*]:-}'"
+# Encrypts with the envelope format if AIRFLOW_BREEZE_ENVELOPE_ENCRYPTION is "true"
+# (the notification secrets are always encrypted with the KMS key only)
+python3 ${MY_DIR}/kms_decryption.py encrypt-files \
+    --gcp-project-id ${AIRFLOW_BREEZE_PROJECT_ID} \
+    --keys-dir ${AIRFLOW_BREEZE_KEYS_DIR} \
+    ${FILES[@]+"${FILES[@]}"}
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
+import collections
 import errno
+import json
 import os
 import random
 import string
@@ -8,6 +10,9 @@ import subprocess
 import sys
 
 ENCRYPTED_SUFFIX = '_ENCRYPTED'
+# The helper runs in the IDE virtualenv (which may be Python 2.7), the secrets
+# agent client needs Python 3
+PYTHON3 = os.environ.get('AIRFLOW_BREEZE_PYTHON3', 'python3')
 #
 # Licensed to the Apache Software Foundation (ASF) under one
 # or more contributor license agreements.  See the NOTICE file
@@ -79,44 +84,18 @@ def process_environment_variables():
     os.environ['AIRFLOW_BREEZE_TEST_SUITE'] = lowercase_user_and_python_version
     os.environ['AIRFLOW_BREEZE_SHORT_SHA'] = last_random
     variable_env_file = os.path.join(airflow_config_dir, 'variables.env')
-    with open(variable_env_file) as f:
-        lines = f.readlines()
-    variable_names = []
-    for line in lines:
-        if not line.startswith('#') and not line.strip() == "":
-            key = line.split('=')[0]
-            variable_names.append(key)
-            if key.endswith(ENCRYPTED_SUFFIX):
-                variable_names.append(key[:-len(ENCRYPTED_SUFFIX)])
     if not os.path.isfile(variable_env_file):
         print("The {} is not variable env file.".format(variable_env_file))
         exit(1)
-    variables = subprocess.check_output(
-        [
-            "/bin/bash", "-c", "set -a && "
-                               "source {} && "
-                               "set +a && "
-                               "printenv".
-            format(variable_env_file)
-        ]
-    ).decode('utf-8')
-    all_variables = {}
-    for line in variables.splitlines():
-        key, val = line.split('=', 1)
-        if key.endswith(ENCRYPTED_SUFFIX):
-            original_key = key[:-len(ENCRYPTED_SUFFIX)]
-            decrypted_val = subprocess.check_output(
-                ['bash', '-c',
-                 'echo -n "{}" | base64 --decode | '
-                 'gcloud kms decrypt --plaintext-file=- '
-                 '--ciphertext-file=- --location=global '
-                 '--keyring=airflow '
-                 '--project={} '
-                 '--key=airflow_crypto_key'.format(val, project_id)]). \
-                decode('utf-8')
-            all_variables[original_key] = decrypted_val
-        else:
-            all_variables[key] = val
+    # Served by the secrets agent of the workspace if it is running
+    environment = json.loads(subprocess.check_output(
+        [PYTHON3, os.path.join(current_file_dir, 'secrets_agent.py'), 'get',
+         '--config-dir', airflow_config_dir, '--gcp-project-id', project_id,
+         '--format', 'json']).decode('utf-8'), object_pairs_hook=collections.OrderedDict)
+    variable_names = list(environment)
+    # Only the decrypted values are printed
+    all_variables = {key: val for key, val in environment.items()
+                     if not key.endswith(ENCRYPTED_SUFFIX)}
 
     # Force enabling of Cloud SQL query tests
     add_variable("GCP_ENABLE_CLOUDSQL_QUERY_TEST", variable_names, all_variables, "True")
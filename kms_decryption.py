@@ -0,0 +1,463 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Encrypts and decrypts values with the KMS key of the workspace project."""
+import argparse
+import base64
+import errno
+import hashlib
+import hmac
+import json
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    # Only needed for the envelope format (pip install cryptography)
+    AESGCM = None
+
+KEYRING = 'airflow'
+KEY = 'airflow_crypto_key'
+LOCATION = 'global'
+
+# Each gcloud invocation spends most of its time starting up, so several of them
+# can run at the same time without overloading the KMS API.
+# Overridden with AIRFLOW_BREEZE_KMS_MAX_WORKERS.
+DEFAULT_MAX_WORKERS = 8
+
+ENCRYPTED_SUFFIX = '_ENCRYPTED'
+
+# The cache is kept in the keys directory of the workspace config, next to the
+# decrypted service account keys. The name is matched by its .gitignore.
+SECRET_CACHE_FILE_NAME = '.decrypted_secrets_cache.json'
+# Number of seconds the decrypted values are kept (0 disables the cache).
+# Overridden with AIRFLOW_BREEZE_SECRET_CACHE_TTL.
+DEFAULT_SECRET_CACHE_TTL = 86400
+
+# When enabled, values and files are encrypted locally with a data key which is
+# wrapped with the KMS key (one KMS call per run instead of one per secret).
+# Both formats are always decrypted, whatever the setting.
+ENVELOPE_ENCRYPTION = os.environ.get('AIRFLOW_BREEZE_ENVELOPE_ENCRYPTION', 'false') == 'true'
+ENVELOPE_MAGIC = b'ABENV1'
+# The wrapped data key is kept in the keys directory of the workspace config (and
+# committed with the encrypted files), so that later runs encrypt with the same key.
+WRAPPED_DATA_KEY_FILE_NAME = 'envelope_data_key.wrapped'
+# Files decrypted with plain 'gcloud kms decrypt' (by the Cloud Build deploying
+# the Slack notification function) are always encrypted with the KMS key itself.
+KMS_ONLY_FILE_NAMES = ['secret.variables.yaml']
+
+
+class KmsBackend(object):
+    """Base class of the backends encrypting and decrypting raw bytes."""
+
+    def encrypt(self, plaintext):
+        raise NotImplementedError()
+
+    def decrypt(self, ciphertext):
+        raise NotImplementedError()
+
+
+class GcloudKmsBackend(KmsBackend):
+    """Uses Cloud KMS via the gcloud command line tool."""
+
+    def __init__(self, project_id, keyring=KEYRING, key=KEY, location=LOCATION,
+                 check_output=subprocess.check_output):
+        self.project_id = project_id
+        self.keyring = keyring
+        self.key = key
+        self.location = location
+        self._check_output = check_output
+
+    def _run(self, operation, data):
+        return self._check_output(
+            [
+                'gcloud', 'kms', operation,
+                '--plaintext-file=-', '--ciphertext-file=-',
+                '--location={}'.format(self.location),
+                '--keyring={}'.format(self.keyring),
+                '--key={}'.format(self.key),
+                '--project={}'.format(self.project_id)
+            ], input=data)
+
+    def encrypt(self, plaintext):
+        return self._run('encrypt', plaintext)
+
+    def decrypt(self, ciphertext):
+        return self._run('decrypt', ciphertext)
+
+
+class LocalKeyBackend(KmsBackend):
+    """Stand-in for KMS that keeps the key in memory.
+
+    It is only meant for exercising the decryption code without a GCP project -
+    the ciphertext is authenticated but the cipher is not a production one.
+    """
+
+    NONCE_SIZE = 16
+    TAG_SIZE = 32
+
+    def __init__(self, key, project_id='local', keyring=KEYRING, key_name=KEY):
+        self._key = key if isinstance(key, bytes) else key.encode('utf-8')
+        self.project_id = project_id
+        self.keyring = keyring
+        self.key = key_name
+
+    def _keystream(self, nonce, length):
+        blocks = []
+        for counter in range((length + 31) // 32):
+            blocks.append(hmac.new(self._key, nonce + counter.to_bytes(8, 'big'),
+                                   hashlib.sha256).digest())
+        return b''.join(blocks)[:length]
+
+    def encrypt(self, plaintext):
+        nonce = os.urandom(self.NONCE_SIZE)
+        body = bytes(a ^ b for a, b in zip(plaintext,
+                                           self._keystream(nonce, len(plaintext))))
+        tag = hmac.new(self._key, nonce + body, hashlib.sha256).digest()
+        return nonce + body + tag
+
+    def decrypt(self, ciphertext):
+        if len(ciphertext) < self.NONCE_SIZE + self.TAG_SIZE:
+            raise ValueError("The ciphertext is too short")
+        nonce = ciphertext[:self.NONCE_SIZE]
+        body = ciphertext[self.NONCE_SIZE:-self.TAG_SIZE]
+        tag = ciphertext[-self.TAG_SIZE:]
+        expected_tag = hmac.new(self._key, nonce + body, hashlib.sha256).digest()
+        if not hmac.compare_digest(tag, expected_tag):
+            raise ValueError("The ciphertext was not encrypted with this key")
+        return bytes(a ^ b for a, b in zip(body, self._keystream(nonce, len(body))))
+
+
+class EnvelopeBackend(KmsBackend):
+    """Encrypts locally with AES-GCM using a data key wrapped by another backend.
+
+    The envelope is ENVELOPE_MAGIC, length of the wrapped data key (2 bytes),
+    the wrapped data key, 12 bytes nonce and the AES-GCM ciphertext. Each
+    distinct wrapped data key is unwrapped once per process, so decrypting any
+    number of envelopes encrypted in the same run takes one call of the wrapping
+    backend. Ciphertexts without the magic are decrypted by the wrapping backend
+    directly (the format used before envelopes were introduced).
+    """
+
+    NONCE_SIZE = 12
+
+    def __init__(self, backend, wrapped_key_file=None, encrypt_envelopes=True):
+        self.backend = backend
+        self.project_id = backend.project_id
+        self.keyring = backend.keyring
+        self.key = backend.key
+        self.wrapped_key_file = wrapped_key_file
+        self.encrypt_envelopes = encrypt_envelopes
+        self.unwrap_calls = 0
+        self._data_key = None
+        self._wrapped_data_key = None
+        self._unwrapped_keys = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _check_available():
+        if AESGCM is None:
+            raise Exception("The envelope format needs the cryptography package. "
+                            "Install it with 'pip install cryptography'")
+
+    def _unwrap(self, wrapped_data_key):
+        with self._lock:
+            if wrapped_data_key not in self._unwrapped_keys:
+                self.unwrap_calls += 1
+                self._unwrapped_keys[wrapped_data_key] = self.backend.decrypt(
+                    wrapped_data_key)
+            return self._unwrapped_keys[wrapped_data_key]
+
+    def _get_data_key(self):
+        with self._lock:
+            if self._data_key is None and self.wrapped_key_file and \
+                    os.path.exists(self.wrapped_key_file):
+                with open(self.wrapped_key_file, 'rb') as f:
+                    self._wrapped_data_key = f.read()
+                self.unwrap_calls += 1
+                self._data_key = self.backend.decrypt(self._wrapped_data_key)
+                self._unwrapped_keys[self._wrapped_data_key] = self._data_key
+            if self._data_key is None:
+                data_key = AESGCM.generate_key(bit_length=256)
+                self._wrapped_data_key = self.backend.encrypt(data_key)
+                self._data_key = data_key
+                self._unwrapped_keys[self._wrapped_data_key] = data_key
+                if self.wrapped_key_file:
+                    with open(self.wrapped_key_file, 'wb') as f:
+                        f.write(self._wrapped_data_key)
+            return self._data_key, self._wrapped_data_key
+
+    def encrypt(self, plaintext):
+        if not self.encrypt_envelopes:
+            return self.backend.encrypt(plaintext)
+        self._check_available()
+        data_key, wrapped_data_key = self._get_data_key()
+        header = ENVELOPE_MAGIC + struct.pack('>H', len(wrapped_data_key)) + \
+            wrapped_data_key
+        nonce = os.urandom(self.NONCE_SIZE)
+        return header + nonce + AESGCM(data_key).encrypt(nonce, plaintext, header)
+
+    def decrypt(self, ciphertext):
+        if not is_envelope(ciphertext):
+            return self.backend.decrypt(ciphertext)
+        self._check_available()
+        offset = len(ENVELOPE_MAGIC)
+        wrapped_length, = struct.unpack('>H', ciphertext[offset:offset + 2])
+        offset += 2 + wrapped_length
+        if len(ciphertext) < offset + self.NONCE_SIZE:
+            raise ValueError("The envelope is too short")
+        header = ciphertext[:offset]
+        nonce = ciphertext[offset:offset + self.NONCE_SIZE]
+        data_key = self._unwrap(header[len(ENVELOPE_MAGIC) + 2:])
+        return AESGCM(data_key).decrypt(nonce, ciphertext[offset + self.NONCE_SIZE:], header)
+
+
+def is_envelope(ciphertext):
+    return ciphertext.startswith(ENVELOPE_MAGIC)
+
+
+def get_kms_backend(project_id, keys_dir=None, envelope=None,
+                    check_output=subprocess.check_output):
+    """Returns the backend decrypting both formats and encrypting with the configured one.
+
+    envelope (ENVELOPE_ENCRYPTION by default) selects the envelope format for
+    encryption. The wrapped data key is kept in keys_dir when it is specified.
+    """
+    if envelope is None:
+        envelope = ENVELOPE_ENCRYPTION
+    wrapped_key_file = os.path.join(keys_dir, WRAPPED_DATA_KEY_FILE_NAME) \
+        if keys_dir else None
+    return EnvelopeBackend(GcloudKmsBackend(project_id, check_output=check_output),
+                           wrapped_key_file=wrapped_key_file, encrypt_envelopes=envelope)
+
+
+def get_file_backend(backend, file):
+    """Returns the backend encrypting the file - the KMS key for KMS_ONLY_FILE_NAMES."""
+    if isinstance(backend, EnvelopeBackend) and \
+            os.path.basename(file) in KMS_ONLY_FILE_NAMES:
+        return backend.backend
+    return backend
+
+
+def encrypt_files(backend, files):
+    """Encrypts each of the files to <FILE>.enc."""
+    for file in files:
+        with open(file, 'rb') as plaintext_file:
+            encrypted_content = get_file_backend(backend, file).encrypt(plaintext_file.read())
+        with open(file + '.enc', 'wb') as encrypted_file:
+            encrypted_file.write(encrypted_content)
+        print("Encrypted {}".format(file))
+
+
+def decrypt_value(backend, encoded_value):
+    """Decrypts single base64-encoded ciphertext (the *_ENCRYPTED variable format)."""
+    return backend.decrypt(base64.b64decode(encoded_value)).decode('utf-8')
+
+
+def encrypt_value(backend, value):
+    """Encrypts the value and returns it in the *_ENCRYPTED variable format."""
+    return base64.b64encode(backend.encrypt(value.encode('utf-8'))).decode('ascii')
+
+
+def get_int_environment_variable(name, default):
+    """Returns the integer value of the environment variable or default if not set.
+
+    A malformed value is reported and the default is used instead.
+    """
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        sys.stderr.write("Ignoring {}={} which is not an integer. Using {}\n".format(
+            name, value, default))
+        return default
+
+
+def get_max_workers():
+    return get_int_environment_variable('AIRFLOW_BREEZE_KMS_MAX_WORKERS', DEFAULT_MAX_WORKERS)
+
+
+def get_secret_cache_ttl():
+    return get_int_environment_variable('AIRFLOW_BREEZE_SECRET_CACHE_TTL',
+                                        DEFAULT_SECRET_CACHE_TTL)
+
+
+class DecryptedSecretCache(object):
+    """On-disk cache of decrypted values, readable only by the owner.
+
+    Entries are keyed by the SHA-256 digest of the ciphertext and the
+    project/keyring/key used to decrypt it, so any change of the encrypted value
+    or of the key results in a miss.
+    """
+
+    def __init__(self, cache_file, ttl=None):
+        self.cache_file = cache_file
+        self.ttl = get_secret_cache_ttl() if ttl is None else ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._modified = False
+
+    @staticmethod
+    def cache_key(backend, encoded_value):
+        digest = hashlib.sha256(base64.b64decode(encoded_value))
+        digest.update('|{}|{}|{}'.format(backend.project_id, backend.keyring,
+                                         backend.key).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.cache_file) as f:
+                    self._entries = json.load(f)
+            except (OSError, IOError) as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                self._entries = {}
+            except ValueError:
+                # Corrupted cache is simply rebuilt
+                self._entries = {}
+        return self._entries
+
+    def get(self, key):
+        entry = self._load().get(key) if self.ttl > 0 else None
+        if entry is None or entry['time'] + self.ttl < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['value']
+
+    def put(self, key, value):
+        if self.ttl > 0:
+            self._load()[key] = dict(value=value, time=time.time())
+            self._modified = True
+
+    def save(self):
+        if not self._modified:
+            return
+        now = time.time()
+        entries = {key: entry for key, entry in self._load().items()
+                   if entry['time'] + self.ttl >= now}
+        temporary_file = self.cache_file + '.tmp'
+        fd = os.open(temporary_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.chmod(temporary_file, 0o600)
+        os.replace(temporary_file, self.cache_file)
+        self._modified = False
+
+    def invalidate(self):
+        self._entries = {}
+        self._modified = False
+        try:
+            os.remove(self.cache_file)
+        except (OSError, IOError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def print_statistics(self):
+        sys.stderr.write("Decrypted secret cache: {} hits, {} misses\n".format(
+            self.hits, self.misses))
+
+
+def decrypt_values(backend, encoded_values, max_workers=None, cache=None):
+    """Decrypts all base64-encoded ciphertexts concurrently.
+
+    Identical ciphertexts are decrypted only once and the ones found in the cache
+    (if provided) are not decrypted at all. The returned list of plaintexts
+    is in the same order as the encoded values passed.
+    """
+    decrypted = {}
+    to_decrypt = []
+    for value in dict.fromkeys(encoded_values):
+        cached_value = cache.get(cache.cache_key(backend, value)) if cache else None
+        if cached_value is None:
+            to_decrypt.append(value)
+        else:
+            decrypted[value] = cached_value
+    if to_decrypt:
+        workers = max(1, min(max_workers or get_max_workers(), len(to_decrypt)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            decrypted.update(zip(to_decrypt,
+                                 executor.map(lambda value: decrypt_value(backend, value),
+                                              to_decrypt)))
+        if cache:
+            for value in to_decrypt:
+                cache.put(cache.cache_key(backend, value), decrypted[value])
+            cache.save()
+    return [decrypted[value] for value in encoded_values]
+
+
+def decrypt_environment(backend, environment, cache=None):
+    """Returns decrypted values of all *_ENCRYPTED variables (without the suffix)."""
+    encrypted_keys = sorted(key for key in environment if key.endswith(ENCRYPTED_SUFFIX))
+    decrypted_values = decrypt_values(backend,
+                                      [environment[key] for key in encrypted_keys],
+                                      cache=cache)
+    return [(key[:-len(ENCRYPTED_SUFFIX)], value)
+            for key, value in zip(encrypted_keys, decrypted_values)]
+
+
+# Decrypts the _ENCRYPTED variables of the environment (cached in the keys directory):
+#
+#   kms_decryption.py decrypt-environment -p <PROJECT> -c <KEYS_DIR>/<CACHE_FILE>
+#   kms_decryption.py invalidate-cache -c <KEYS_DIR>/<CACHE_FILE>
+#
+# and replaces the gcloud kms encrypt loops of encrypt_all_files.sh:
+#
+#   kms_decryption.py encrypt-files -p <PROJECT> -k <KEYS_DIR> FILE...
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Decrypts *_ENCRYPTED variables from the environment.')
+    parser.add_argument('command',
+                        choices=['decrypt-environment', 'invalidate-cache', 'encrypt-files'])
+    parser.add_argument('files', nargs='*', help='Files encrypted to <FILE>.enc')
+    parser.add_argument('--gcp-project-id', '-p', help='GCP project id')
+    parser.add_argument('--cache-file', '-c',
+                        help='Cache of decrypted values (not used if not specified)')
+    parser.add_argument('--keys-dir', '-k',
+                        help='Keys directory where the wrapped data key of the envelope '
+                             'format is kept')
+    args = parser.parse_args()
+
+    secret_cache = DecryptedSecretCache(args.cache_file) if args.cache_file else None
+    if args.command == 'invalidate-cache':
+        if not secret_cache:
+            parser.error('--cache-file is required to invalidate the cache')
+        secret_cache.invalidate()
+        print("Removed decrypted secret cache {}".format(args.cache_file))
+        sys.exit(0)
+    if not args.gcp_project_id:
+        parser.error('--gcp-project-id is required to encrypt or decrypt')
+    kms_backend = get_kms_backend(args.gcp_project_id, keys_dir=args.keys_dir)
+    if args.command == 'encrypt-files':
+        encrypt_files(kms_backend, args.files)
+        sys.exit(0)
+    for decrypted_key, decrypted_val in decrypt_environment(
+            kms_backend, os.environ, cache=secret_cache):
+        # The same as the shell $(...) substitution used by the bash script
+        print("{}={}".format(decrypted_key, decrypted_val.rstrip('\n')))
+    if secret_cache:
+        secret_cache.print_statistics()
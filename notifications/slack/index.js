@@ -1,6 +1,7 @@
 const {Storage} = require('@google-cloud/storage');
 const {PubSub} = require('@google-cloud/pubsub');
 const Octokit = require('@octokit/rest');
+const {LocalBucket} = require('./local_bucket');
 
 let ps;
 
@@ -14,11 +15,10 @@ const AIRFLOW_BREEZE_GITHUB_ORGANIZATION = process.env.AIRFLOW_BREEZE_GITHUB_ORG
 const webhook = new IncomingWebhook(process.env.SLACK_HOOK);
 const test_suites = process.env.AIRFLOW_BREEZE_TEST_SUITES.split(" ");
 
-const storage = new Storage({
-    projectId: PROJECT_ID,
-});
-
-const bucket = storage.bucket(GCS_BUCKET);
+// LOCAL_BUCKET_DIR replaces the GCS bucket with a local directory (for testing)
+const bucket = process.env.LOCAL_BUCKET_DIR ?
+    new LocalBucket(process.env.LOCAL_BUCKET_DIR) :
+    new Storage({projectId: PROJECT_ID}).bucket(GCS_BUCKET);
 const octokit = new Octokit();
 
 // subscribe is the main function called by Cloud Functions.
@@ -62,40 +62,42 @@ module.exports.slack_notify = async (data, context) => {
     }
 };
 
-async function get_test_suite_status(build, test_suite) {
-    const failure_file = bucket.file(`${build.id}/tests/${test_suite}-failure.txt`);
-    const success_file = bucket.file(`${build.id}/tests/${test_suite}-success.txt`);
+// Reads the results manifest written by the CI scripts (one object for all suites)
+async function get_test_results(build) {
+    const results_file = bucket.file(`${build.id}/tests/results.json`);
     try {
-        await failure_file.download({destination: `/tmp/${test_suite}-failure.txt`});
-        // Yeah. if we can get the file, it means it was a failure :)
-        return {
-            title: `${test_suite} tests [FAILURE]`,
-            title_link: `https://storage.googleapis.com/${GCS_BUCKET}/${build.id}/tests/${test_suite}.xml.html`,
-            color: 'danger'
-        }
+        const [content] = await results_file.download();
+        return JSON.parse(content.toString());
     } catch (error) {
         console.log(error);
-        try {
-            await success_file.download({destination: `/tmp/${test_suite}-success.txt`});
-            return {
-                title: `${test_suite} tests [SUCCESS]`,
-                title_link: `https://storage.googleapis.com/${GCS_BUCKET}/${build.id}/tests/${test_suite}.xml.html`,
-                color: 'good'
-            }
-        } catch (error) {
-            console.log(error);
-            console.log(`Neither success nor failure file found. The test suite ${test_suite} was not run. Skipping it`);
-            return undefined;
-        }
+        console.log("The results manifest is missing. No test suite was run.");
+        return {suites: {}};
+    }
+}
+
+function get_test_suite_status(build, results, test_suite) {
+    const suite = results.suites[test_suite];
+    if (suite === undefined || (suite.status !== 'passed' && suite.status !== 'failed')) {
+        console.log(`The test suite ${test_suite} was not run. Skipping it`);
+        return undefined;
+    }
+    const failed = suite.status === 'failed';
+    return {
+        title: `${test_suite} tests [${failed ? 'FAILURE' : 'SUCCESS'}]`,
+        title_link: `https://storage.googleapis.com/${GCS_BUCKET}/${build.id}/tests/${test_suite}.xml.html`,
+        text: `${suite.tests} tests, ${suite.failures} failures, ${suite.errors} errors, ` +
+            `${suite.skipped} skipped in ${Math.round(suite.duration)}s`,
+        color: failed ? 'danger' : 'good'
     }
 }
 
 async function get_documentation_attachment(build, attachments) {
-    const documentation_index_file = bucket.file(`${build.id}/docs/index.html`);
+    // The docs are uploaded as an archive with an index - see log_archive.py
+    const documentation_index_file = bucket.file(`${build.id}/docs.gz.index.json`);
     try {
-        await documentation_index_file.download({destination: `/tmp/index.html`});
+        await documentation_index_file.download({destination: `/tmp/docs.gz.index.json`});
         attachments[0].fields.push({
-            value: `<https://storage.googleapis.com/${GCS_BUCKET}/${build.id}/docs/index.html| Documentation>`,
+            value: `<https://storage.googleapis.com/${GCS_BUCKET}/${build.id}/docs.gz| Documentation archive>`,
             short: true
         });
     } catch (error) {
@@ -152,9 +154,10 @@ async function createSlackMessage(build) {
         value: `Commit: <https://github.com/${AIRFLOW_BREEZE_GITHUB_ORGANIZATION}/${repo_name}/commit/${commit_sha}| ${data.commit.message.split('\n')[0]}>`,
     });
 
+    const results = await get_test_results(build);
     let i;
     for (i = 0; i < test_suites.length; i++) {
-        let attachment_test_suite = await get_test_suite_status(build, test_suites[i]);
+        let attachment_test_suite = get_test_suite_status(build, results, test_suites[i]);
         if (attachment_test_suite !== undefined) {
             attachments.push(attachment_test_suite);
         }
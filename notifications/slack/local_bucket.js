@@ -0,0 +1,49 @@
+// Directory-backed stand-in for the GCS bucket, with the subset of the
+// @google-cloud/storage Bucket API used by the notifier. Objects are files
+// under the directory. Used when LOCAL_BUCKET_DIR is set (for local testing).
+const fs = require('fs');
+const path = require('path');
+const {promisify} = require('util');
+
+const readFile = promisify(fs.readFile);
+const writeFile = promisify(fs.writeFile);
+
+function make_dirs(dir) {
+    if (!fs.existsSync(dir)) {
+        make_dirs(path.dirname(dir));
+        fs.mkdirSync(dir);
+    }
+}
+
+class LocalFile {
+    constructor(bucket_dir, name) {
+        this.name = name;
+        this.file_path = path.join(bucket_dir, name);
+    }
+
+    async download(options = {}) {
+        const content = await readFile(this.file_path);
+        if (options.destination) {
+            await writeFile(options.destination, content);
+            return [];
+        }
+        return [content];
+    }
+
+    async save(content) {
+        make_dirs(path.dirname(this.file_path));
+        await writeFile(this.file_path, content);
+    }
+}
+
+class LocalBucket {
+    constructor(bucket_dir) {
+        this.bucket_dir = bucket_dir;
+    }
+
+    file(name) {
+        return new LocalFile(this.bucket_dir, name);
+    }
+}
+
+module.exports.LocalBucket = LocalBucket;
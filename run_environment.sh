@@ -79,6 +79,12 @@ RECREATE_GCP_PROJECT=false
 #################### Compares the boot
 COMPARE_BOOTSTRAP_CONFIG=false
 
+#################### Invalidates cache of decrypted variables
+INVALIDATE_SECRET_CACHE=false
+
+#################### Serves decrypted variables from the secrets agent
+SECRETS_AGENT=${AIRFLOW_BREEZE_SECRETS_AGENT:=false}
+
 #################### Helper functions
 
 # Helper function for building the docker image locally.
@@ -177,31 +183,19 @@ check_encrypt_decrypt_permission() {
   echo "Checking required permissions in KMS"
   echo
   echo "*************************************************************************"
-    echo "TEST" | gcloud kms encrypt --plaintext-file=- --ciphertext-file=- \
-         --location=global --keyring=airflow --key=airflow_crypto_key \
-         --project=${AIRFLOW_BREEZE_PROJECT_ID} >/dev/null || \
-         (echo "ERROR! You should have KMS Encrypt/Decrypt Role assigned in Google Cloud Platform. Exiting!" && exit 1)
+    python3 ${MY_DIR}/decrypt_files.py check-permission \
+        --gcp-project-id ${AIRFLOW_BREEZE_PROJECT_ID} \
+        --keys-dir ${AIRFLOW_BREEZE_KEYS_DIR}
 }
 
 decrypt_all_files() {
     ################## Decrypt all files variables #############################
-    pushd ${AIRFLOW_BREEZE_KEYS_DIR}
-    FILES=$(ls *.json.enc *.pem.enc 2>/dev/null || true)
     echo "Decrypting all new encrypted files"
-    for FILE in ${FILES}
-    do
-      DECRYPTED_FILE=$(basename ${FILE} .enc)
-      if [[ ${FILE} -nt ${DECRYPTED_FILE} ]]; then
-          gcloud kms decrypt --plaintext-file $(basename ${FILE} .enc) --ciphertext-file ${FILE} \
-             --location=global --keyring=airflow --key=airflow_crypto_key \
-             --project=${AIRFLOW_BREEZE_PROJECT_ID} \
-                && echo Decrypted ${FILE}
-      else
-        echo "Skipping the unchanged and already decrypted ${FILE}"
-      fi
-    done
-    chmod -v og-rw *
-    popd
+    python3 ${MY_DIR}/decrypt_files.py decrypt \
+        --gcp-project-id ${AIRFLOW_BREEZE_PROJECT_ID} \
+        --keys-dir ${AIRFLOW_BREEZE_KEYS_DIR} \
+        --notifications-dir ${GCP_CONFIG_DIR}/notifications
+    chmod -v og-rw ${AIRFLOW_BREEZE_KEYS_DIR}/*
     echo
     echo "All files decrypted! "
     echo
@@ -212,9 +206,11 @@ decrypt_all_variables() {
     echo
     echo "Decrypting encrypted variables"
     echo
-    (set -a && source "${GCP_CONFIG_DIR}/variables.env" && set +a && \
-     bash ${MY_DIR}/_decrypt_encrypted_variables.sh ${AIRFLOW_BREEZE_PROJECT_ID} >\
-          ${GCP_CONFIG_DIR}/decrypted_variables.env)
+    # Served by the secrets agent if it is running
+    python3 ${MY_DIR}/secrets_agent.py get --scope decrypted \
+          --config-dir ${GCP_CONFIG_DIR} \
+          --gcp-project-id ${AIRFLOW_BREEZE_PROJECT_ID} >\
+          ${GCP_CONFIG_DIR}/decrypted_variables.env
     echo
     echo "Variables decrypted! "
     echo
@@ -276,6 +272,19 @@ Reconfiguring existing project:
         Compares bootstrap configuration with current workspace configuration. It will
         report differences found and suggestions how those two should be aligned.
 
+-I, --invalidate-secret-cache
+        Removes the cache of decrypted variables kept in '<WORKSPACE>/config/keys' so
+        that all encrypted variables are decrypted again with KMS. Cached values
+        expire after AIRFLOW_BREEZE_SECRET_CACHE_TTL seconds [86400]. Stops the
+        secrets agent of the workspace as well.
+
+-A, --secrets-agent
+        Starts the secrets agent of the workspace (unless running already). It keeps
+        the decrypted variables in memory and serves them to run_environment.sh and
+        get_system_test_environment_variables.py until it is not used for
+        AIRFLOW_BREEZE_SECRETS_AGENT_IDLE_TIMEOUT seconds [14400]. Set
+        AIRFLOW_BREEZE_SECRETS_AGENT to \"true\" to always start it.
+
 Initializing your local virtualenv:
 
 -e, --initialize-local-virtualenv
@@ -403,10 +412,11 @@ if [[ ${GETOPT_RETVAL} != 4 ]]; then
 fi
 
 PARAMS=$(getopt \
-    -o hp:w:k:KP:f:F:iudcgGzeR:B:St:x: \
+    -o hp:w:k:KP:f:F:iudcgGzIAeR:B:St:x: \
     -l help,project:,workspace:,key-name:,key-list,python:,forward-webserver-port:,forward-postgres-port:,\
 do-not-rebuild-image,upload-image,dowload-image,cleanup-image,reconfigure-gcp-project,\
-recreate-gcp-project,compare-bootstrap-config,initialize-local-virtualenv,repository:,\
+recreate-gcp-project,compare-bootstrap-config,invalidate-secret-cache,secrets-agent,\
+initialize-local-virtualenv,repository:,\
 branch:,synchronise-master,test-target:,execute: \
     --name "$CMDNAME" -- "$@")
 
@@ -470,6 +480,10 @@ do
       RECREATE_GCP_PROJECT=true; RUN_DOCKER=false; shift ;;
     -z|--compare-bootstrap-config)
       COMPARE_BOOTSTRAP_CONFIG=true; RUN_DOCKER=false; shift ;;
+    -I|--invalidate-secret-cache)
+      INVALIDATE_SECRET_CACHE=true; shift ;;
+    -A|--secrets-agent)
+      SECRETS_AGENT=true; shift ;;
     -e|--initialize-local-virtualenv)
       INITIALIZE_LOCAL_VIRTUALENV=true; RUN_DOCKER=false; shift ;;
     -R|--repository)
@@ -515,6 +529,7 @@ echo ${AIRFLOW_BREEZE_WORKSPACE_NAME} > ${AIRFLOW_BREEZE_WORKSPACE_FILE}
 
 export GCP_CONFIG_DIR="${AIRFLOW_BREEZE_WORKSPACE_DIR}/config"
 export AIRFLOW_BREEZE_KEYS_DIR="${GCP_CONFIG_DIR}/keys"
+export AIRFLOW_BREEZE_SECRET_CACHE_FILE="${AIRFLOW_BREEZE_KEYS_DIR}/.decrypted_secrets_cache.json"
 export AIRFLOW_BREEZE_AIRFLOW_DIR=${AIRFLOW_BREEZE_WORKSPACE_DIR}/airflow
 export AIRFLOW_BREEZE_OUTPUT_DIR=${AIRFLOW_BREEZE_WORKSPACE_DIR}/output
 
@@ -693,28 +708,37 @@ echo ${AIRFLOW_BREEZE_PYTHON_VERSION} > ${AIRFLOW_BREEZE_PYTHON_VERSION_FILE}
 
 check_encrypt_decrypt_permission
 
+if [[ ${INVALIDATE_SECRET_CACHE} == "true" ]]; then
+    python3 ${MY_DIR}/kms_decryption.py invalidate-cache \
+        --cache-file ${AIRFLOW_BREEZE_SECRET_CACHE_FILE}
+    python3 ${MY_DIR}/secrets_agent.py stop --config-dir ${GCP_CONFIG_DIR} \
+        --gcp-project-id ${AIRFLOW_BREEZE_PROJECT_ID}
+fi
+
+if [[ ${SECRETS_AGENT} == "true" ]]; then
+    python3 ${MY_DIR}/secrets_agent.py start --config-dir ${GCP_CONFIG_DIR} \
+        --gcp-project-id ${AIRFLOW_BREEZE_PROJECT_ID}
+fi
+
 if [[ ${RECREATE_GCP_PROJECT} == "true" ]]; then
     echo && echo "Reconfiguring project in GCP" && echo &&
-    (set -a && source "${GCP_CONFIG_DIR}/variables.env" && set +a && \
-        python3 ${MY_DIR}/bootstrap/_bootstrap_airflow_breeze_config.py \
+    python3 ${MY_DIR}/bootstrap/_bootstrap_airflow_breeze_config.py \
        --gcp-project-id ${AIRFLOW_BREEZE_PROJECT_ID} \
        --workspace ${AIRFLOW_BREEZE_WORKSPACE_DIR}   \
-       --recreate-project )
+       --recreate-project
     decrypt_all_files
     decrypt_all_variables
 elif [[ ${RECONFIGURE_GCP_PROJECT} == "true" ]]; then
     echo && echo "Reconfiguring project in GCP with new secrets and services" && echo &&
-    (set -a && source "${GCP_CONFIG_DIR}/variables.env" && set +a && \
-        python3 ${MY_DIR}/bootstrap/_bootstrap_airflow_breeze_config.py \
+    python3 ${MY_DIR}/bootstrap/_bootstrap_airflow_breeze_config.py \
        --gcp-project-id ${AIRFLOW_BREEZE_PROJECT_ID} \
-       --workspace ${AIRFLOW_BREEZE_WORKSPACE_DIR}  )
+       --workspace ${AIRFLOW_BREEZE_WORKSPACE_DIR}
     decrypt_all_files
     decrypt_all_variables
 elif [[ ${COMPARE_BOOTSTRAP_CONFIG} == "true" ]]; then
- (set -a && source "${GCP_CONFIG_DIR}/variables.env" &&
-     source "${GCP_CONFIG_DIR}/decrypted_variables.env" &&
-     set +a &&
-     ${MY_DIR}/compare_workspace_with_bootstrap.py)
+ python3 ${MY_DIR}/secrets_agent.py run --config-dir ${GCP_CONFIG_DIR} \
+     --gcp-project-id ${AIRFLOW_BREEZE_PROJECT_ID} -- \
+     ${MY_DIR}/compare_workspace_with_bootstrap.py
 fi
 if [[ ${INITIALIZE_LOCAL_VIRTUALENV} == "true" ]]; then
    # Check if we are in virtualenv
@@ -883,10 +907,9 @@ if [[ ${RUN_DOCKER} == "true" ]]; then
     echo " Comparing your current configuration with bootstrap configuration"
     echo
     set +e
-    (set -a && source "${GCP_CONFIG_DIR}/variables.env" &&
-     source "${GCP_CONFIG_DIR}/decrypted_variables.env" &&
-     set +a &&
-     ${MY_DIR}/compare_workspace_with_bootstrap.py)
+    python3 ${MY_DIR}/secrets_agent.py run --config-dir ${GCP_CONFIG_DIR} \
+     --gcp-project-id ${AIRFLOW_BREEZE_PROJECT_ID} -- \
+     ${MY_DIR}/compare_workspace_with_bootstrap.py
     RES=$?
     set -e
     if [[ ${RES} != 0 ]]; then
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Serves the variables of a workspace with the *_ENCRYPTED values decrypted.
+
+The agent is an opt-in process per workspace config directory. It decrypts the
+values once, keeps them in memory and answers over a Unix domain socket which
+only the owner can use. The socket is in $XDG_RUNTIME_DIR or in the workspace
+and clients only connect when its directory is private to the user (owned by
+them with mode 0700) and the agent runs as the same user. Changes of
+variables.env and of the encrypted files are picked up on the next request
+(the encrypted files are decrypted again as well).
+
+Clients (get_variables) fall back to loading and decrypting the variables
+themselves when the agent is not running.
+
+The protocol is one JSON request line, answered with 'OK' or 'ERROR' line
+followed by the payload. The environment of 'get' only has the variables
+referenced in variables.env and the *_ENCRYPTED ones:
+
+  {"command": "get", "format": "env", "scope": "all", "environment": {...}}
+  {"command": "ping"}
+  {"command": "stop"}
+"""
+import argparse
+import errno
+import hashlib
+import json
+import os
+import re
+import shlex
+import socket
+import socketserver
+import stat
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from decrypt_files import DecryptedFilesManifest, MANIFEST_FILE_NAME, decrypt_files, \
+    find_encrypted_files
+from kms_decryption import ENCRYPTED_SUFFIX, SECRET_CACHE_FILE_NAME, DecryptedSecretCache, \
+    decrypt_values, get_int_environment_variable, get_kms_backend
+from variables_env import load_variables_env
+
+FORMATS = ['env', 'export', 'json', 'docker']
+SCOPES = ['all', 'decrypted']
+
+SOCKET_ENV_VARIABLE = 'AIRFLOW_BREEZE_SECRETS_AGENT_SOCKET'
+# The agent exits (forgetting the secrets) when it is not used for that long.
+# Overridden with AIRFLOW_BREEZE_SECRETS_AGENT_IDLE_TIMEOUT.
+DEFAULT_IDLE_TIMEOUT = 14400
+CONNECT_TIMEOUT = 0.5
+# Reloading after a change may need to decrypt all values again
+RESPONSE_TIMEOUT = 120
+START_TIMEOUT = 10
+SOCKET_DIR_NAME = '.secrets-agent'
+# Variables of the environment of the client referenced by variables.env
+REFERENCE_PATTERN = re.compile(r'\$\{?([A-Za-z_][A-Za-z0-9_]*)')
+# Sent to the agent in case variables.env has to be sourced with bash
+CLIENT_ENVIRONMENT_NAMES = ['HOME', 'PATH']
+
+
+class SecretsAgentException(Exception):
+    """Raised when the agent answers a request with an error."""
+
+
+def get_socket_path(config_dir):
+    """Returns socket of the agent of config_dir, in a directory private to the user.
+
+    The directory is airflow-breeze in $XDG_RUNTIME_DIR or .secrets-agent in the
+    workspace (the parent of config_dir) if XDG_RUNTIME_DIR is not set.
+    """
+    if os.environ.get(SOCKET_ENV_VARIABLE):
+        return os.environ[SOCKET_ENV_VARIABLE]
+    config_dir = os.path.abspath(config_dir)
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        socket_dir = os.path.join(os.environ['XDG_RUNTIME_DIR'], 'airflow-breeze')
+    else:
+        socket_dir = os.path.join(os.path.dirname(config_dir), SOCKET_DIR_NAME)
+    # Socket paths are limited to ~100 characters, so the workspace path is hashed
+    name = hashlib.sha1(config_dir.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(socket_dir, 'secrets-{}.sock'.format(name))
+
+
+def check_socket_dir(socket_dir):
+    """Raises SecretsAgentException unless the directory is private to the user.
+
+    Raises OSError if the directory does not exist.
+    """
+    dir_stat = os.lstat(socket_dir)
+    if not stat.S_ISDIR(dir_stat.st_mode) or dir_stat.st_uid != os.getuid() or \
+            stat.S_IMODE(dir_stat.st_mode) != 0o700:
+        raise SecretsAgentException(
+            "Socket directory {} must be a directory owned by uid {} with mode 0700".format(
+                socket_dir, os.getuid()))
+
+
+def get_peer_uid(connection):
+    """Returns uid of the process at the other end of the Unix socket (None if unknown)."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                        struct.calcsize('3i'))
+    _pid, uid, _gid = struct.unpack('3i', credentials)
+    return uid
+
+
+def get_client_environment(variables_file, environment):
+    """Returns the part of the environment needed by the agent to resolve variables_file."""
+    with open(variables_file) as f:
+        names = set(REFERENCE_PATTERN.findall(f.read()))
+    names.update(CLIENT_ENVIRONMENT_NAMES)
+    return {name: value for name, value in environment.items()
+            if name in names or name.endswith(ENCRYPTED_SUFFIX)}
+
+
+def resolve_variables(variables_file, environment, decrypt):
+    """Loads variables_file and decrypts the *_ENCRYPTED values with decrypt(list).
+
+    Returns (names, variables, decrypted names). The names are in the order of
+    the file with each decrypted variable following the encrypted one, then the
+    variables decrypted from *_ENCRYPTED variables of the environment.
+    """
+    assigned_names, variables = load_variables_env(variables_file, environment)
+    encrypted_names = [name for name in assigned_names if name.endswith(ENCRYPTED_SUFFIX)]
+    encrypted_names.extend(sorted(name for name in variables
+                                  if name.endswith(ENCRYPTED_SUFFIX) and
+                                  name not in encrypted_names))
+    decrypted_names = [name[:-len(ENCRYPTED_SUFFIX)] for name in encrypted_names]
+    variables.update(zip(decrypted_names,
+                         decrypt([variables[name] for name in encrypted_names])))
+    names = []
+    for name in assigned_names:
+        names.append(name)
+        if name.endswith(ENCRYPTED_SUFFIX):
+            names.append(name[:-len(ENCRYPTED_SUFFIX)])
+    names.extend(name for name in decrypted_names if name not in names)
+    return list(dict.fromkeys(names)), variables, decrypted_names
+
+
+def format_variables(names, variables, output_format):
+    if output_format == 'json':
+        return json.dumps({name: variables[name] for name in names}, indent=2) + '\n'
+    lines = []
+    for name in names:
+        value = variables[name]
+        if output_format == 'export':
+            lines.append("export {}={}".format(name, shlex.quote(value)))
+            continue
+        # The same as the shell $(...) substitution used to decrypt the values
+        value = value.rstrip('\n')
+        if output_format == 'docker' and '\n' in value:
+            # docker --env-file takes the rest of the line literally
+            sys.stderr.write("Skipping multi-line variable {} in docker env file\n".format(
+                name))
+            continue
+        lines.append("{}={}".format(name, value))
+    return ''.join(line + '\n' for line in lines)
+
+
+def _select(names, decrypted_names, scope):
+    return decrypted_names if scope == 'decrypted' else names
+
+
+def _decrypt_directly(project_id, keys_dir):
+    backend = get_kms_backend(project_id)
+    cache = DecryptedSecretCache(os.path.join(keys_dir, SECRET_CACHE_FILE_NAME))
+
+    def decrypt(encoded_values):
+        values = decrypt_values(backend, encoded_values, cache=cache)
+        cache.print_statistics()
+        return values
+    return decrypt
+
+
+class SecretsAgent(object):
+    """Decrypted values of the workspace config, reloaded when the files change."""
+
+    def __init__(self, config_dir, project_id, environment=None):
+        self.config_dir = config_dir
+        self.keys_dir = os.path.join(config_dir, 'keys')
+        self.notifications_dir = os.path.join(config_dir, 'notifications')
+        self.variables_file = os.path.join(config_dir, 'variables.env')
+        self.environment = dict(os.environ if environment is None else environment)
+        self.backend = get_kms_backend(project_id)
+        self.cache = DecryptedSecretCache(os.path.join(self.keys_dir, SECRET_CACHE_FILE_NAME))
+        self.reloads = 0
+        self._decrypted = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _get_signature(self):
+        signature = []
+        for path in [self.variables_file] + find_encrypted_files(self.keys_dir,
+                                                                 self.notifications_dir):
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return signature
+
+    def _decrypt(self, encoded_values):
+        missing = [value for value in dict.fromkeys(encoded_values)
+                   if value not in self._decrypted]
+        if missing:
+            self._decrypted.update(zip(missing, decrypt_values(self.backend, missing,
+                                                               cache=self.cache)))
+        return [self._decrypted[value] for value in encoded_values]
+
+    def reload_if_changed(self):
+        with self._lock:
+            signature = self._get_signature()
+            if signature == self._signature:
+                return False
+            decrypted_files, _ = decrypt_files(
+                self.backend, find_encrypted_files(self.keys_dir, self.notifications_dir),
+                DecryptedFilesManifest(os.path.join(self.keys_dir, MANIFEST_FILE_NAME)))
+            for decrypted_file in decrypted_files:
+                print("Decrypted {}".format(decrypted_file))
+            # Values which are no longer used are forgotten
+            self._decrypted = {}
+            resolve_variables(self.variables_file, self.environment, self._decrypt)
+            self._signature = signature
+            self.reloads += 1
+            print("Loaded {} ({} encrypted values)".format(self.variables_file,
+                                                          len(self._decrypted)))
+            sys.stdout.flush()
+            return True
+
+    def get_variables(self, environment=None):
+        """Returns the same as resolve_variables, for the environment of the client."""
+        self.reload_if_changed()
+        with self._lock:
+            return resolve_variables(self.variables_file,
+                                     self.environment if environment is None else environment,
+                                     self._decrypt)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        server.last_request = time.time()
+        uid = get_peer_uid(self.request)
+        if uid is not None and uid != os.getuid():
+            self._respond('ERROR', "Only the owner of the agent can use it")
+            return
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            command = request.get('command', 'get')
+            if command == 'ping':
+                self._respond('OK', str(os.getpid()))
+            elif command == 'stop':
+                self._respond('OK', "Stopping")
+                threading.Thread(target=server.shutdown).start()
+            elif command == 'get':
+                output_format = request.get('format', 'env')
+                scope = request.get('scope', 'all')
+                if output_format not in FORMATS or scope not in SCOPES:
+                    raise ValueError("Unknown format {} or scope {}".format(output_format,
+                                                                           scope))
+                names, variables, decrypted_names = server.agent.get_variables(
+                    request.get('environment'))
+                self._respond('OK', format_variables(
+                    _select(names, decrypted_names, scope), variables, output_format))
+            else:
+                raise ValueError("Unknown command {}".format(command))
+        except Exception as e:
+            self._respond('ERROR', str(e))
+
+    def _respond(self, status, payload):
+        self.wfile.write('{}\n{}'.format(status, payload).encode('utf-8'))
+
+
+class _AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(agent, socket_path, idle_timeout=None):
+    if idle_timeout is None:
+        idle_timeout = get_int_environment_variable(
+            'AIRFLOW_BREEZE_SECRETS_AGENT_IDLE_TIMEOUT', DEFAULT_IDLE_TIMEOUT)
+    socket_dir = os.path.dirname(socket_path)
+    if not os.path.isdir(socket_dir):
+        os.makedirs(socket_dir, mode=0o700)
+    check_socket_dir(socket_dir)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    agent.reload_if_changed()
+    previous_umask = os.umask(0o177)
+    try:
+        server = _AgentServer(socket_path, _RequestHandler)
+    finally:
+        os.umask(previous_umask)
+    server.agent = agent
+    server.last_request = time.time()
+
+    def stop_when_idle():
+        while server.last_request + idle_timeout > time.time():
+            time.sleep(min(60, idle_timeout))
+        print("Stopping the agent after {} seconds of inactivity".format(idle_timeout))
+        server.shutdown()
+
+    if idle_timeout > 0:
+        threading.Thread(target=stop_when_idle, daemon=True).start()
+    print("Serving variables of {} on {}".format(agent.config_dir, socket_path))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def request_agent(socket_path, request):
+    """Sends the request to the agent and returns the payload of its answer.
+
+    Raises OSError if the agent is not running and SecretsAgentException if
+    the socket is not private to the user or the agent failed to handle the
+    request.
+    """
+    check_socket_dir(os.path.dirname(socket_path))
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(CONNECT_TIMEOUT)
+        client.connect(socket_path)
+        uid = get_peer_uid(client)
+        if uid is not None and uid != os.getuid():
+            raise SecretsAgentException("Secrets agent on {} runs as uid {}, not {}".format(
+                socket_path, uid, os.getuid()))
+        client.settimeout(RESPONSE_TIMEOUT)
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        chunks = []
+        for chunk in iter(lambda: client.recv(65536), b''):
+            chunks.append(chunk)
+    finally:
+        client.close()
+    status, _, payload = b''.join(chunks).decode('utf-8').partition('\n')
+    if status != 'OK':
+        raise SecretsAgentException("Secrets agent failed: {}".format(payload))
+    return payload
+
+
+def get_variables(config_dir, project_id, environment=None, scope='all'):
+    """Returns (names, variables) from the agent or, if it is not running or fails, decrypted.
+
+    variables contains the whole environment when loaded directly, but only
+    the named variables when served by the agent.
+    """
+    environment = dict(os.environ if environment is None else environment)
+    variables_file = os.path.join(config_dir, 'variables.env')
+    try:
+        payload = request_agent(get_socket_path(config_dir),
+                                dict(command='get', format='json', scope=scope,
+                                     environment=get_client_environment(variables_file,
+                                                                        environment)))
+        variables = json.loads(payload)
+        return list(variables), variables
+    except (OSError, IOError):
+        pass
+    except SecretsAgentException as e:
+        sys.stderr.write("{}. Decrypting the variables directly.\n".format(e))
+    names, variables, decrypted_names = resolve_variables(
+        variables_file, environment,
+        _decrypt_directly(project_id, os.path.join(config_dir, 'keys')))
+    return _select(names, decrypted_names, scope), variables
+
+
+def start_agent(config_dir, project_id, socket_path):
+    """Starts the agent in the background unless it is running already."""
+    try:
+        request_agent(socket_path, dict(command='ping'))
+        print("Secrets agent is already running on {}".format(socket_path))
+        return True
+    except (OSError, IOError):
+        pass
+    socket_dir = os.path.dirname(socket_path)
+    if not os.path.isdir(socket_dir):
+        os.makedirs(socket_dir, mode=0o700)
+    check_socket_dir(socket_dir)
+    log_file = os.path.splitext(socket_path)[0] + '.log'
+    with open(log_file, 'a') as log:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve',
+                          '--config-dir', os.path.abspath(config_dir),
+                          '--gcp-project-id', project_id,
+                          '--socket', socket_path],
+                         stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                         start_new_session=True)
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        try:
+            request_agent(socket_path, dict(command='ping'))
+            print("Secrets agent started on {} (log in {})".format(socket_path, log_file))
+            return True
+        except (OSError, IOError):
+            time.sleep(0.1)
+    print("Secrets agent did not start. See {}".format(log_file))
+    return False
+
+
+# Serves the variables of the workspace or gets them (falling back to decrypting
+# them when the agent is not running):
+#
+#   secrets_agent.py start|stop|serve -c <CONFIG_DIR> -p <PROJECT>
+#   secrets_agent.py get -c <CONFIG_DIR> -p <PROJECT> [--format F] [--scope S]
+#   secrets_agent.py run -c <CONFIG_DIR> -p <PROJECT> -- <COMMAND> [ARGS]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serves decrypted variables of the workspace over a Unix socket.')
+    parser.add_argument('command', choices=['start', 'stop', 'serve', 'get', 'run'])
+    parser.add_argument('--config-dir', '-c', required=True,
+                        help='Config directory of the workspace')
+    parser.add_argument('--gcp-project-id', '-p', required=True, help='GCP project id')
+    parser.add_argument('--socket', '-s', help='Socket of the agent')
+    parser.add_argument('--format', '-f', choices=FORMATS, default='env',
+                        help='Format in which the variables are printed')
+    parser.add_argument('--scope', choices=SCOPES, default='all',
+                        help='All variables or only the decrypted ones')
+    arguments = sys.argv[1:]
+    command_to_run = []
+    if '--' in arguments:
+        command_to_run = arguments[arguments.index('--') + 1:]
+        arguments = arguments[:arguments.index('--')]
+    args = parser.parse_args(arguments)
+
+    agent_socket = args.socket or get_socket_path(args.config_dir)
+    if args.command == 'serve':
+        serve(SecretsAgent(args.config_dir, args.gcp_project_id), agent_socket)
+    elif args.command == 'start':
+        sys.exit(0 if start_agent(args.config_dir, args.gcp_project_id, agent_socket) else 1)
+    elif args.command == 'stop':
+        try:
+            request_agent(agent_socket, dict(command='stop'))
+            print("Stopped secrets agent on {}".format(agent_socket))
+        except (OSError, IOError):
+            print("Secrets agent is not running on {}".format(agent_socket))
+    else:
+        if args.socket:
+            os.environ[SOCKET_ENV_VARIABLE] = args.socket
+        variable_names, all_variables = get_variables(args.config_dir, args.gcp_project_id,
+                                                      scope=args.scope)
+        if args.command == 'run':
+            if not command_to_run:
+                parser.error('Command to run is missing after --')
+            run_environment = dict(os.environ)
+            run_environment.update({name: all_variables[name] for name in variable_names})
+            sys.stdout.flush()
+            os.execvpe(command_to_run[0], command_to_run, run_environment)
+        sys.stdout.write(format_variables(variable_names, all_variables, args.format))
@@ -0,0 +1,75 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Renders the bootstrap TEMPLATE- files.
+
+We do not use Jinja2 or another templating system because we want to make
+bootstrapping works without external dependencies. Also built-in templating
+is not good enough because it uses $variable syntax that would clash with
+Bash substitution we use in a number of places. In order to avoid escaping
+The '$' we use Jinja2 form of template variables '{{ VARIABLE }}' or
+'{{VARIABLE}}'. Note strict single spaces or lack of them!
+"""
+import functools
+import re
+
+PLACEHOLDER_PATTERN = re.compile(r'{{ ([^{}\s]+) }}|{{([^{}\s]+)}}')
+
+
+class CompiledTemplate(object):
+    """Template split once into literal text and placeholder names.
+
+    Rendering costs one dictionary lookup per placeholder, regardless of the
+    number of variables available.
+    """
+
+    def __init__(self, text):
+        self.literals = []
+        self.placeholders = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            self.literals.append(text[position:match.start()])
+            self.placeholders.append((match.group(1) or match.group(2), match.group(0)))
+            position = match.end()
+        self.literals.append(text[position:])
+        self.names = frozenset(name for name, _ in self.placeholders)
+
+    def render(self, variables):
+        """Returns rendered text and sorted names of the unresolved placeholders.
+
+        Unresolved placeholders are left in the text unchanged.
+        """
+        parts = [self.literals[0]]
+        unresolved = set()
+        for (name, placeholder), literal in zip(self.placeholders, self.literals[1:]):
+            value = variables.get(name)
+            if value is None:
+                unresolved.add(name)
+                value = placeholder
+            parts.append(value)
+            parts.append(literal)
+        return ''.join(parts), sorted(unresolved)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_template(text):
+    return CompiledTemplate(text)
+
+
+def render_template(text, variables):
+    """Renders the text, returning it with sorted names of unresolved placeholders."""
+    return compile_template(text).render(variables)
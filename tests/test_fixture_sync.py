@@ -0,0 +1,82 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from os.path import abspath, dirname
+
+sys.path.insert(0, os.path.join(dirname(dirname(abspath(__file__))), 'bootstrap'))
+
+from fixture_sync import DirectoryBucket, build_local_manifest, sync_files  # noqa: E402
+
+ALL_FILES = ['a.txt', 'b.txt', 'c.txt']
+
+
+class IncrementalSyncTest(unittest.TestCase):
+    """Syncs files to directories standing in for two buckets."""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='fixture-sync-')
+        self.files_dir = os.path.join(self.work_dir, 'files')
+        os.makedirs(os.path.join(self.files_dir, 'not-synced-directory'))
+        for name in ALL_FILES:
+            self.write_file(name, name[0].encode('ascii'))
+        self.buckets = [DirectoryBucket(os.path.join(self.work_dir, 'bucket-1')),
+                        DirectoryBucket(os.path.join(self.work_dir, 'bucket-2'))]
+        self.assert_sync_uploads(ALL_FILES, ALL_FILES)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def write_file(self, name, content):
+        with open(os.path.join(self.files_dir, name), 'wb') as f:
+            f.write(content)
+
+    def assert_sync_uploads(self, *expected_uploads):
+        """Syncs the files, expected_uploads are the names uploaded to each bucket."""
+        uploads = sync_files(self.files_dir, self.buckets)
+        for bucket, expected in zip(self.buckets, expected_uploads):
+            self.assertEqual(expected, sorted(uploads[bucket.name]))
+            self.assertEqual(build_local_manifest(self.files_dir), bucket.list_objects())
+
+    def test_unchanged_files_are_not_uploaded(self):
+        self.assert_sync_uploads([], [])
+
+    def test_file_changed_without_changing_size_is_uploaded(self):
+        self.write_file('b.txt', b'B')
+        self.assert_sync_uploads(['b.txt'], ['b.txt'])
+
+    def test_new_file_and_missing_object_are_uploaded(self):
+        self.write_file('d.txt', b'd')
+        os.remove(os.path.join(self.buckets[0].directory, 'a.txt'))
+        self.assert_sync_uploads(['a.txt', 'd.txt'], ['d.txt'])
+
+    def test_listing_passed_in_is_not_listed_again(self):
+        self.write_file('b.txt', b'B')
+        # The stale listing of the first bucket claims b.txt is up to date
+        listing = {self.buckets[0].name: build_local_manifest(self.files_dir)}
+        self.write_file('b.txt', b'b')
+        uploads = sync_files(self.files_dir, self.buckets, remote_objects=listing)
+        self.assertEqual(['b.txt'], uploads[self.buckets[0].name])
+        self.assertEqual([], uploads[self.buckets[1].name])
+
+
+if __name__ == '__main__':
+    unittest.main()
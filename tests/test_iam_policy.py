@@ -0,0 +1,113 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from os.path import abspath, dirname
+from unittest import mock
+
+sys.path.insert(0, os.path.join(dirname(dirname(abspath(__file__))), 'bootstrap'))
+
+from iam_policy import EtagConflictException, JsonFileIamPolicyBackend, \
+    apply_bindings, find_missing_bindings, is_conflict_error  # noqa: E402
+
+WRITERS = 4
+
+
+def get_bindings(writer):
+    member = 'serviceAccount:writer-{}@example.iam.gserviceaccount.com'.format(writer)
+    return [('roles/viewer', member), ('roles/writer-{}'.format(writer), member)]
+
+
+class IsConflictErrorTest(unittest.TestCase):
+    def test_aborted_status_is_conflict(self):
+        self.assertTrue(is_conflict_error(
+            "ERROR: (gcloud.projects.set-iam-policy) ABORTED: There were concurrent "
+            "policy changes. Please retry the whole read-modify-write with exponential "
+            "backoff.\n"))
+
+    def test_other_errors_mentioning_etag_are_not_conflicts(self):
+        self.assertFalse(is_conflict_error(
+            "ERROR: (gcloud.projects.set-iam-policy) INVALID_ARGUMENT: The etag of "
+            "policy 409 is malformed.\n"))
+
+
+class JsonFileIamPolicyBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='iam-policy-')
+        self.policy_file = os.path.join(self.work_dir, 'policy.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_stale_etag_is_rejected(self):
+        backend = JsonFileIamPolicyBackend(self.policy_file)
+        policy = backend.get_policy()
+        apply_bindings(backend, get_bindings(0))
+        with self.assertRaises(EtagConflictException):
+            backend.set_policy(policy)
+
+    def test_bindings_are_added_once(self):
+        backend = JsonFileIamPolicyBackend(self.policy_file)
+        self.assertEqual(get_bindings(0), apply_bindings(backend, get_bindings(0)))
+        self.assertEqual([], apply_bindings(backend, get_bindings(0)))
+        self.assertEqual(1, backend.writes)
+
+    @mock.patch('iam_policy.time.sleep')
+    def test_concurrent_writers_are_retried_without_losing_bindings(self, _sleep):
+        first_read = threading.Barrier(WRITERS)
+
+        class FirstReadTogetherBackend(JsonFileIamPolicyBackend):
+            """All writers read the policy before any of them writes it."""
+            read = False
+
+            def get_policy(self):
+                policy = super(FirstReadTogetherBackend, self).get_policy()
+                if not self.read:
+                    self.read = True
+                    first_read.wait()
+                return policy
+
+        backends = [FirstReadTogetherBackend(self.policy_file) for _ in range(WRITERS)]
+        errors = []
+
+        def write(writer):
+            try:
+                apply_bindings(backends[writer], get_bindings(writer), max_attempts=WRITERS)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(writer,))
+                   for writer in range(WRITERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual([], find_missing_bindings(
+            JsonFileIamPolicyBackend(self.policy_file).get_policy(),
+            [binding for writer in range(WRITERS) for binding in get_bindings(writer)]))
+        self.assertGreaterEqual(sum(backend.conflicts for backend in backends), WRITERS - 1)
+        self.assertEqual(WRITERS, sum(backend.writes for backend in backends))
+
+
+if __name__ == '__main__':
+    unittest.main()
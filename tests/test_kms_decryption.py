@@ -0,0 +1,91 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import kms_decryption  # noqa: E402
+from decrypt_files import DecryptedFilesManifest, MANIFEST_FILE_NAME, decrypt_files, \
+    find_encrypted_files  # noqa: E402
+from kms_decryption import EnvelopeBackend, LocalKeyBackend, WRAPPED_DATA_KEY_FILE_NAME, \
+    encrypt_files, is_envelope  # noqa: E402
+
+KEY_CONTENT = b'{"type": "service_account"}'
+NOTIFICATION_CONTENT = b'SLACK_HOOK: https://hooks.example.com/round-trip\n'
+
+
+@unittest.skipIf(kms_decryption.AESGCM is None, 'The envelope format needs cryptography')
+class EnvelopeRoundTripTest(unittest.TestCase):
+    """Files encrypted as encrypt-files does it, with LocalKeyBackend instead of KMS."""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='kms-round-trip-')
+        self.keys_dir = os.path.join(self.work_dir, 'keys')
+        self.notifications_dir = os.path.join(self.work_dir, 'notifications')
+        os.makedirs(self.keys_dir)
+        os.makedirs(os.path.join(self.notifications_dir, 'slack'))
+        self.key_file = os.path.join(self.keys_dir, 'gcp_round_trip.json')
+        self.notification_file = os.path.join(self.notifications_dir, 'slack',
+                                              'secret.variables.yaml')
+        self.contents = {self.key_file: KEY_CONTENT,
+                         self.notification_file: NOTIFICATION_CONTENT}
+        for file, content in self.contents.items():
+            with open(file, 'wb') as f:
+                f.write(content)
+        self.kms_key = LocalKeyBackend(os.urandom(32))
+        self.wrapped_key_file = os.path.join(self.keys_dir, WRAPPED_DATA_KEY_FILE_NAME)
+        encrypt_files(self.get_envelope_backend(), sorted(self.contents))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def get_envelope_backend(self):
+        return EnvelopeBackend(self.kms_key, wrapped_key_file=self.wrapped_key_file)
+
+    def read_ciphertext(self, file):
+        with open(file + '.enc', 'rb') as f:
+            return f.read()
+
+    def test_key_file_is_encrypted_with_envelope_format(self):
+        self.assertTrue(is_envelope(self.read_ciphertext(self.key_file)))
+
+    def test_notification_secret_can_be_decrypted_with_kms_key_only(self):
+        ciphertext = self.read_ciphertext(self.notification_file)
+        self.assertFalse(is_envelope(ciphertext))
+        self.assertEqual(NOTIFICATION_CONTENT, self.kms_key.decrypt(ciphertext))
+
+    def test_decrypt_files_restores_all_files(self):
+        for file in self.contents:
+            os.remove(file)
+        decrypted, _ = decrypt_files(
+            self.get_envelope_backend(),
+            find_encrypted_files(self.keys_dir, self.notifications_dir),
+            DecryptedFilesManifest(os.path.join(self.keys_dir, MANIFEST_FILE_NAME)))
+        self.assertEqual(sorted(file + '.enc' for file in self.contents), sorted(decrypted))
+        for file, content in self.contents.items():
+            with open(file, 'rb') as f:
+                self.assertEqual(content, f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from os.path import abspath, dirname
+
+sys.path.insert(0, os.path.join(dirname(dirname(abspath(__file__))), 'cloudbuild', 'scripts'))
+
+from log_archive import extract, get_index_file, pack  # noqa: E402
+
+
+class ExtractTest(unittest.TestCase):
+    """Packs a small tree and extracts it, also with a tampered index."""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='log-archive-')
+        self.logs_dir = os.path.join(self.work_dir, 'logs')
+        os.makedirs(os.path.join(self.logs_dir, 'dag', 'task'))
+        with open(os.path.join(self.logs_dir, 'dag', 'task', '1.log'), 'w') as f:
+            f.write('log')
+        self.archive_file = os.path.join(self.work_dir, 'logs.gz')
+        pack(self.archive_file, [('', self.logs_dir)])
+        self.destination_dir = os.path.join(self.work_dir, 'extracted')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def rename_in_index(self, path):
+        with open(get_index_file(self.archive_file)) as f:
+            index = json.load(f)
+        index['files'] = {path: entry for entry in index['files'].values()}
+        with open(get_index_file(self.archive_file), 'w') as f:
+            json.dump(index, f)
+
+    def test_extracts_files(self):
+        self.assertEqual(1, extract(self.archive_file, self.destination_dir))
+        with open(os.path.join(self.destination_dir, 'dag', 'task', '1.log')) as f:
+            self.assertEqual('log', f.read())
+
+    def test_rejects_paths_outside_of_destination(self):
+        for path in ['../escaped.log', 'dag/../../escaped.log',
+                     os.path.join(self.work_dir, 'escaped.log')]:
+            self.rename_in_index(path)
+            with self.assertRaises(Exception):
+                extract(self.archive_file, self.destination_dir)
+        self.assertFalse(os.path.exists(os.path.join(self.work_dir, 'escaped.log')))
+        self.assertFalse(os.path.exists(self.destination_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,292 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Loads variables.env without sourcing it in bash.
+
+The file is a bash script sourced with 'set -a'. This module evaluates the subset
+of bash it uses - assignments (optionally prefixed with 'export'), comments,
+single/double quoting, backslash escapes and $VAR, ${VAR}, ${VAR:=default},
+${VAR:-default}, ${VAR:+value} and ${VAR:offset:length} expansions. Any other
+construct (command substitution, commands, arithmetic ...) makes the loader fall
+back to sourcing the file with bash.
+"""
+import argparse
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+
+NAME_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+ASSIGNMENT_PATTERN = re.compile(r'^\s*(?:export\s+)?([A-Za-z_][A-Za-z0-9_]*)=', re.MULTILINE)
+SUBSTRING_PATTERN = re.compile(r'^\s*(-?\d+)\s*(?::\s*(-?\d+)\s*)?$')
+
+BLANKS = ' \t'
+UNSUPPORTED_UNQUOTED_CHARACTERS = ';&|<>()`'
+
+
+class UnsupportedSyntaxError(Exception):
+    """Raised for shell constructs which only bash can evaluate."""
+
+
+class _VariablesEnvParser(object):
+    def __init__(self, text, environment):
+        self.text = text
+        self.pos = 0
+        self.environment = environment
+
+    def _peek(self, offset=0):
+        pos = self.pos + offset
+        return self.text[pos] if pos < len(self.text) else None
+
+    def _fail(self, message):
+        line = self.text.count('\n', 0, self.pos) + 1
+        raise UnsupportedSyntaxError("{} in line {}".format(message, line))
+
+    def _skip_blanks(self):
+        while self._peek() is not None and self._peek() in BLANKS:
+            self.pos += 1
+
+    def _skip_comment(self):
+        end = self.text.find('\n', self.pos)
+        self.pos = len(self.text) if end == -1 else end
+
+    def parse(self):
+        names = []
+        while self.pos < len(self.text):
+            self._skip_blanks()
+            char = self._peek()
+            if char is None:
+                break
+            if char == '\n':
+                self.pos += 1
+                continue
+            if char == '#':
+                self._skip_comment()
+                continue
+            if self.text.startswith('export', self.pos) and self._peek(6) in list(BLANKS):
+                self.pos += 6
+                self._skip_blanks()
+            match = NAME_PATTERN.match(self.text, self.pos)
+            if not match or self.text[match.end():match.end() + 1] != '=':
+                self._fail("Not an assignment")
+            self.pos = match.end() + 1
+            value = self._read_word(stop_characters=BLANKS + '\n')
+            self.environment[match.group(0)] = value
+            names.append(match.group(0))
+            self._finish_assignment()
+        return names
+
+    def _finish_assignment(self):
+        self._skip_blanks()
+        char = self._peek()
+        if char == '#':
+            self._skip_comment()
+        elif char is not None and char != '\n':
+            # Several assignments in one line are fine, anything else is a command
+            match = NAME_PATTERN.match(self.text, self.pos)
+            if not match or self.text[match.end():match.end() + 1] != '=':
+                self._fail("Command after assignment")
+
+    def _read_word(self, stop_characters):
+        parts = []
+        start = self.pos
+        while True:
+            char = self._peek()
+            if char is None or char in stop_characters:
+                return ''.join(parts)
+            if char == '\\':
+                escaped = self._peek(1)
+                if escaped is None:
+                    parts.append('\\')
+                elif escaped != '\n':
+                    parts.append(escaped)
+                self.pos += 2
+            elif char == "'":
+                end = self.text.find("'", self.pos + 1)
+                if end == -1:
+                    self._fail("Unterminated single quote")
+                parts.append(self.text[self.pos + 1:end])
+                self.pos = end + 1
+            elif char == '"':
+                parts.append(self._read_double_quoted())
+            elif char == '$':
+                parts.append(self._expand_parameter())
+            elif char in UNSUPPORTED_UNQUOTED_CHARACTERS or (char == '~' and self.pos == start):
+                self._fail("Unsupported character '{}'".format(char))
+            else:
+                parts.append(char)
+                self.pos += 1
+
+    def _read_double_quoted(self):
+        parts = []
+        self.pos += 1
+        while True:
+            char = self._peek()
+            if char is None:
+                self._fail("Unterminated double quote")
+            if char == '"':
+                self.pos += 1
+                return ''.join(parts)
+            if char == '\\' and self._peek(1) in list('$`"\\\n'):
+                if self._peek(1) != '\n':
+                    parts.append(self._peek(1))
+                self.pos += 2
+            elif char == '$':
+                parts.append(self._expand_parameter())
+            elif char == '`':
+                self._fail("Command substitution")
+            else:
+                parts.append(char)
+                self.pos += 1
+
+    def _expand_parameter(self):
+        char = self._peek(1)
+        if char == '{':
+            self.pos += 2
+            return self._expand_braced_parameter()
+        match = NAME_PATTERN.match(self.text, self.pos + 1)
+        if match:
+            self.pos = match.end()
+            return self.environment.get(match.group(0), '')
+        if char is not None and (char.isdigit() or char in '(@*#?$!-\'"'):
+            self._fail("Unsupported expansion '${}'".format(char))
+        # Lone dollar sign is taken literally
+        self.pos += 1
+        return '$'
+
+    def _expand_braced_parameter(self):
+        match = NAME_PATTERN.match(self.text, self.pos)
+        if not match:
+            self._fail("Unsupported parameter expansion")
+        name = match.group(0)
+        self.pos = match.end()
+        value = self.environment.get(name)
+        char = self._peek()
+        if char == '}':
+            self.pos += 1
+            return value or ''
+        check_null = char == ':'
+        operator = self._peek(1) if check_null else char
+        if operator not in list('-=+?'):
+            if check_null:
+                return self._expand_substring(value or '')
+            self._fail("Unsupported parameter expansion of {}".format(name))
+        self.pos += 2 if check_null else 1
+        word = self._read_word(stop_characters='}')
+        if self._peek() != '}':
+            self._fail("Unterminated parameter expansion of {}".format(name))
+        self.pos += 1
+        is_set = value is not None and (value != '' or not check_null)
+        if operator == '+':
+            return word if is_set else ''
+        if is_set:
+            return value
+        if operator == '?':
+            self._fail("Required variable {} is not set".format(name))
+        if operator == '=':
+            self.environment[name] = word
+        return word
+
+    def _expand_substring(self, value):
+        end = self.text.find('}', self.pos)
+        match = SUBSTRING_PATTERN.match(self.text[self.pos + 1:end]) if end != -1 else None
+        if not match:
+            self._fail("Unsupported parameter expansion")
+        self.pos = end + 1
+        offset = int(match.group(1))
+        if offset < 0:
+            offset += len(value)
+            if offset < 0:
+                return ''
+        if match.group(2) is None:
+            return value[offset:]
+        length = int(match.group(2))
+        return value[offset:offset + length] if length >= 0 else value[offset:length]
+
+
+def parse_variables(text, environment):
+    """Evaluates the assignments in text, updating the environment dictionary.
+
+    Returns names of the assigned variables in the order of the assignments.
+    Raises UnsupportedSyntaxError if text uses constructs not supported here.
+    """
+    return _VariablesEnvParser(text, environment).parse()
+
+
+def _source_with_bash(variables_file, environment):
+    output = subprocess.check_output(
+        ['/bin/bash', '-c', 'set -a && source "$0" && set +a && env -0', variables_file],
+        env=environment).decode('utf-8')
+    sourced_environment = {}
+    for entry in output.split('\0'):
+        if '=' in entry:
+            key, val = entry.split('=', 1)
+            sourced_environment[key] = val
+    with open(variables_file) as f:
+        names = list(dict.fromkeys(ASSIGNMENT_PATTERN.findall(f.read())))
+    return names, sourced_environment
+
+
+def load_variables_env(variables_file, environment=None):
+    """Returns assigned names and the environment as if variables_file was sourced.
+
+    The environment (os.environ by default) is not modified - a copy of it with
+    all variables from the file is returned.
+    """
+    base_environment = dict(os.environ if environment is None else environment)
+    with open(variables_file) as f:
+        text = f.read()
+    loaded_environment = dict(base_environment)
+    try:
+        names = parse_variables(text, loaded_environment)
+    except UnsupportedSyntaxError as e:
+        sys.stderr.write("Sourcing {} with bash: {}\n".format(variables_file, e))
+        names, loaded_environment = _source_with_bash(variables_file, base_environment)
+    return names, loaded_environment
+
+
+# Prints the variables or runs the command with the variables set - the same as
+# 'set -a && source <FILE> && set +a && <COMMAND>' in bash:
+#
+#   variables_env.py <FILE> [--format env|export|json]
+#   variables_env.py <FILE> -- <COMMAND> [ARGS]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Loads variables.env file.')
+    parser.add_argument('variables_file', help='Path to the variables.env file')
+    parser.add_argument('--format', '-f', choices=['env', 'export', 'json'], default='env',
+                        help='Format in which the variables are printed')
+    arguments = sys.argv[1:]
+    command = []
+    if '--' in arguments:
+        command = arguments[arguments.index('--') + 1:]
+        arguments = arguments[:arguments.index('--')]
+    args = parser.parse_args(arguments)
+
+    variable_names, variables = load_variables_env(args.variables_file)
+    if command:
+        sys.stdout.flush()
+        os.execvpe(command[0], command, variables)
+    if args.format == 'json':
+        print(json.dumps({key: variables[key] for key in variable_names}, indent=2))
+    else:
+        for key in variable_names:
+            if args.format == 'export':
+                print("export {}={}".format(key, shlex.quote(variables[key])))
+            else:
+                print("{}={}".format(key, variables[key]))